@@ -0,0 +1,53 @@
+import argparse
+import logging
+from contextlib import nullcontext
+
+from modules import instrumentation
+from modules.batch_runner import FORMATOS, cargar_escenarios, ejecutar_lote
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run PV layout scenarios from a YAML/JSON/CSV file without prompts")
+    parser.add_argument('scenarios', help="Scenario file (.yaml, .yml, .json or .csv)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="Worker processes (0 uses every core, default 1)")
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help="Folder for the summary and the per-scenario outputs")
+    parser.add_argument('-e', '--export', nargs='*', choices=FORMATOS, default=[],
+                        help="Per-scenario outputs to write")
+    parser.add_argument('--cache-dir', default=None,
+                        help="On-disk cache for projected site geometry")
+    parser.add_argument('--summary', default='batch_summary.csv',
+                        help="Summary file name, .csv or .xlsx (default batch_summary.csv)")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Logging level (DEBUG shows per zone and per pitch details)")
+    parser.add_argument('--log-file', default=None, help="Also write the log to this file")
+    parser.add_argument('--metrics', default=None,
+                        help="Write stage timings, counters and peak memory to this JSON file")
+    parser.add_argument('--trace', default=None,
+                        help="Write a Chrome trace (chrome://tracing, Perfetto) to this file")
+    args = parser.parse_args()
+    instrumentation.configurar_logging(args.log_level, args.log_file)
+
+    escenarios = cargar_escenarios(args.scenarios)
+    if not escenarios:
+        logger.warning("No scenarios in %s, nothing to run", args.scenarios)
+        return 0
+    medir = args.metrics or args.trace
+    with instrumentation.instrumentar() if medir else nullcontext() as inst:
+        tabla = ejecutar_lote(escenarios, max_workers=args.workers or None,
+                              output_dir=args.output_dir, formatos=args.export,
+                              cache_dir=args.cache_dir, resumen=args.summary)
+    if args.metrics:
+        inst.exportar_json(args.metrics)
+    if args.trace:
+        inst.exportar_chrome_trace(args.trace)
+    return 0 if (tabla['status'] == 'ok').all() else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
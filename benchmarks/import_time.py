@@ -0,0 +1,92 @@
+"""
+Import time of the layout core and the entry points
+
+Imports each module in a fresh interpreter, keeps the best wall time of a
+few runs and checks it against a budget, and checks that none of the heavy
+I/O and rendering libraries (pandas, geopandas, pyproj, matplotlib, ...)
+is loaded by the import: those belong to the paths that read KML, export or
+draw, and are imported there on first use. Run from the repo root:
+
+    python -m benchmarks.import_time                   # default modules and budget
+    python -m benchmarks.import_time --budget 0.3 -r 5
+    python -m benchmarks.import_time --modules modules.panel_optimizer
+
+Exits with status 1 when a module is over budget or imports a heavy
+library. Like the benchmark baselines, the budget depends on the machine.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Placement core (NumPy and shapely only) and the command-line entry points
+MODULOS = ('modules.panel_optimizer', 'modules.stringing', 'modules.batch_runner',
+           'main', 'batch')
+
+# Libraries only the I/O and render paths may import
+BIBLIOTECAS_PESADAS = ('pandas', 'geopandas', 'pyproj', 'matplotlib', 'openpyxl',
+                       'pyarrow', 'pyogrio', 'yaml')
+
+# Seconds, numpy and shapely included
+PRESUPUESTO_S = 0.5
+
+_SONDA = '''
+import json, sys, time
+inicio = time.perf_counter()
+import {modulo}
+segundos = time.perf_counter() - inicio
+print(json.dumps({{'segundos': segundos,
+                  'pesadas': [m for m in {pesadas!r} if m in sys.modules]}}))
+'''
+
+
+def medir_importacion(modulo, repeticiones=3):
+    """
+    Best import time of a module over fresh interpreters
+
+    Returns:
+        dict: 'segundos' (best run) and 'pesadas', the heavy libraries the
+        import loaded
+    """
+    mejor = None
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', _SONDA.format(modulo=modulo, pesadas=BIBLIOTECAS_PESADAS)],
+            cwd=RAIZ, capture_output=True, text=True, check=True)
+        medida = json.loads(salida.stdout.strip().splitlines()[-1])
+        if mejor is None or medida['segundos'] < mejor['segundos']:
+            mejor = medida
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the layout core")
+    parser.add_argument('--modules', nargs='+', default=MODULOS,
+                        help="Modules to import (default: core and entry points)")
+    parser.add_argument('--budget', type=float, default=PRESUPUESTO_S,
+                        help=f"Seconds allowed per import (default {PRESUPUESTO_S})")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="Fresh interpreters per module, the best time is kept")
+    args = parser.parse_args()
+
+    fallos = 0
+    for modulo in args.modules:
+        medida = medir_importacion(modulo, args.repeat)
+        problemas = []
+        if medida['segundos'] > args.budget:
+            problemas.append(f"over the {args.budget:.3f} s budget")
+        if medida['pesadas']:
+            problemas.append(f"imports {', '.join(medida['pesadas'])}")
+        fallos += bool(problemas)
+        print(f"{modulo:<28} {medida['segundos']:>7.3f} s"
+              + (f"  FAIL: {'; '.join(problemas)}" if problemas else ''))
+    if not fallos:
+        print("Every import is within budget")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
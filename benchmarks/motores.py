@@ -0,0 +1,124 @@
+"""
+Placement engines compared on synthetic sites
+
+Runs optimizar_paneles with each engine ('vectorial', 'scanline',
+'raster') on the same synthetic site, for one pitch and for a pitch
+sweep, each run in a fresh process so its peak resident memory is its
+own. Reports the wall time, the peak memory, the table count and the
+speed-up over the exact 'vectorial' engine. Run from the repo root:
+
+    python -m benchmarks.motores                                  # 1000 ha, 300 restricted zones
+    python -m benchmarks.motores --sizes 1000 5000 --restricted 300
+    python -m benchmarks.motores --engines vectorial raster -o motores.json
+
+The table counts of 'raster' (refined) and 'vectorial' must match; the run
+exits with status 1 when they do not.
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from modules.instrumentation import _memoria_pico_mb
+
+TAMANOS_HA = (1000,)
+
+MOTORES = ('vectorial', 'scanline', 'raster')
+
+# (name, pitch_min, pitch_max, pitch_step)
+BARRIDOS = (
+    ('un_pitch', 4.0, 4.0, 1.0),
+    ('barrido_2_6', 2.0, 6.0, 0.5),
+)
+
+PARAMETROS = {
+    'module_id': 2,
+    'panels_x_module': 28,
+    'modulos_entre_calles': 30,
+    'ancho_calle': 8,
+    'fenced_distance': 10,
+}
+
+
+def _ejecutar(hectareas, n_restringidas, motor, barrido, cola):
+    """One optimization in this (fresh) process; puts its measures on cola"""
+    from benchmarks.sitios import generar_sitio
+    from modules.data_loader import ModuleCatalog
+    from modules.panel_optimizer import optimizar_paneles
+
+    zonas_habilitadas, zonas_inhabilitadas = generar_sitio(hectareas, n_restringidas)
+    module_specs = ModuleCatalog.cargar().por_id(PARAMETROS['module_id'])
+    memoria_base = _memoria_pico_mb()
+    _, pitch_min, pitch_max, pitch_step = barrido
+    inicio = time.perf_counter()
+    resultado = optimizar_paneles(
+        zonas_habilitadas, zonas_inhabilitadas, module_specs, PARAMETROS['panels_x_module'],
+        pitch_min, pitch_max, pitch_step,
+        modulos_entre_calles=PARAMETROS['modulos_entre_calles'],
+        ancho_calle=PARAMETROS['ancho_calle'], fenced_distance=PARAMETROS['fenced_distance'],
+        motor=motor)
+    segundos = time.perf_counter() - inicio
+    cola.put({'segundos': round(segundos, 3), 'tablas': int(resultado[1]),
+              'pitch': resultado[3], 'memoria_pico_mb': _memoria_pico_mb(),
+              'memoria_base_mb': memoria_base})
+
+
+def medir_motor(hectareas, n_restringidas, motor, barrido):
+    """
+    Time and peak memory of one engine on one sweep, in a fresh process
+
+    Returns:
+        dict: Site size, engine, sweep, seconds, tables, chosen pitch and
+        peak resident memory (total and before the optimization) in MB
+    """
+    contexto = multiprocessing.get_context('spawn')
+    cola = contexto.Queue()
+    proceso = contexto.Process(target=_ejecutar,
+                               args=(hectareas, n_restringidas, motor, barrido, cola))
+    proceso.start()
+    medida = cola.get()
+    proceso.join()
+    return {'hectareas': hectareas, 'restringidas': n_restringidas, 'motor': motor,
+            'barrido': barrido[0], **medida}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the placement engines")
+    parser.add_argument('--sizes', type=float, nargs='+', default=TAMANOS_HA,
+                        help="Site sizes in hectares")
+    parser.add_argument('--restricted', type=int, default=300,
+                        help="Restricted zones per site")
+    parser.add_argument('--engines', nargs='+', default=MOTORES, choices=MOTORES)
+    parser.add_argument('-o', '--output', help="Write the measures to this JSON file")
+    args = parser.parse_args()
+
+    filas = []
+    discrepancias = 0
+    for hectareas in args.sizes:
+        for barrido in BARRIDOS:
+            referencia = None
+            for motor in args.engines:
+                fila = medir_motor(hectareas, args.restricted, motor, barrido)
+                if motor == 'vectorial':
+                    referencia = fila
+                aceleracion = (referencia['segundos'] / fila['segundos']
+                               if referencia is not None else None)
+                fila['aceleracion'] = round(aceleracion, 2) if aceleracion else None
+                distinto = (motor == 'raster' and referencia is not None
+                            and fila['tablas'] != referencia['tablas'])
+                discrepancias += distinto
+                filas.append(fila)
+                print(f"{hectareas:>6g} ha {barrido[0]:<12} {motor:<10} "
+                      f"{fila['segundos']:>8.2f} s {fila['memoria_pico_mb'] or 0:>8.0f} MB "
+                      f"{fila['tablas']:>7d} tables"
+                      + (f"  x{aceleracion:.2f} vs vectorial" if aceleracion else '')
+                      + ("  TABLE COUNT DIFFERS" if distinto else ''))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(filas, f, indent=2)
+    return 1 if discrepancias else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Benchmarks of the layout pipeline on synthetic sites
+
+Times cargar_kml, optimizar_paneles (total and per pitch),
+visualizar_paneles (headless) and export_results separately for each site
+size, writes the timings to a JSON file and compares them with a stored
+baseline. Run from the repo root:
+
+    python -m benchmarks.run_benchmarks                      # compare with benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --sizes 10 100 -r 3  # quicker run
+    python -m benchmarks.run_benchmarks --save-baseline      # store this run as the baseline
+
+Exits with status 1 when a stage is slower than the baseline by more than
+--tolerance (relative) and --min-delta seconds (absolute). Baselines are
+machine specific: store one per benchmark machine.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import shapely
+
+from benchmarks.sitios import escribir_kml, generar_sitio
+from modules.data_loader import ModuleCatalog
+from modules.export_results import export_results
+from modules.instrumentation import configurar_logging
+from modules.kml_loader import cargar_kml
+from modules.panel_optimizer import _secuencia_pitch, optimizar_paneles
+from modules.visualizer import visualizar_paneles
+
+RUTA_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+TAMANOS_HA = (10, 100, 1000, 5000)
+
+# Libraries the pipeline imports on first use (see benchmarks/import_time.py).
+# They are loaded before the timed stages, so the first site measures the
+# stage itself and not the import, as before the imports were made lazy.
+IMPORTACIONES_DIFERIDAS = ('geopandas', 'pyproj', 'matplotlib.collections',
+                           'matplotlib.figure', 'matplotlib.patches', 'openpyxl')
+
+# Layout parameters of every benchmark run
+PARAMETROS = {
+    'module_id': 2,
+    'panels_x_module': 28,
+    'pitch_min': 4.0,
+    'pitch_max': 6.0,
+    'pitch_step': 0.5,
+    'modulos_entre_calles': 30,
+    'ancho_calle': 8,
+    'fenced_distance': 10,
+}
+
+
+def _cronometrar(funcion, repeticiones):
+    """Best wall time of `repeticiones` calls, and the last result"""
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def medir_sitio(hectareas, directorio, repeticiones=1, n_restringidas=50):
+    """
+    Time every pipeline stage on one synthetic site
+
+    Returns:
+        list: One dict per stage with the site size, stage and seconds
+    """
+    zonas_habilitadas, zonas_inhabilitadas = generar_sitio(hectareas, n_restringidas)
+    ruta_kml = os.path.join(directorio, f"sitio_{hectareas}ha.kml")
+    escribir_kml(ruta_kml, zonas_habilitadas, zonas_inhabilitadas)
+    p = PARAMETROS
+    module_specs = ModuleCatalog.cargar().por_id(p['module_id'])
+    n_pitches = len(_secuencia_pitch(p['pitch_min'], p['pitch_max'], p['pitch_step']))
+
+    t_carga, (zh, zi) = _cronometrar(
+        lambda: cargar_kml(ruta_kml, output_crs='EPSG:25833'), repeticiones)
+    t_optimizacion, resultado = _cronometrar(
+        lambda: optimizar_paneles(zh, zi, module_specs, p['panels_x_module'], p['pitch_min'],
+                                  p['pitch_max'], p['pitch_step'],
+                                  modulos_entre_calles=p['modulos_entre_calles'],
+                                  ancho_calle=p['ancho_calle'],
+                                  fenced_distance=p['fenced_distance']),
+        repeticiones)
+    layout, total_modulos, total_energia, pitch, calles = resultado
+    extra = {'project_name': f"bench_{hectareas}ha", 'racking': 'FixTilt',
+             'module_model': module_specs['PV Module Model'],
+             'fenced_distance': p['fenced_distance']}
+    t_visualizacion, _ = _cronometrar(
+        lambda: visualizar_paneles(zh, zi, layout, total_modulos, total_energia, module_specs,
+                                   p['panels_x_module'], pitch, proyecto_extra_info=extra,
+                                   calles=calles, mostrar=False,
+                                   salida=os.path.join(directorio, f"bench_{hectareas}ha.png")),
+        repeticiones)
+    t_exportacion, _ = _cronometrar(
+        lambda: export_results(zh, zi, layout, total_modulos, total_energia, module_specs,
+                               p['panels_x_module'], pitch, 'FixTilt', 26,
+                               f"bench_{hectareas}ha", output_dir=directorio),
+        repeticiones)
+
+    comunes = {'hectareas': hectareas, 'tablas': int(total_modulos),
+               'vertices': int(shapely.get_num_coordinates(zh.geometry.values).sum()),
+               'restringidas': len(zi)}
+    return [dict(comunes, etapa=etapa, segundos=round(segundos, 4)) for etapa, segundos in (
+        ('cargar_kml', t_carga),
+        ('optimizar_paneles', t_optimizacion),
+        ('optimizar_paneles_por_pitch', t_optimizacion / n_pitches),
+        ('visualizar_paneles', t_visualizacion),
+        ('export_results', t_exportacion),
+    )]
+
+
+def comparar(resultados, baseline, tolerancia=0.25, delta_minimo=0.05):
+    """
+    Stages slower than the baseline by more than tolerancia (relative) and
+    delta_minimo seconds (absolute)
+
+    Returns:
+        list: One dict per regression
+    """
+    referencia = {(fila['hectareas'], fila['etapa']): fila['segundos']
+                  for fila in baseline['resultados']}
+    regresiones = []
+    for fila in resultados:
+        antes = referencia.get((fila['hectareas'], fila['etapa']))
+        if antes is None:
+            continue
+        ahora = fila['segundos']
+        if ahora > antes * (1 + tolerancia) and ahora - antes > delta_minimo:
+            regresiones.append({'hectareas': fila['hectareas'], 'etapa': fila['etapa'],
+                                'baseline': antes, 'segundos': ahora,
+                                'ratio': round(ahora / antes, 2)})
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PV layout pipeline")
+    parser.add_argument('--sizes', type=float, nargs='+', default=TAMANOS_HA,
+                        help="Site sizes in hectares (default 10 100 1000 5000)")
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help="Runs per stage, the best time is kept")
+    parser.add_argument('--restricted', type=int, default=50,
+                        help="Small restricted zones per site")
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help="JSON results file")
+    parser.add_argument('--baseline', default=RUTA_BASELINE, help="Baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store this run as the baseline instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed relative slowdown (default 0.25)")
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help="Ignore slowdowns below this many seconds")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Show the pipeline output")
+    args = parser.parse_args()
+    configurar_logging('INFO' if args.verbose else 'WARNING')
+
+    for modulo in IMPORTACIONES_DIFERIDAS:
+        importlib.import_module(modulo)
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for hectareas in args.sizes:
+            hectareas = int(hectareas) if float(hectareas).is_integer() else hectareas
+            filas = medir_sitio(hectareas, directorio, args.repeat, args.restricted)
+            for fila in filas:
+                print(f"{hectareas:>8} ha  {fila['etapa']:<28} {fila['segundos']:>9.3f} s"
+                      f"  ({fila['tablas']} tables)")
+            resultados.extend(filas)
+
+    informe = {
+        'meta': {
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'numpy': np.__version__,
+            'shapely': shapely.__version__,
+            'parametros': PARAMETROS,
+            'repeticiones': args.repeat,
+        },
+        'resultados': resultados,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, nothing to compare")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regresiones = comparar(resultados, baseline, args.tolerance, args.min_delta)
+    for r in regresiones:
+        print(f"REGRESSION {r['hectareas']} ha {r['etapa']}: {r['baseline']:.3f} s -> "
+              f"{r['segundos']:.3f} s (x{r['ratio']})")
+    if not regresiones:
+        print("No regressions against the baseline")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Synthetic PV sites for the benchmarks
+
+generar_sitio builds enabled and restricted zones of a given size in a
+projected CRS; escribir_kml writes them as a KML that cargar_kml reads
+like a real site file.
+"""
+from xml.sax.saxutils import escape
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.affinity import scale
+
+from modules.kml_loader import reproyectar
+
+
+def _contorno(rng, radio, n_vertices):
+    """Concave star-shaped outline around the origin"""
+    angulos = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+    radios = radio * rng.uniform(0.55, 1.0, n_vertices)
+    return shapely.Polygon(np.c_[radios * np.cos(angulos), radios * np.sin(angulos)])
+
+
+def generar_sitio(hectareas, n_restringidas=50, huecos=2, multipoligono=True,
+                  n_vertices=60, seed=0, origen=(400_000.0, 5_830_000.0),
+                  crs='EPSG:25833'):
+    """
+    Synthetic site of about `hectareas` enabled area
+
+    Args:
+        hectareas (float): Target enabled area
+        n_restringidas (int): Small restricted zones (poles, trees, ...),
+            plus one long drainage line across the site
+        huecos (int): Holes cut out of the main zone
+        multipoligono (bool): Split the main zone into a MultiPolygon with a
+            corridor and add a second, separate enabled zone
+        n_vertices (int): Vertices of the concave outline
+        seed (int): Random seed, the same arguments give the same site
+        origen (tuple): Site centre in the projected CRS
+
+    Returns:
+        tuple: (enabled zones, restricted zones) GeoDataFrames in crs
+    """
+    rng = np.random.default_rng(seed)
+    principal = _contorno(rng, 1.0, n_vertices)
+    for _ in range(huecos):
+        # Clear of the MultiPolygon corridor along x = 0
+        centro = (rng.choice([-1, 1]) * rng.uniform(0.15, 0.35), rng.uniform(-0.3, 0.3))
+        principal = principal.difference(
+            shapely.Point(centro).buffer(rng.uniform(0.03, 0.08)))
+    zonas = [principal]
+    if multipoligono:
+        zonas[0] = principal.difference(shapely.box(-0.02, -2, 0.02, 2))
+        zonas.append(shapely.affinity.translate(_contorno(rng, 0.35, n_vertices // 2), 1.5, 0))
+
+    # Scale the unit-sized site to the target area
+    factor = np.sqrt(hectareas * 10_000 / sum(zona.area for zona in zonas))
+    zonas = [shapely.affinity.translate(scale(zona, factor, factor, origin=(0, 0)), *origen)
+             for zona in zonas]
+
+    minx, miny, maxx, maxy = shapely.total_bounds(zonas)
+    puntos = np.c_[rng.uniform(minx, maxx, n_restringidas), rng.uniform(miny, maxy, n_restringidas)]
+    restringidas = list(shapely.buffer(shapely.points(puntos),
+                                       rng.uniform(2, 15, n_restringidas), quad_segs=4))
+    restringidas.append(shapely.LineString([(minx, miny + 0.3 * (maxy - miny)),
+                                            (maxx, miny + 0.35 * (maxy - miny))]).buffer(1.5))
+
+    zonas_habilitadas = gpd.GeoDataFrame({'Name': ['enabled'] * len(zonas)},
+                                         geometry=zonas, crs=crs)
+    zonas_inhabilitadas = gpd.GeoDataFrame({'Name': ['restricted'] * len(restringidas)},
+                                           geometry=restringidas, crs=crs)
+    return zonas_habilitadas, zonas_inhabilitadas
+
+
+def _poligono_kml(poligono):
+    def anillo(coords):
+        return ' '.join(f"{x:.9f},{y:.9f},0" for x, y in np.asarray(coords)[:, :2])
+
+    interiores = ''.join(
+        f"<innerBoundaryIs><LinearRing><coordinates>{anillo(r.coords)}</coordinates>"
+        f"</LinearRing></innerBoundaryIs>" for r in poligono.interiors)
+    return (f"<Polygon><outerBoundaryIs><LinearRing><coordinates>{anillo(poligono.exterior.coords)}"
+            f"</coordinates></LinearRing></outerBoundaryIs>{interiores}</Polygon>")
+
+
+def escribir_kml(ruta, zonas_habilitadas, zonas_inhabilitadas):
+    """Write a site as a WGS84 KML with 'enabled' / 'restricted' placemarks"""
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n')
+        for zonas in (zonas_habilitadas, zonas_inhabilitadas):
+            geometrias = reproyectar(zonas.geometry.values, zonas.crs.to_string(), 'EPSG:4326')
+            for nombre, geometria in zip(zonas['Name'], geometrias):
+                partes = shapely.get_parts(geometria)
+                cuerpo = ''.join(_poligono_kml(p) for p in partes)
+                if len(partes) > 1:
+                    cuerpo = f"<MultiGeometry>{cuerpo}</MultiGeometry>"
+                f.write(f"<Placemark><name>{escape(nombre)}</name>{cuerpo}</Placemark>\n")
+        f.write('</Document></kml>\n')
@@ -3,8 +3,12 @@ from modules.data_loader import load_module_data
 from modules.panel_optimizer import optimizar_paneles
 from modules.visualizer import visualizar_paneles
 from modules.export_results import export_results
+from modules.stringing import agrupar_strings
+from modules.instrumentation import configurar_logging
 
 def main():
+    configurar_logging()
+
     # Input parameters
     module_id = float(input("Enter module ID: ")) or '2'
     panels_x_module = int(input("Enter panels per module (per table): ")) or '56'
@@ -25,6 +29,7 @@ def main():
     project_name = input("Enter project name: ") or 'Default'
     racking = input("Enter racking type (Fix Tilt/Tracker): ") or 'FixTilt'
     modules_per_string = int(input("Enter modules per string: ")) or '26'
+    capacidad_bloque_kwp = float(input("Enter inverter block capacity (kWp): ") or '4000')
 
     kml_path = input("Enter KML file path: ") or 'D:\FIDgate\ScopeGis\1\ScopeGis1\data\Zona1.kml'
 
@@ -80,6 +85,15 @@ def main():
         calles=calles
     )
 
+    # Group the tables into strings, combiner boxes and inverter blocks
+    agrupacion = agrupar_strings(
+        lineas_paneles,
+        module_specs,
+        panels_x_module,
+        modules_per_string,
+        capacidad_bloque_kwp=capacidad_bloque_kwp
+    )
+
     # Export results
     export_results(
         zonas_habilitadas,
@@ -92,7 +106,11 @@ def main():
         optimal_pitch,
         racking,
         modules_per_string,
-        project_name
+        project_name,
+        agrupacion=agrupacion,
+        geoparquet=True,
+        flatgeobuf=True,
+        calles=calles
     )
 
 if __name__ == "__main__":
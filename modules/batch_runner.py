@@ -0,0 +1,356 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+from modules import instrumentation
+from modules.data_loader import RUTA_CATALOGO, ModuleCatalog
+from modules.kml_loader import cargar_kml
+from modules.panel_optimizer import OptimizacionCancelada, optimizar_paneles
+from modules.site_cache import firma_archivo
+
+logger = logging.getLogger(__name__)
+
+# Scenario parameters and their defaults, named like the prompts of main.py
+PARAMETROS_POR_DEFECTO = {
+    'name': None,
+    'kml': None,
+    'module_id': None,
+    'catalog': RUTA_CATALOGO,
+    'panels_x_module': 56,
+    'modulos_entre_calles': 30,
+    'ancho_calle': 8,
+    'pitch_min': 2,
+    'pitch_max': 4,
+    'pitch_step': 0.5,
+    'fenced_distance': 10,
+    'racking': 'FixTilt',
+    'modules_per_string': 26,
+    'capacidad_bloque_kwp': 4000,
+    'strings_por_caja': 24,
+    'input_crs': 'EPSG:4326',
+    'output_crs': 'EPSG:25833',
+}
+
+# Optional optimizar_paneles keywords a scenario may set
+OPCIONES_OPTIMIZADOR = ('motor', 'resolucion_raster', 'refinar_raster', 'busqueda',
+                        'tolerancia_pitch', 'angulos', 'desfases_x', 'desfases_y',
+                        'columnas_tesela', 'stream', 'criterio', 'opciones_rendimiento')
+
+# Per-scenario outputs that can be requested
+FORMATOS = ('kmz', 'xlsx', 'png', 'parquet', 'fgb')
+
+
+def cargar_escenarios(ruta):
+    """
+    Read a scenario file
+
+    YAML and JSON files hold either a list of scenarios or a mapping with a
+    'scenarios' list and an optional 'defaults' mapping applied to every
+    scenario. CSV files hold one scenario per row; list values (angulos) are
+    written separated by ';'.
+
+    Returns:
+        list: Scenario dicts with every parameter filled in
+    """
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension in ('.yaml', '.yml'):
+        import yaml
+        with open(ruta, encoding='utf-8') as f:
+            contenido = yaml.safe_load(f) or []
+    elif extension == '.json':
+        with open(ruta, encoding='utf-8') as f:
+            contenido = json.load(f)
+    elif extension == '.csv':
+        import pandas as pd
+        try:
+            df = pd.read_csv(ruta)
+        except pd.errors.EmptyDataError:
+            df = pd.DataFrame()
+        contenido = [{clave: valor for clave, valor in fila.items() if not pd.isna(valor)}
+                     for fila in df.to_dict('records')]
+    else:
+        raise ValueError(f"Unsupported scenario file '{ruta}', expected YAML, JSON or CSV")
+
+    defaults = {}
+    if isinstance(contenido, dict):
+        defaults = contenido.get('defaults') or {}
+        contenido = contenido.get('scenarios') or []
+
+    # Relative KML and catalog paths are taken from the scenario file folder
+    base = os.path.dirname(os.path.abspath(ruta))
+    return [completar_escenario(escenario, base, defaults, f"scenario_{i+1}")
+            for i, escenario in enumerate(contenido)]
+
+
+def completar_escenario(escenario, base='.', defaults=None, nombre='scenario'):
+    """
+    Fill in the defaults of one scenario and resolve its paths
+
+    Args:
+        escenario (dict): Scenario parameters, at least 'kml' and 'module_id'
+        base (str): Folder relative KML and catalog paths are taken from
+        defaults (dict): Values applied before the scenario's own
+        nombre (str): Name used when the scenario has none
+
+    Returns:
+        dict: Scenario with every parameter filled in
+    """
+    escenario = {**PARAMETROS_POR_DEFECTO, **(defaults or {}), **escenario}
+    if escenario['kml'] is None or escenario['module_id'] is None:
+        raise ValueError(f"Scenario '{escenario['name'] or nombre}' needs at least "
+                         f"'kml' and 'module_id'")
+    if escenario['name'] is None:
+        escenario['name'] = nombre
+    for clave in ('kml', 'catalog'):
+        escenario[clave] = os.path.join(base, os.path.expanduser(str(escenario[clave])))
+    if isinstance(escenario.get('angulos'), str):
+        escenario['angulos'] = tuple(float(a) for a in escenario['angulos'].split(';'))
+    return escenario
+
+
+# Sites are loaded once per worker process and shared by its scenarios; the
+# KML (size, mtime) is part of the key, so an edited site is loaded again
+@lru_cache(maxsize=16)
+def _sitio(ruta_kml, input_crs, output_crs, cache_dir, firma):
+    zonas_habilitadas, zonas_inhabilitadas = cargar_kml(
+        ruta_kml, input_crs=input_crs, output_crs=output_crs, cache_dir=cache_dir)
+    if zonas_habilitadas is None or zonas_inhabilitadas is None:
+        raise ValueError(f"Could not load site {ruta_kml}")
+    return zonas_habilitadas, zonas_inhabilitadas
+
+
+# Memos of prepared geometry (see optimizar_paneles), one per site and thread:
+# shapely.prepare and the memoized rotations change the geometry in place,
+# which GEOS does not allow from two threads at once (layout_service)
+_MEMOS = threading.local()
+
+
+def _geometrias_sitio(*sitio):
+    memos = getattr(_MEMOS, 'por_sitio', None)
+    if memos is None:
+        memos = _MEMOS.por_sitio = OrderedDict()
+    memos[sitio] = memos.pop(sitio, None) or {}
+    while len(memos) > _sitio.cache_info().maxsize:
+        memos.popitem(last=False)
+    return memos[sitio]
+
+
+class _MemoEvaluaciones:
+    """
+    Bounded, thread-safe LRU memo of pitch evaluations for the `cache` of
+    optimizar_paneles: the least recently used entries are dropped past
+    `maximo`, so a long-running process (layout_service) does not grow
+    without limit
+    """
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave, defecto=None):
+        with self._lock:
+            if clave not in self._datos:
+                return defecto
+            self._datos.move_to_end(clave)
+            return self._datos[clave]
+
+    def __setitem__(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+# Evaluation summaries kept per process (a few hundred bytes each)
+MAX_EVALUACIONES = 20_000
+
+# Layout evaluations of this worker, reused by scenarios sharing a site
+_EVALUACIONES = _MemoEvaluaciones(MAX_EVALUACIONES)
+
+
+def ejecutar_escenario(escenario, output_dir='.', formatos=(), cache_dir=None, cancelar=None):
+    """
+    Run one scenario: load the site and module, optimize, export
+
+    Errors are caught and reported in the summary row, so one bad scenario
+    does not stop the batch. Scenarios with stream: true pipe the layout
+    batches straight into the KMZ / XLSX exports (see optimizar_paneles),
+    which rules out the png output. Setting the optional cancelar event
+    stops the optimization and reports the scenario as 'cancelled'.
+
+    Returns:
+        dict: Summary row of the scenario
+    """
+    inicio = time.perf_counter()
+    fila = {'name': escenario['name'], 'kml': escenario['kml'],
+            'module_id': escenario['module_id'], 'status': 'ok', 'error': None}
+    try:
+        sitio = (escenario['kml'], escenario['input_crs'], escenario['output_crs'], cache_dir,
+                 firma_archivo(escenario['kml']))
+        zonas_habilitadas, zonas_inhabilitadas = _sitio(*sitio)
+        geometrias = _geometrias_sitio(*sitio)
+        module_specs = ModuleCatalog.cargar(escenario['catalog']).por_id(escenario['module_id'])
+        if module_specs is None:
+            raise ValueError(f"Module with ID {escenario['module_id']} not found")
+
+        opciones = {clave: escenario[clave] for clave in OPCIONES_OPTIMIZADOR
+                    if clave in escenario}
+        if 'angulos' in opciones:
+            opciones['angulos'] = tuple(opciones['angulos'])
+        if opciones.get('criterio', 'capacidad') != 'capacidad':
+            # The yield model follows the scenario's racking unless set
+            opciones['opciones_rendimiento'] = {'racking': escenario['racking'],
+                                                **(opciones.get('opciones_rendimiento') or {})}
+        if opciones.get('stream') and 'png' in formatos:
+            raise ValueError("The png output needs the whole layout, it cannot be streamed")
+        resultado = optimizar_paneles(
+            zonas_habilitadas, zonas_inhabilitadas, module_specs,
+            int(escenario['panels_x_module']), escenario['pitch_min'],
+            escenario['pitch_max'], escenario['pitch_step'],
+            modulos_entre_calles=float(escenario['modulos_entre_calles']),
+            ancho_calle=escenario['ancho_calle'],
+            fenced_distance=escenario['fenced_distance'],
+            cache=_EVALUACIONES, cache_dir=cache_dir, geometrias_preparadas=geometrias,
+            cancelar=cancelar, **opciones)
+        lineas_paneles, total_modulos, total_energia, optimal_pitch, calles = resultado[:5]
+
+        fila.update({
+            'module_model': module_specs['PV Module Model'],
+            'pitch': optimal_pitch,
+            'total_tables': total_modulos,
+            'total_modules': total_modulos * int(escenario['panels_x_module']),
+            'dc_capacity_mwp': total_energia / 1_000_000,
+            'streets': len(calles),
+        })
+
+        # Strings and inverter blocks need the whole layout, not a stream
+        agrupacion = None
+        if not opciones.get('stream'):
+            from modules.stringing import agrupar_strings
+            agrupacion = agrupar_strings(
+                lineas_paneles, module_specs, int(escenario['panels_x_module']),
+                int(escenario['modules_per_string']),
+                capacidad_bloque_kwp=escenario['capacidad_bloque_kwp'],
+                strings_por_caja=int(escenario['strings_por_caja']))
+            fila.update(agrupacion.resumen())
+
+        if formatos:
+            os.makedirs(output_dir, exist_ok=True)
+        geodatos = [formato for formato in ('parquet', 'fgb') if formato in formatos]
+        if 'kmz' in formatos or 'xlsx' in formatos or geodatos:
+            from modules.export_results import export_results
+            archivos = export_results(
+                zonas_habilitadas, zonas_inhabilitadas, lineas_paneles, total_modulos,
+                total_energia, module_specs, int(escenario['panels_x_module']),
+                optimal_pitch, escenario['racking'], escenario['modules_per_string'],
+                escenario['name'], output_dir=output_dir,
+                kmz='kmz' in formatos, excel='xlsx' in formatos, agrupacion=agrupacion,
+                geoparquet='parquet' in geodatos, flatgeobuf='fgb' in geodatos, calles=calles)
+            fila['kmz'], fila['xlsx'] = archivos[:2]
+            # (tables, streets) per GIS format; the row links the tables file
+            fila.update(zip(geodatos, archivos[2::2]))
+        if 'png' in formatos:
+            from modules.visualizer import visualizar_paneles
+            proyecto_extra_info = {
+                'project_name': escenario['name'],
+                'racking': escenario['racking'],
+                'module_model': module_specs['PV Module Model'],
+                'fenced_distance': escenario['fenced_distance'],
+                'modules_per_string': escenario['modules_per_string'],
+            }
+            fila['png'] = visualizar_paneles(
+                zonas_habilitadas, zonas_inhabilitadas, lineas_paneles, total_modulos,
+                total_energia, module_specs, int(escenario['panels_x_module']),
+                optimal_pitch, proyecto_extra_info=proyecto_extra_info, calles=calles,
+                salida=os.path.join(output_dir, f"Layout_{escenario['name']}.png"),
+                mostrar=False)
+    except OptimizacionCancelada:
+        logger.info("Scenario %s cancelled", escenario['name'])
+        fila.update(status='cancelled')
+    except Exception as e:
+        logger.error("Scenario %s failed: %s", escenario['name'], e)
+        fila.update(status='error', error=f"{type(e).__name__}: {e}")
+    fila['seconds'] = round(time.perf_counter() - inicio, 3)
+    return fila
+
+
+def _ejecutar(argumentos, medir=False):
+    """
+    Run one scenario, in a pool worker or inline; with medir=True also
+    return its instrumentation for the parent to merge
+    """
+    if not medir:
+        return ejecutar_escenario(*argumentos), None
+    with instrumentation.capturar() as inst:
+        with inst.etapa('escenario', name=argumentos[0]['name']):
+            fila = ejecutar_escenario(*argumentos)
+    return fila, inst.a_dict()
+
+
+def ejecutar_lote(escenarios, max_workers=1, output_dir='.', formatos=(),
+                  cache_dir=None, resumen='batch_summary.csv'):
+    """
+    Run a list of scenarios and write one summary table
+
+    With max_workers other than 1 the scenarios run on a ProcessPoolExecutor
+    (None uses every core). They are scheduled grouped by site, so a worker
+    tends to get consecutive scenarios of the site it already has loaded;
+    with cache_dir the projected sites are also shared between workers
+    through the on-disk site cache. The summary keeps the scenario order.
+
+    Args:
+        escenarios (list): Scenario dicts, see cargar_escenarios
+        formatos (iterable): Per-scenario outputs among FORMATOS
+        resumen (str): Summary file name in output_dir, CSV or XLSX by
+            extension; None skips writing it
+
+    Returns:
+        pd.DataFrame: One summary row per scenario
+    """
+    formatos = tuple(formatos)
+    desconocidos = set(formatos) - set(FORMATOS)
+    if desconocidos:
+        raise ValueError(f"Unknown output formats {sorted(desconocidos)}, expected {FORMATOS}")
+
+    logger.info("Running %d scenarios", len(escenarios))
+    orden = sorted(range(len(escenarios)),
+                   key=lambda i: (escenarios[i]['kml'], escenarios[i]['input_crs'],
+                                  escenarios[i]['output_crs'], i))
+    argumentos = [(escenarios[i], output_dir, formatos, cache_dir) for i in orden]
+
+    ejecutar = partial(_ejecutar, medir=instrumentation.actual() is not None)
+    if max_workers == 1 or len(escenarios) <= 1:
+        resultados = [ejecutar(a) for a in argumentos]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            resultados = list(executor.map(ejecutar, argumentos))
+
+    filas = [None] * len(escenarios)
+    for i, (fila, metricas) in zip(orden, resultados):
+        filas[i] = fila
+        if metricas is not None:
+            instrumentation.actual().fusionar(metricas)
+    import pandas as pd
+    tabla = pd.DataFrame(filas)
+
+    errores = int((tabla['status'] != 'ok').sum()) if len(tabla) else 0
+    logger.info("Batch complete: %d ok, %d failed", len(tabla) - errores, errores)
+    if resumen:
+        os.makedirs(output_dir, exist_ok=True)
+        ruta = os.path.join(output_dir, resumen)
+        if ruta.lower().endswith('.xlsx'):
+            tabla.to_excel(ruta, index=False)
+        else:
+            tabla.to_csv(ruta, index=False)
+        logger.info("Summary written to %s", ruta)
+    return tabla
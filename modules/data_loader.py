@@ -1,49 +1,194 @@
-import pandas as pd
+import logging
+import os
+import tempfile
+from functools import lru_cache
 
-def load_module_data(module_id):
+import numpy as np
+
+from modules import instrumentation
+from modules.site_cache import firma_archivo
+
+logger = logging.getLogger(__name__)
+
+# Module database shipped with the repo, resolved from the repo root so it does
+# not depend on the working directory (or on a case-insensitive file system)
+RUTA_CATALOGO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'data', 'cec_module_test_fermin.csv')
+
+# Schema metadata key holding the (size, mtime) of the CSV a snapshot was
+# built from
+_CLAVE_ORIGEN = b'csv_firma'
+
+
+class ModuleCatalog:
+    """
+    PV module database indexed by ID and by model name
+
+    The CSV is parsed once into an uncompressed Feather snapshot stored next
+    to it (<csv>.feather); later loads read the snapshot instead of parsing
+    the CSV. The snapshot records the size and modification time of the CSV
+    it was built from and is rebuilt whenever they change, so checking it
+    costs one stat. Lookups go through hashed pandas indexes, so single and
+    bulk lookups do not scan the table.
+
+    Args:
+        ruta_csv (str): Path to the CEC-style module CSV
+        ruta_snapshot (str): Snapshot path (default: ruta_csv + '.feather')
+    """
+
+    def __init__(self, ruta_csv=RUTA_CATALOGO, ruta_snapshot=None):
+        import pandas as pd
+        self.ruta_csv = ruta_csv
+        self.ruta_snapshot = ruta_snapshot or f"{ruta_csv}.feather"
+        self.df = self._cargar()
+
+        # First row wins for duplicated IDs or models, as the former lookup did
+        ids = pd.to_numeric(self.df['ID'], errors='coerce')
+        self._por_id = pd.Series(np.arange(len(self.df)), index=ids)
+        self._por_id = self._por_id[~self._por_id.index.duplicated()]
+        modelos = self.df['Modelo'].astype(str).str.strip().str.lower()
+        self._por_modelo = pd.Series(np.arange(len(self.df)), index=modelos)
+        self._por_modelo = self._por_modelo[~self._por_modelo.index.duplicated()]
+
+    @classmethod
+    def cargar(cls, ruta_csv=RUTA_CATALOGO):
+        """Process-wide catalog for a CSV, loaded on first use"""
+        return _catalogo(os.path.abspath(ruta_csv), firma_archivo(ruta_csv))
+
+    @instrumentation.cronometrado('cargar_catalogo')
+    def _cargar(self):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        origen = ':'.join(map(str, firma_archivo(self.ruta_csv))).encode()
+        try:
+            tabla = feather.read_table(self.ruta_snapshot)
+            if (tabla.schema.metadata or {}).get(_CLAVE_ORIGEN) == origen:
+                return tabla.to_pandas()
+        except (FileNotFoundError, OSError, pa.ArrowInvalid):
+            pass
+
+        df = pd.read_csv(self.ruta_csv)
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+        tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}),
+                                               _CLAVE_ORIGEN: origen})
+        try:
+            directorio = os.path.dirname(os.path.abspath(self.ruta_snapshot))
+            fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+            os.close(fd)
+            try:
+                feather.write_feather(tabla, temporal, compression='uncompressed')
+                os.replace(temporal, self.ruta_snapshot)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+        except OSError as e:
+            # Read-only data directory: keep working from the parsed CSV
+            logger.warning("Could not write the module catalog snapshot: %s", e)
+        return df
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, module_id):
+        return self._posicion_id(module_id) is not None
+
+    def _posicion_id(self, module_id):
+        try:
+            return int(self._por_id[float(module_id)])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _fila(self, posicion):
+        return _especificacion(self.df.iloc[posicion].to_dict())
+
+    def por_id(self, module_id):
+        """
+        Module specifications for an ID
+
+        Returns:
+            dict: Every catalog column plus the 'PV Module Model', 'length',
+            'width' and 'stc' keys, or None if not found
+        """
+        posicion = self._posicion_id(module_id)
+        return None if posicion is None else self._fila(posicion)
+
+    def por_modelo(self, modelo):
+        """Module specifications for a model name (case-insensitive), or None"""
+        posicion = self._por_modelo.get(str(modelo).strip().lower())
+        return None if posicion is None else self._fila(int(posicion))
+
+    def buscar_ids(self, module_ids):
+        """
+        Bulk lookup by ID
+
+        Returns:
+            pd.DataFrame: One catalog row per requested ID, in request order;
+            unknown IDs are dropped
+        """
+        import pandas as pd
+        ids = pd.to_numeric(pd.Series(module_ids), errors='coerce')
+        posiciones = self._por_id.reindex(ids).dropna().astype(int)
+        return self.df.iloc[posiciones.values].reset_index(drop=True)
+
+    def buscar_modelos(self, modelos):
+        """Bulk lookup by model name, same contract as buscar_ids"""
+        import pandas as pd
+        claves = pd.Series(modelos).astype(str).str.strip().str.lower()
+        posiciones = self._por_modelo.reindex(claves).dropna().astype(int)
+        return self.df.iloc[posiciones.values].reset_index(drop=True)
+
+
+@lru_cache(maxsize=8)
+def _catalogo(ruta_csv, firma):
+    return ModuleCatalog(ruta_csv)
+
+
+def _especificacion(fila):
+    """Catalog row as a spec dict with NumPy scalars turned into Python values"""
+    spec = {clave: (valor.item() if isinstance(valor, np.generic) else valor)
+            for clave, valor in fila.items()}
+    spec.update({
+        'PV Module Model': spec['Modelo'],
+        'length': spec['Length'],
+        'width': spec['Width'],
+        'stc': spec['STC'],
+    })
+    return spec
+
+
+def load_module_data(module_id, ruta_csv=RUTA_CATALOGO):
     """
     Load module data from CSV based on module ID
-    
+
     Args:
         module_id (str): Unique identifier for the module
-    
+        ruta_csv (str): Module database (default: the repo's data/ CSV)
+
     Returns:
-        dict: Module specifications or None if not found
+        dict: Module specifications or None if not found. Besides 'PV Module
+        Model', 'length', 'width' and 'stc' it holds every catalog column
+        (V_oc_ref, I_sc_ref, N_s, ...)
     """
-    print(f"\n=== LOADING MODULE DATA FOR ID {module_id} ===")
-    
+    logger.info("Loading module data for ID %s", module_id)
+
     try:
-        # Load CSV file
-        df = pd.read_csv('./Data/cec_module_test_fermin.csv')
-        
-        # Find module by ID
-        module_data = df[df['ID'].astype(float) == module_id]
-
-        
-        if module_data.empty:
-            print(f"ERROR: Module with ID {module_id} not found")
+        module_spec = ModuleCatalog.cargar(ruta_csv).por_id(module_id)
+
+        if module_spec is None:
+            logger.error("Module with ID %s not found", module_id)
             return None
-        
-        # Extract module specifications
-        module_spec = {
-            'PV Module Model': module_data['Modelo'].values[0],
-            'length': module_data['Length'].values[0],
-            'width': module_data['Width'].values[0],
-            'stc': module_data['STC'].values[0]
-        
-        }
-        
-        print("Module data found:")
-        print(f"PV Module Model: {module_spec['PV Module Model']} m" )
-        print(f"Length: {module_spec['length']} m")
-        print(f"Width: {module_spec['width']} m")
-        print(f"STC: {module_spec['stc']} W")
-        
+
+        logger.info("Module data found: %s, %s x %s m, %s W",
+                    module_spec['PV Module Model'], module_spec['length'],
+                    module_spec['width'], module_spec['stc'])
+
         return module_spec
-    
+
     except FileNotFoundError:
-        print("ERROR: CSV file not found")
+        logger.error("CSV file not found: %s", ruta_csv)
         return None
     except Exception as e:
-        print(f"UNEXPECTED ERROR: {e}")
-        return None
\ No newline at end of file
+        logger.exception("Unexpected error loading module data: %s", e)
+        return None
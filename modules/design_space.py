@@ -0,0 +1,137 @@
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from modules import instrumentation
+from modules.data_loader import ModuleCatalog
+from modules.panel_optimizer import (MOTORES, _clave_evaluacion, _evaluar_combinacion,
+                                     _iniciar_worker, _preparar, _preparar_geometria)
+
+logger = logging.getLogger(__name__)
+
+
+def _total_mesas(tarea, geometrias=None, **kwargs):
+    """Table count of one (footprint, street spacing, pitch) evaluation"""
+    dimensiones, modulos_entre_calles, pitch = tarea
+    resultado = _evaluar_combinacion((0, 0.0, 0.0, pitch), geometrias=geometrias,
+                                     dimensiones=dimensiones,
+                                     modulos_entre_calles=modulos_entre_calles, **kwargs)
+    # Only the count crosses the process boundary, not the table arrays
+    resultado.pop('zonas')
+    return resultado
+
+
+def explorar_diseno(zonas_habilitadas, zonas_inhabilitadas, module_ids,
+                    panels_x_module, pitches, modulos_entre_calles=(float('inf'),),
+                    ancho_calle=0, fenced_distance=0, max_workers=1, motor='vectorial',
+                    opciones_motor=None, catalog=None, cache=None, cache_dir=None):
+    """
+    Capacity of every combination of modules, table sizes, pitches and
+    street spacings on one site
+
+    The fenced zones and the restricted union are prepared once for the whole
+    cross-product. Combinations whose tables have the same footprint (module
+    length x module width * panels per table) share one layout per pitch and
+    street spacing; only the capacity differs. With max_workers other than 1
+    the distinct layouts are evaluated on a ProcessPoolExecutor that receives
+    the geometry once per worker.
+
+    Evaluations are memoized in `cache` with the same keys optimizar_paneles
+    uses (unrotated grid, no offset), so one dict can be shared by both.
+
+    Args:
+        module_ids (list): Module IDs of the catalog
+        panels_x_module (list): Panels per table options
+        pitches (list): Pitches to evaluate
+        modulos_entre_calles (list): Tables between streets options
+        catalog (ModuleCatalog): Module catalog (default: the repo's one)
+
+    Returns:
+        pd.DataFrame: One row per (module, panels per table, street spacing,
+        pitch), in that nesting order
+    """
+    if motor not in MOTORES:
+        raise ValueError(f"Unknown placement engine '{motor}', expected one of {sorted(MOTORES)}")
+    logger.info("Starting design space exploration")
+    catalog = catalog or ModuleCatalog.cargar()
+    modulos = []
+    for module_id in module_ids:
+        spec = catalog.por_id(module_id)
+        if spec is None:
+            raise ValueError(f"Module with ID {module_id} not found")
+        # NaN fails the comparison too: a module without dimensions would
+        # otherwise lay out 0 tables
+        if not all(spec[medida] is not None and 0 < spec[medida] < math.inf
+                   for medida in ('length', 'width')):
+            raise ValueError(f"Module with ID {module_id} has no valid length and width "
+                             f"({spec['length']}, {spec['width']})")
+        modulos.append((module_id, spec))
+
+    with instrumentation.etapa('preparar_geometria'):
+        geometria = _preparar_geometria(zonas_habilitadas, zonas_inhabilitadas,
+                                        fenced_distance, cache_dir=cache_dir)
+    geometrias = {0: geometria}
+
+    # Same table dimensions as optimizar_paneles
+    combinaciones = []
+    for module_id, spec in modulos:
+        for paneles in panels_x_module:
+            dimensiones = (spec['length'], spec['width'] * paneles)
+            for entre_calles in modulos_entre_calles:
+                for pitch in pitches:
+                    combinaciones.append((module_id, spec, paneles, dimensiones,
+                                          entre_calles, pitch))
+
+    opciones_motor = dict(opciones_motor or {})
+    clave = {}
+    for _, _, _, dimensiones, entre_calles, pitch in combinaciones:
+        tarea = (dimensiones, entre_calles, pitch)
+        clave[tarea] = _clave_evaluacion(geometria['huella'], dimensiones, entre_calles,
+                                         ancho_calle, motor, opciones_motor or None,
+                                         (0, 0.0, 0.0, pitch))
+    if cache is None:
+        cache = {}
+    pendientes = [tarea for tarea, c in clave.items() if c not in cache]
+    logger.info("%d combinations, %d distinct layouts, %d to evaluate",
+                len(combinaciones), len(clave), len(pendientes))
+
+    evaluar = partial(_total_mesas, ancho_calle=ancho_calle, motor=motor,
+                      opciones_motor=opciones_motor or None,
+                      medir=instrumentation.actual() is not None)
+
+    def guardar(tarea, resultado):
+        metricas = resultado.pop('metricas', None)
+        if metricas is not None:
+            instrumentation.actual().fusionar(metricas)
+        cache[clave[tarea]] = resultado
+
+    if max_workers == 1 or len(pendientes) <= 1:
+        _preparar(geometria)
+        for tarea in pendientes:
+            guardar(tarea, evaluar(tarea, geometrias=geometrias))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_iniciar_worker,
+                                 initargs=(geometrias,)) as executor:
+            for tarea, resultado in zip(pendientes, executor.map(evaluar, pendientes)):
+                guardar(tarea, resultado)
+
+    filas = []
+    for module_id, spec, paneles, dimensiones, entre_calles, pitch in combinaciones:
+        total_mesas = cache[clave[(dimensiones, entre_calles, pitch)]]['total_modules']
+        filas.append({
+            'module_id': module_id,
+            'module_model': spec['PV Module Model'],
+            'panels_x_module': paneles,
+            'table_width': dimensiones[0],
+            'table_length': dimensiones[1],
+            'modulos_entre_calles': entre_calles,
+            'pitch': pitch,
+            'total_tables': total_mesas,
+            'total_modules': total_mesas * paneles,
+            'dc_capacity_mwp': total_mesas * paneles * spec['stc'] / 1_000_000,
+        })
+
+    logger.info("Design space exploration complete")
+    import pandas as pd
+    return pd.DataFrame(filas)
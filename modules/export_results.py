@@ -1,13 +1,33 @@
 # export_results.py
+import contextlib
+import contextvars
+import io
+import json
+import logging
 import os
-import geopandas as gpd
-import pandas as pd
+import queue
 import numpy as np
-from shapely.geometry import LineString, Polygon
-import xml.etree.ElementTree as ET
+import shapely
+from xml.sax.saxutils import escape
 import zipfile
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
+from modules import instrumentation
+from modules.kml_loader import obtener_transformador
+from modules.layout import MESA_DTYPE, Layout
+
+logger = logging.getLogger(__name__)
+
+
+# Rows per Excel sheet (the format's limit), further tables go to 'Tables 2', ...
+MAX_FILAS_EXCEL = 1_048_576
+
+# Per-table attribute columns of the CSV and of the Excel 'Tables' sheet
+COLUMNAS_MESAS = ['Table', 'Zone', 'Column', 'Row', 'X', 'Y', 'Modules', 'Power (Wp)']
+
+
+@instrumentation.cronometrado()
 def export_results(
     zonas_habilitadas,
     zonas_inhabilitadas,
@@ -20,138 +40,629 @@ def export_results(
     racking,
     modules_per_string,
     project_name,
-    input_crs='EPSG:4326'
+    input_crs='EPSG:4326',
+    output_dir='.',
+    kmz=True,
+    excel=True,
+    atributos=False,
+    agrupacion=None,
+    geoparquet=False,
+    flatgeobuf=False,
+    calles=None
 ):
     """
-    Export solar PV layout results to KML/KMZ and Excel
+    Export solar PV layout results to KML/KMZ, Excel and GIS formats
+
+    lineas_paneles is the Layout returned by optimizar_paneles, or the
+    generator of Layout batches of optimizar_paneles(stream=True). The
+    tables are read in a single pass that feeds every output at once, each
+    output written on its own thread so the export takes about as long as
+    its slowest writer: KML placemarks are streamed into the KMZ entry,
+    Excel rows are appended in openpyxl write-only mode and, with
+    atributos=True, one row per table is written to
+    Layout_<project>_tables.csv (and to 'Tables' sheets of the workbook).
+    For a stream the Excel totals are accumulated from the tables written;
+    memory use does not depend on the table count.
+
+    geoparquet and flatgeobuf write one feature per table to
+    Layout_<project>_tables.parquet / .fgb: table id, zone, column, row,
+    centre, modules and power, with the table footprint as geometry in the
+    project CRS, and the streets from `calles` (the street dicts of
+    optimizar_paneles) to Layout_<project>_streets.parquet / .fgb.
+
+    With the AgrupacionElectrica of stringing.agrupar_strings as
+    `agrupacion`, the KML gets 'Inverter Blocks' (block outlines and
+    inverter stations) and 'Combiner Boxes' folders, and the workbook
+    'Inverter Blocks' and 'Combiner Boxes' sheets with the cable estimates,
+    plus a 'Strings' sheet with atributos=True; the GIS tables get the
+    block, combiner box and string of every table.
+
+    Files are written to output_dir; kmz / excel switch each output off, in
+    which case None is returned in its place.
+
+    Returns:
+        tuple: (KMZ file, Excel file), plus the CSV file with atributos=True,
+        then (tables, streets) files for each of geoparquet and flatgeobuf;
+        the streets file is None without calles
     """
-    print("\n=== EXPORTING RESULTS ===")
+    logger.info("Exporting results")
 
     # Suppress UserWarning about geographic CRS
     warnings.filterwarnings('ignore', category=UserWarning)
 
-    # Convert panel lines to polygons
-    panel_polygons = []
-    for line in lineas_paneles:
-        # Approximate panel polygon from line
-        width = module_specs['length']
-        height = module_specs['width'] * panels_x_module
-        panel_poly = Polygon([
-            (line.coords[0][0] - width/2, line.coords[0][1]),
-            (line.coords[0][0] + width/2, line.coords[0][1]),
-            (line.coords[1][0] + width/2, line.coords[1][1]),
-            (line.coords[1][0] - width/2, line.coords[1][1])
-        ])
-        panel_polygons.append(panel_poly)
-
-    # Create GeoDataFrame of panels
-    gdf_panels = gpd.GeoDataFrame(geometry=panel_polygons, crs=zonas_habilitadas.crs)
-
-    # Export KML/KMZ
-    kml_filename = f"Layout_{project_name}.kmz"
-
-    # Temporary files
-    temp_kml = "temp_layout.kml"
-    with zipfile.ZipFile(kml_filename, 'w', zipfile.ZIP_DEFLATED) as kmzfile:
-        # Ensure panels are in WGS84 for KML
-        gdf_panels_wgs84 = gdf_panels.to_crs('EPSG:4326')
-
-        # Create KML content
-        kml_content = create_kml_content(gdf_panels_wgs84, project_name, zonas_habilitadas, zonas_inhabilitadas)
-
-        with open(temp_kml, 'w') as f:
-            f.write(kml_content)
-        kmzfile.write(temp_kml, arcname='doc.kml')
-        os.remove(temp_kml)
-
-    
-    # Export Excel
-    excel_filename = f"Layout_{project_name}_tables.xlsx"
-    
-    # Prepare Excel sheets
-    with pd.ExcelWriter(excel_filename) as writer:
-        # Technology Sheet
-        tech_data = {
-            'Parameter': ['PV Module Model', 'Racking'],
-            'Value': [module_specs.get('model', 'Unknown'), racking]
-        }
-        pd.DataFrame(tech_data).to_excel(writer, sheet_name='Technology', index=False)
-        
-        # Capacity Sheet
-        capacity_data = {
-            'Parameter': [
-                'DC Capacity', 
-                'Module Power', 
-                'Total Module Qty', 
-                'Module Width', 
-                'Module Length'
-            ],
-            'Value': [
-                f"{total_energia/1_000_000:.2f} MWp",
-                f"{module_specs['stc']} Wp",
-                total_modulos * panels_x_module,
-                module_specs['width'],
-                module_specs['length']
-            ]
-        }
-        pd.DataFrame(capacity_data).to_excel(writer, sheet_name='Capacity', index=False)
-        
-        # Assumptions Sheet
-        total_area_ha = zonas_habilitadas.geometry.area.sum() / 10_000
-        structure_conf = "1P" if racking == "Tracker" else "2P"
-        assumptions_data = {
-            'Parameter': [
-                'Fenced Area', 
-                'Pitch', 
-                'Structure Conf.', 
-                'Modules per String', 
-                'Modules per Table', 
-                'Total Table Qty'
-            ],
-            'Value': [
-                f"{total_area_ha:.2f} Ha",
-                pitch,
-                structure_conf,
-                modules_per_string,
-                panels_x_module,
-                total_modulos
-            ]
-        }
-        pd.DataFrame(assumptions_data).to_excel(writer, sheet_name='Assumptions', index=False)
-    
-    print(f"Results exported to {kml_filename} and {excel_filename}")
-    return kml_filename, excel_filename
-
-def create_kml_content(gdf, project_name, zonas_habilitadas, zonas_inhabilitadas):
-    """Create KML content from GeoDataFrame"""
-    kml_template = f'''<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-<Document>
-    <name>{project_name} Layout</name>
-    <Folder>
-        <name>PV Modules</name>
-        {_generate_placemark_elements(gdf)}
-    </Folder>
-</Document>
-</kml>'''
-    return kml_template
-
-def _generate_placemark_elements(gdf):
-    """Generate KML placemark elements"""
-    placemarks = []
-    for idx, row in gdf.iterrows():
-        coords = list(row.geometry.exterior.coords)
-        coord_string = ' '.join([f"{lon},{lat},0" for lon, lat in coords])
-        placemark = f'''
+    def ruta(sufijo):
+        return os.path.join(output_dir, f"Layout_{project_name}{sufijo}")
+
+    kml_filename = ruta('.kmz') if kmz else None
+    excel_filename = ruta('_tables.xlsx') if excel else None
+    csv_filename = ruta('_tables.csv') if atributos else None
+    geodatos = [(extension, clase) for extension, clase, activo in
+                (('.parquet', _EscritorGeoParquet, geoparquet),
+                 ('.fgb', _EscritorFlatGeobuf, flatgeobuf)) if activo]
+    archivos_geo = [(ruta('_tables' + extension),
+                     ruta('_streets' + extension) if calles is not None else None)
+                    for extension, _ in geodatos]
+
+    def resumen_excel(hojas, mesas):
+        modulos, energia = total_modulos, total_energia
+        if not isinstance(lineas_paneles, Layout):
+            modulos = mesas
+            energia = mesas * panels_x_module * module_specs['stc']
+        _write_excel(hojas, zonas_habilitadas, modulos, energia, module_specs,
+                     panels_x_module, pitch, racking, modules_per_string, agrupacion)
+
+    with contextlib.ExitStack() as pila:
+        escritores = []
+        if kmz:
+            kmzfile = pila.enter_context(zipfile.ZipFile(kml_filename, 'w', zipfile.ZIP_DEFLATED))
+            escritores.append(_EscritorKML(pila.enter_context(kmzfile.open('doc.kml', 'w')),
+                                           project_name, zonas_habilitadas, zonas_inhabilitadas,
+                                           agrupacion))
+        if excel:
+            # Sheets in their final order; the summaries are filled in last
+            nombres = ['Technology', 'Capacity', 'Assumptions']
+            if agrupacion is not None:
+                nombres += ['Inverter Blocks', 'Combiner Boxes']
+                if atributos:
+                    nombres.append('Strings')
+            escritores.append(_EscritorExcel(excel_filename, nombres, atributos, resumen_excel))
+        if atributos:
+            escritores.append(_EscritorCSV(pila.enter_context(
+                open(csv_filename, 'w', encoding='utf-8', newline=''))))
+        for (_, clase), (ruta_mesas, ruta_calles) in zip(geodatos, archivos_geo):
+            escritores.append(clase(ruta_mesas, ruta_calles, zonas_habilitadas.crs, calles,
+                                    agrupacion))
+
+        # One pass over the tables, feeding every output
+        with instrumentation.etapa('write_tables'):
+            mesas = _alimentar(escritores, _lotes(lineas_paneles), panels_x_module,
+                               module_specs['stc'])
+        instrumentation.contar('mesas_exportadas', mesas)
+
+    logger.info("Results exported to %s and %s", kml_filename, excel_filename)
+    for ruta_mesas, ruta_calles in archivos_geo:
+        logger.info("GIS tables exported to %s%s", ruta_mesas,
+                    f" and {ruta_calles}" if ruta_calles else '')
+    return ((kml_filename, excel_filename) + ((csv_filename,) if atributos else ())
+            + tuple(archivo for par in archivos_geo for archivo in par))
+
+
+# Batches queued per writer thread ahead of the slowest writer
+LOTES_EN_COLA = 4
+
+
+def _alimentar(escritores, lotes, panels_x_module, stc):
+    """
+    Feed every batch of tables to every writer, each writer consuming its
+    own bounded queue on a thread of its own
+
+    Returns:
+        int: Tables written
+    """
+    colas = [queue.Queue(maxsize=LOTES_EN_COLA) for _ in escritores]
+
+    def trabajar(escritor, cola):
+        pendientes = iter(cola.get, None)
+        try:
+            with instrumentation.etapa(f"write_{escritor.formato}"):
+                escritor.consumir(pendientes, panels_x_module, stc)
+        finally:
+            # A failed writer keeps draining its queue so the others go on
+            for _ in pendientes:
+                pass
+
+    mesas = 0
+    with ThreadPoolExecutor(max_workers=max(1, len(escritores)),
+                            thread_name_prefix='export') as executor:
+        # Writers run in copies of this context, so they report their stages
+        # to the collector of the job
+        futuros = [executor.submit(contextvars.copy_context().run, trabajar, escritor, cola)
+                   for escritor, cola in zip(escritores, colas)]
+        try:
+            for lote in lotes:
+                for cola in colas:
+                    cola.put((lote, mesas + 1))
+                mesas += len(lote)
+        finally:
+            for cola in colas:
+                cola.put(None)
+        for futuro in futuros:
+            futuro.result()
+    return mesas
+
+
+def _lotes(lineas_paneles, tamano=None):
+    """
+    Layouts of at most `tamano` tables (KML_CHUNK_SIZE) from a Layout or an
+    iterable of Layout batches
+    """
+    tamano = tamano or KML_CHUNK_SIZE
+    lotes = [lineas_paneles] if isinstance(lineas_paneles, Layout) else lineas_paneles
+    for lote in lotes:
+        for inicio in range(0, len(lote), tamano):
+            yield Layout(lote.mesas[inicio:inicio + tamano], lote.module_width,
+                         lote.module_length, lote.angulo)
+
+
+def _atributos_mesas(lote, primera, panels_x_module, stc):
+    """(n, 8) array of the COLUMNAS_MESAS values of a batch, indexes from 1"""
+    mesas = lote.mesas
+    n = len(mesas)
+    return np.column_stack([
+        np.arange(primera, primera + n),
+        mesas['zona'] + 1, mesas['columna'] + 1, mesas['fila'] + 1,
+        mesas['x'], mesas['y'],
+        np.full(n, panels_x_module), np.full(n, panels_x_module * stc),
+    ])
+
+
+class _Escritor:
+    """
+    Output written batch by batch: escribir() per batch of tables, then
+    cerrar(); consumir() runs both over an iterable of (batch, first table
+    number) pairs
+    """
+
+    formato = None
+
+    def escribir(self, lote, primera, panels_x_module, stc):
+        raise NotImplementedError
+
+    def cerrar(self):
+        pass
+
+    def consumir(self, lotes, panels_x_module, stc):
+        for lote, primera in lotes:
+            self.escribir(lote, primera, panels_x_module, stc)
+        self.cerrar()
+
+
+class _EscritorCSV(_Escritor):
+    """Per-table attribute CSV, written batch by batch"""
+
+    formato = 'csv'
+    FORMATO = '%d,%d,%d,%d,%.3f,%.3f,%d,%.1f'
+
+    def __init__(self, f):
+        self.f = f
+        self.f.write(','.join(COLUMNAS_MESAS) + '\n')
+
+    def escribir(self, lote, primera, panels_x_module, stc):
+        np.savetxt(self.f, _atributos_mesas(lote, primera, panels_x_module, stc),
+                   fmt=self.FORMATO)
+
+
+class _EscritorHojaMesas(_Escritor):
+    """Per-table rows appended to write-only 'Tables' sheets of a workbook"""
+
+    def __init__(self, libro):
+        self.libro = libro
+        self.hoja = None
+        self.filas = MAX_FILAS_EXCEL
+        self.hojas = 0
+
+    def escribir(self, lote, primera, panels_x_module, stc):
+        valores = _atributos_mesas(lote, primera, panels_x_module, stc)
+        enteros = valores[:, [0, 1, 2, 3, 6]].astype(np.int64).tolist()
+        reales = valores[:, [4, 5, 7]].tolist()
+        for (tabla, zona, columna, fila, modulos), (x, y, potencia) in zip(enteros, reales):
+            if self.filas == MAX_FILAS_EXCEL:
+                self.hojas += 1
+                self.hoja = self.libro.create_sheet(
+                    'Tables' if self.hojas == 1 else f"Tables {self.hojas}")
+                self.hoja.append(COLUMNAS_MESAS)
+                self.filas = 1
+            self.hoja.append([tabla, zona, columna, fila, x, y, modulos, potencia])
+            self.filas += 1
+
+    def cerrar(self):
+        if self.hoja is None:
+            self.libro.create_sheet('Tables').append(COLUMNAS_MESAS)
+
+
+class _EscritorExcel(_Escritor):
+    """
+    Workbook in openpyxl write-only mode: 'Tables' sheets with atributos,
+    then the summary sheets filled by resumen(hojas, tables written) and
+    saved on cerrar()
+    """
+
+    formato = 'xlsx'
+
+    def __init__(self, ruta, nombres, atributos, resumen):
+        from openpyxl import Workbook
+        self.ruta = ruta
+        self.libro = Workbook(write_only=True)
+        self.hojas = {nombre: self.libro.create_sheet(nombre) for nombre in nombres}
+        self.hoja_mesas = _EscritorHojaMesas(self.libro) if atributos else None
+        self.resumen = resumen
+        self.mesas = 0
+
+    def escribir(self, lote, primera, panels_x_module, stc):
+        if self.hoja_mesas is not None:
+            self.hoja_mesas.escribir(lote, primera, panels_x_module, stc)
+        self.mesas += len(lote)
+
+    def cerrar(self):
+        if self.hoja_mesas is not None:
+            self.hoja_mesas.cerrar()
+        self.resumen(self.hojas, self.mesas)
+        self.libro.save(self.ruta)
+
+
+def _registros_mesas(lote, primera, panels_x_module, stc, agrupacion=None):
+    """
+    Arrow record batch of the tables of a batch: attributes with indexes
+    from 1 and the footprint as WKB, built in bulk from the corner arrays
+    """
+    import pyarrow as pa
+    mesas = lote.mesas
+    n = len(mesas)
+    columnas = {
+        'table': np.arange(primera, primera + n, dtype=np.int64),
+        'zone': mesas['zona'] + 1,
+        'column': mesas['columna'] + 1,
+        'row': mesas['fila'] + 1,
+        'x': mesas['x'],
+        'y': mesas['y'],
+        'modules': np.full(n, panels_x_module, dtype=np.int32),
+        'power_wp': np.full(n, panels_x_module * stc, dtype=np.float64),
+    }
+    if agrupacion is not None:
+        asignacion = agrupacion.mesas[primera - 1:primera - 1 + n]
+        for nombre, campo in (('block', 'bloque'), ('combiner_box', 'caja'),
+                              ('string', 'string')):
+            columnas[nombre] = pa.array(asignacion[campo] + 1, mask=asignacion[campo] < 0)
+    columnas['geometry'] = pa.array(shapely.to_wkb(lote.poligonos()), type=pa.binary())
+    return pa.RecordBatch.from_pydict(columnas)
+
+
+def _registros_calles(calles):
+    """Arrow record batch of the street polygons between their two boundaries"""
+    import pyarrow as pa
+    izquierda = shapely.get_coordinates([c['left_boundary'] for c in calles]).reshape(-1, 2, 2)
+    derecha = shapely.get_coordinates([c['right_boundary'] for c in calles]).reshape(-1, 2, 2)
+    poligonos = shapely.polygons(np.concatenate([izquierda, derecha[:, ::-1]], axis=1))
+    return pa.RecordBatch.from_pydict({
+        'street': np.arange(1, len(calles) + 1, dtype=np.int64),
+        'width': np.array([c['width'] for c in calles], dtype=np.float64),
+        'geometry': pa.array(shapely.to_wkb(poligonos), type=pa.binary()),
+    })
+
+
+class _EscritorGeo(_Escritor):
+    """
+    Per-table features (and the streets) in a columnar GIS format; the
+    Arrow schema comes from an empty batch so that an empty layout still
+    gets a valid file
+    """
+
+    def __init__(self, ruta_mesas, ruta_calles, crs, calles, agrupacion=None):
+        self.ruta_mesas = ruta_mesas
+        self.ruta_calles = ruta_calles
+        self.crs = crs
+        self.calles = calles
+        self.agrupacion = agrupacion
+        self.esquema = _registros_mesas(Layout(np.empty(0, dtype=MESA_DTYPE), 1, 1), 1, 0, 0,
+                                        agrupacion).schema
+
+    def registros(self, lote, primera, panels_x_module, stc):
+        return _registros_mesas(lote, primera, panels_x_module, stc, self.agrupacion)
+
+
+class _EscritorGeoParquet(_EscritorGeo):
+    """GeoParquet 1.0 (WKB geometry), one row group per batch"""
+
+    formato = 'parquet'
+
+    def __init__(self, *args, **kwargs):
+        import pyarrow.parquet as pq
+        super().__init__(*args, **kwargs)
+        self.escritor = pq.ParquetWriter(
+            self.ruta_mesas, self.esquema.with_metadata(self._metadatos('Polygon')))
+
+    def _metadatos(self, tipo):
+        geo = {'version': '1.0.0', 'primary_column': 'geometry',
+               'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': [tipo],
+                                        'crs': self.crs.to_json_dict()}}}
+        return {b'geo': json.dumps(geo).encode('utf-8')}
+
+    def escribir(self, lote, primera, panels_x_module, stc):
+        self.escritor.write_batch(self.registros(lote, primera, panels_x_module, stc))
+
+    def cerrar(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.escritor.close()
+        if self.ruta_calles is not None:
+            tabla = pa.Table.from_batches([_registros_calles(self.calles)])
+            pq.write_table(tabla.replace_schema_metadata(self._metadatos('Polygon')),
+                           self.ruta_calles)
+
+
+class _EscritorFlatGeobuf(_EscritorGeo):
+    """FlatGeobuf with its spatial index, the batches streamed through GDAL's Arrow writer"""
+
+    formato = 'fgb'
+
+    def consumir(self, lotes, panels_x_module, stc):
+        import pyarrow as pa
+        from pyogrio.raw import write_arrow
+
+        def escribir(registros, ruta):
+            write_arrow(registros, ruta, driver='FlatGeobuf', geometry_name='geometry',
+                        geometry_type='Polygon', crs=self.crs.to_wkt())
+
+        escribir(pa.RecordBatchReader.from_batches(
+            self.esquema, (self.registros(lote, primera, panels_x_module, stc)
+                           for lote, primera in lotes)), self.ruta_mesas)
+        if self.ruta_calles is not None:
+            escribir(pa.Table.from_batches([_registros_calles(self.calles)]), self.ruta_calles)
+
+
+def _write_excel(hojas, zonas_habilitadas, total_modulos, total_energia,
+                 module_specs, panels_x_module, pitch, racking, modules_per_string,
+                 agrupacion=None):
+    """Fill the Technology, Capacity and Assumptions sheets, and the grouping ones"""
+    def escribir(hoja, parametros, valores):
+        hoja.append(['Parameter', 'Value'])
+        for parametro, valor in zip(parametros, valores):
+            hoja.append([parametro, valor])
+
+    # Technology Sheet
+    escribir(hojas['Technology'],
+             ['PV Module Model', 'Racking'],
+             [module_specs.get('model', 'Unknown'), racking])
+
+    # Capacity Sheet
+    escribir(hojas['Capacity'],
+             [
+                 'DC Capacity',
+                 'Module Power',
+                 'Total Module Qty',
+                 'Module Width',
+                 'Module Length'
+             ],
+             [
+                 f"{total_energia/1_000_000:.2f} MWp",
+                 f"{module_specs['stc']} Wp",
+                 total_modulos * panels_x_module,
+                 module_specs['width'],
+                 module_specs['length']
+             ])
+
+    # Assumptions Sheet
+    total_area_ha = zonas_habilitadas.geometry.area.sum() / 10_000
+    structure_conf = "1P" if racking == "Tracker" else "2P"
+    parametros = [
+        'Fenced Area',
+        'Pitch',
+        'Structure Conf.',
+        'Modules per String',
+        'Modules per Table',
+        'Total Table Qty'
+    ]
+    valores = [
+        f"{total_area_ha:.2f} Ha",
+        pitch,
+        structure_conf,
+        modules_per_string,
+        panels_x_module,
+        total_modulos
+    ]
+    if agrupacion is not None:
+        resumen = agrupacion.resumen()
+        parametros += ['Total String Qty', 'Combiner Box Qty', 'Inverter Block Qty',
+                       'String Cable', 'DC Cable']
+        valores += [resumen['strings'], resumen['combiner_boxes'], resumen['inverter_blocks'],
+                    f"{resumen['string_cable_km']:.2f} km", f"{resumen['dc_cable_km']:.2f} km"]
+    escribir(hojas['Assumptions'], parametros, valores)
+
+    if agrupacion is not None:
+        _write_agrupacion(hojas, agrupacion)
+
+
+def _write_agrupacion(hojas, agrupacion):
+    """Fill the Inverter Blocks, Combiner Boxes and (if present) Strings sheets"""
+    bloques, cajas, strings = agrupacion.bloques, agrupacion.cajas, agrupacion.strings
+
+    hoja = hojas['Inverter Blocks']
+    hoja.append(['Block', 'Tables', 'Strings', 'Combiner Boxes', 'Modules', 'Unstrung Modules',
+                 'DC Capacity (kWp)', 'String Cable (m)', 'DC Cable (m)',
+                 'Inverter X', 'Inverter Y'])
+    for i, b in enumerate(bloques.tolist(), start=1):
+        x, y, mesas, n_strings, n_cajas, modulos, sin_string, kwp, cable_string, cable_dc = b
+        hoja.append([i, mesas, n_strings, n_cajas, modulos, sin_string, round(kwp, 2),
+                     round(cable_string, 1), round(cable_dc, 1), x, y])
+
+    hoja = hojas['Combiner Boxes']
+    hoja.append(['Combiner Box', 'Block', 'Strings', 'X', 'Y', 'DC Cable (m)'])
+    for i, (bloque, n_strings, x, y, cable) in enumerate(cajas.tolist(), start=1):
+        hoja.append([i, bloque + 1, n_strings, x, y, round(cable, 1)])
+
+    if 'Strings' in hojas:
+        hoja = hojas['Strings']
+        hoja.append(['String', 'Block', 'Combiner Box', 'First Table', 'Last Table',
+                     'X', 'Y', 'String Cable (m)'])
+        for i, (bloque, caja, primera, ultima, x, y, cable) in enumerate(strings.tolist(),
+                                                                         start=1):
+            hoja.append([i, bloque + 1, caja + 1, primera + 1, ultima + 1, x, y, round(cable, 1)])
+
+# Placemarks formatted per batch: memory use does not grow with the table count
+KML_CHUNK_SIZE = 5000
+
+_PANEL_PLACEMARK = '''
         <Placemark>
-            <name>Panel {idx+1}</name>
+            <name>Panel %d</name>
             <Polygon>
                 <outerBoundaryIs>
                     <LinearRing>
-                        <coordinates>{coord_string}</coordinates>
+                        <coordinates>''' + ' '.join(['%.8f,%.8f,0'] * 5) + '''</coordinates>
                     </LinearRing>
                 </outerBoundaryIs>
             </Polygon>
         </Placemark>'''
-        placemarks.append(placemark)
-    return ''.join(placemarks)
\ No newline at end of file
+
+
+_POINT_PLACEMARK = '''
+        <Placemark>
+            <name>%s %d</name>
+            <description>%s</description>
+            <Point><coordinates>%.8f,%.8f,0</coordinates></Point>
+        </Placemark>'''
+
+
+class _EscritorKML(_Escritor):
+    """
+    Layout KML streamed into a binary file-like object
+
+    The document header, the zone folders and, given an AgrupacionElectrica,
+    the inverter block and combiner box folders are written on creation,
+    each batch of tables is appended as placemarks and cerrar() closes the
+    document.
+    """
+
+    formato = 'kmz'
+
+    def __init__(self, stream, project_name, zonas_habilitadas, zonas_inhabilitadas,
+                 agrupacion=None):
+        self.stream = stream
+        self.to_wgs84 = obtener_transformador(zonas_habilitadas.crs.to_string(), 'EPSG:4326')
+        self._escribir(f'''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+    <name>{escape(str(project_name))} Layout</name>''')
+
+        for nombre, zonas in (('Enabled Zones', zonas_habilitadas),
+                              ('Restricted Zones', zonas_inhabilitadas)):
+            self._escribir(f'''
+    <Folder>
+        <name>{nombre}</name>''')
+            if not zonas.empty:
+                for i, geometria in enumerate(zonas.geometry.to_crs('EPSG:4326')):
+                    self._escribir(_zone_placemark(f"{nombre[:-1]} {i+1}", geometria))
+            self._escribir('''
+    </Folder>''')
+
+        if agrupacion is not None:
+            self._escribir_agrupacion(agrupacion)
+
+        self._escribir('''
+    <Folder>
+        <name>PV Modules</name>''')
+
+    def _escribir(self, texto):
+        self.stream.write(texto.encode('utf-8'))
+
+    def _puntos(self, nombre, x, y, descripciones):
+        """Point placemarks numbered from 1"""
+        lon, lat = self.to_wgs84.transform(x, y)
+        self._escribir(''.join(
+            _POINT_PLACEMARK % (escape(nombre), i, escape(descripcion), lo, la)
+            for i, (descripcion, lo, la) in enumerate(zip(descripciones, lon, lat), start=1)))
+
+    def _escribir_agrupacion(self, agrupacion):
+        bloques, cajas = agrupacion.bloques, agrupacion.cajas
+        contornos = shapely.transform(
+            agrupacion.contornos(),
+            lambda xy: np.column_stack(self.to_wgs84.transform(xy[:, 0], xy[:, 1])))
+        self._escribir('''
+    <Folder>
+        <name>Inverter Blocks</name>''')
+        for i, contorno in enumerate(contornos, start=1):
+            self._escribir(_zone_placemark(f"Block {i}", contorno))
+        self._puntos('Inverter', bloques['x'], bloques['y'], [
+            f"{kwp:.1f} kWp, {n} strings, {c} combiner boxes"
+            for kwp, n, c in zip(bloques['potencia_kwp'], bloques['strings'], bloques['cajas'])])
+        self._escribir('''
+    </Folder>
+    <Folder>
+        <name>Combiner Boxes</name>''')
+        self._puntos('Combiner Box', cajas['x'], cajas['y'], [
+            f"Block {b + 1}, {n} strings" for b, n in zip(cajas['bloque'], cajas['strings'])])
+        self._escribir('''
+    </Folder>''')
+
+    def escribir(self, lote, primera, *_):
+        """Placemarks of a batch of tables, numbered from `primera`"""
+        esquinas = lote.coordenadas_poligonos()
+        # Closed rings: repeat the first corner
+        anillos = np.concatenate([esquinas, esquinas[:, :1]], axis=1)
+        lon, lat = self.to_wgs84.transform(anillos[..., 0], anillos[..., 1])
+        valores = np.empty((len(lote), 11), dtype=object)
+        valores[:, 0] = np.arange(primera, primera + len(lote))
+        valores[:, 1::2] = lon
+        valores[:, 2::2] = lat
+        self._escribir((_PANEL_PLACEMARK * len(lote)) % tuple(valores.ravel()))
+
+    def cerrar(self):
+        self._escribir('''
+    </Folder>
+</Document>
+</kml>''')
+
+
+def write_kml(stream, layout, project_name, zonas_habilitadas, zonas_inhabilitadas):
+    """
+    Stream the layout KML into a binary file-like object
+
+    The enabled and restricted zones are written as their own folders. Table
+    footprints (a Layout or an iterable of Layout batches) are reprojected
+    to WGS84 and formatted from NumPy arrays in batches of KML_CHUNK_SIZE
+    placemarks, so memory use stays flat as the table count grows.
+    """
+    escritor = _EscritorKML(stream, project_name, zonas_habilitadas, zonas_inhabilitadas)
+    primera = 1
+    for lote in _lotes(layout):
+        escritor.escribir(lote, primera)
+        primera += len(lote)
+    escritor.cerrar()
+
+
+def _zone_placemark(nombre, geometria):
+    """KML placemark of a (Multi)Polygon zone, holes included"""
+    def anillo(coords):
+        return ' '.join(f"{lon},{lat},0" for lon, lat in np.asarray(coords)[:, :2])
+
+    def poligono(p):
+        interiores = ''.join(
+            f"<innerBoundaryIs><LinearRing><coordinates>{anillo(r.coords)}</coordinates></LinearRing></innerBoundaryIs>"
+            for r in p.interiors)
+        return (f"<Polygon><outerBoundaryIs><LinearRing><coordinates>{anillo(p.exterior.coords)}"
+                f"</coordinates></LinearRing></outerBoundaryIs>{interiores}</Polygon>")
+
+    partes = [p for p in shapely.get_parts(geometria) if p.geom_type == 'Polygon']
+    cuerpo = poligono(partes[0]) if len(partes) == 1 else \
+        f"<MultiGeometry>{''.join(poligono(p) for p in partes)}</MultiGeometry>"
+    return f'''
+        <Placemark>
+            <name>{escape(nombre)}</name>
+            {cuerpo}
+        </Placemark>'''
+
+
+def create_kml_content(layout, project_name, zonas_habilitadas, zonas_inhabilitadas):
+    """Create the full KML document as a string (see write_kml)"""
+    buffer = io.BytesIO()
+    write_kml(buffer, layout, project_name, zonas_habilitadas, zonas_inhabilitadas)
+    return buffer.getvalue().decode('utf-8')
@@ -0,0 +1,235 @@
+import logging
+from collections import Counter
+
+import numpy as np
+import shapely
+
+from modules import instrumentation
+from modules.layout import Layout
+from modules.panel_optimizer import (_calles, _geometrias, _posiciones_columnas,
+                                     _posiciones_filas, _rectangulos)
+
+logger = logging.getLogger(__name__)
+
+
+class LayoutIncremental:
+    """
+    Layout at a fixed pitch that is updated in place when zones change
+
+    Keeps, per enabled zone, the fenced geometry, the grid (column and row
+    positions) and a column x row occupancy grid, plus an STRtree of the
+    restricted zones. actualizar() compares the new zones with the current
+    ones and re-checks only the grid cells whose footprint overlaps the
+    bounding box of something that changed: each added/removed/edited
+    restricted zone, or the part of an edited enabled zone that differs. An enabled zone whose
+    fenced bounds move gets a new grid and is laid out again in full.
+
+    Tables are checked with the exact predicates of the vectorial engine
+    (contained in the fenced zone, not intersecting any restricted zone), on
+    the unrotated grid without origin offset. Use the pitch returned by
+    optimizar_paneles to continue from its result. Zones are GeoDataFrames
+    or plain shapely polygons, as in optimizar_paneles.
+    """
+
+    def __init__(self, zonas_habilitadas, zonas_inhabilitadas, module_specs,
+                 panels_x_module, pitch, modulos_entre_calles=float('inf'),
+                 ancho_calle=0, fenced_distance=0):
+        self.module_specs = module_specs
+        self.panels_x_module = panels_x_module
+        self.pitch = pitch
+        self.modulos_entre_calles = modulos_entre_calles
+        self.ancho_calle = ancho_calle
+        self.fenced_distance = fenced_distance
+        # Same table dimensions as optimizar_paneles
+        self.module_width = module_specs['length']
+        self.module_length = module_specs['width'] * panels_x_module
+
+        self._fijar_restringidas(_geometrias(zonas_inhabilitadas))
+        self.zonas = [self._zona_nueva(geometria)
+                      for geometria in _geometrias(zonas_habilitadas)]
+
+    def _fijar_restringidas(self, geometrias):
+        """Restricted zones and their spatial index"""
+        self.restringidas = geometrias
+        self._wkb_restringidas = Counter(shapely.to_wkb(geometrias))
+        self.arbol = shapely.STRtree(geometrias)
+
+    def _zona_nueva(self, habilitada):
+        """Fence, grid and full layout of one enabled zone"""
+        fenced = shapely.buffer(habilitada, -self.fenced_distance, quad_segs=16)
+        zona = {'habilitada': shapely.to_wkb(habilitada), 'fenced': None}
+        if not fenced.is_valid or fenced.is_empty:
+            return zona
+        shapely.prepare(fenced)
+        minx, miny, maxx, maxy = fenced.bounds
+        xs, calles_x = _posiciones_columnas(minx, maxx, self.module_width, self.pitch,
+                                            self.modulos_entre_calles, self.ancho_calle)
+        ys = _posiciones_filas(miny, maxy, self.module_length)
+        zona.update({'fenced': fenced, 'xs': xs, 'ys': ys, 'calles_x': calles_x,
+                     'miny': miny, 'maxy': maxy,
+                     'ocupado': np.zeros((len(xs), len(ys)), dtype=bool)})
+        col, fila = np.nonzero(np.ones((len(xs), len(ys)), dtype=bool))
+        self._recalcular(zona, col, fila)
+        return zona
+
+    def _recalcular(self, zona, col, fila):
+        """Re-check the (col[i], fila[i]) cells of a zone"""
+        if len(col) == 0:
+            return
+        mesas = _rectangulos(zona['xs'][col], zona['ys'][fila],
+                             self.module_width, self.module_length)
+        valida = shapely.contains(zona['fenced'], mesas)
+        indice_mesa, _ = self.arbol.query(mesas, predicate='intersects')
+        valida[indice_mesa] = False
+        zona['ocupado'][col, fila] = valida
+
+    def _celdas(self, zona, caja):
+        """Columns and rows of a zone whose tables overlap a (closed) bbox"""
+        bx0, by0, bx1, by1 = caja
+        xs, ys = zona['xs'], zona['ys']
+        columnas = np.nonzero((xs <= bx1) & (xs + self.module_width >= bx0))[0]
+        filas = np.nonzero((ys <= by1) & (ys + self.module_length >= by0))[0]
+        return columnas, filas
+
+    def _mesas(self, zona, indice, ocupado):
+        col, fila = np.nonzero(ocupado)
+        return Layout.desde_arrays(
+            zona['xs'][col] + self.module_width / 2, zona['ys'][fila] + self.module_length / 2,
+            np.full(len(col), indice), col, fila, self.module_width, self.module_length)
+
+    @property
+    def layout(self):
+        """Current tables as a Layout"""
+        return _concatenar([self._mesas(zona, i, zona['ocupado'])
+                            for i, zona in enumerate(self.zonas) if zona['fenced'] is not None],
+                           self.module_width, self.module_length)
+
+    @property
+    def total_modules(self):
+        """Current table count"""
+        return int(sum(zona['ocupado'].sum() for zona in self.zonas
+                       if zona['fenced'] is not None))
+
+    @property
+    def total_energy(self):
+        """Current DC capacity in W"""
+        return self.total_modules * self.panels_x_module * self.module_specs['stc']
+
+    def calles(self):
+        """Street dicts, like the ones returned by optimizar_paneles"""
+        return _calles({'zonas': [zona if zona['fenced'] is not None else None
+                                  for zona in self.zonas]}, self.ancho_calle)
+
+    @instrumentation.cronometrado('actualizar_layout')
+    def actualizar(self, zonas_habilitadas=None, zonas_inhabilitadas=None):
+        """
+        Apply new enabled and/or restricted zones (None keeps the current ones)
+
+        Enabled zones are matched by position; restricted zones are compared
+        as a set of geometries, so reordering them costs nothing.
+
+        Returns:
+            dict: 'added' and 'removed' tables (Layouts), the updated
+            'total_modules' and 'total_energy', and 'cells_checked', the
+            number of grid cells re-checked
+        """
+        anterior = [zona['ocupado'].copy() if zona['fenced'] is not None else None
+                    for zona in self.zonas]
+        anteriores = list(self.zonas)
+        rehechas = set()
+        cajas = []
+        revisadas = 0
+
+        if zonas_inhabilitadas is not None:
+            geometrias = _geometrias(zonas_inhabilitadas)
+            wkb = Counter(shapely.to_wkb(geometrias))
+            cambiadas = [shapely.from_wkb(w) for w in
+                         (wkb - self._wkb_restringidas) + (self._wkb_restringidas - wkb)]
+            if cambiadas:
+                self._fijar_restringidas(geometrias)
+                # One box per changed zone: a single bbox over scattered
+                # edits would re-check everything between them
+                cajas.extend(shapely.bounds(cambiadas))
+
+        cajas_zona = {}
+        if zonas_habilitadas is not None:
+            geometrias = list(_geometrias(zonas_habilitadas))
+            for i in range(max(len(geometrias), len(self.zonas))):
+                if i >= len(geometrias):
+                    rehechas.add(i)
+                    continue
+                if i < len(self.zonas) and self.zonas[i]['habilitada'] == shapely.to_wkb(geometrias[i]):
+                    continue
+                nueva = self._zona_nueva(geometrias[i]) if i >= len(self.zonas) else None
+                if nueva is not None:
+                    self.zonas.append(nueva)
+                    rehechas.add(i)
+                    revisadas += nueva['ocupado'].size if nueva['fenced'] is not None else 0
+                    continue
+                vieja = self.zonas[i]
+                fenced = shapely.buffer(geometrias[i], -self.fenced_distance, quad_segs=16)
+                if vieja['fenced'] is None or not fenced.is_valid or fenced.is_empty \
+                        or fenced.bounds != vieja['fenced'].bounds:
+                    # The grid depends on the fenced bounds: lay the zone out again
+                    self.zonas[i] = self._zona_nueva(geometrias[i])
+                    rehechas.add(i)
+                    if self.zonas[i]['fenced'] is not None:
+                        revisadas += self.zonas[i]['ocupado'].size
+                    continue
+                diferencia = shapely.symmetric_difference(vieja['fenced'], fenced)
+                shapely.prepare(fenced)
+                vieja.update(habilitada=shapely.to_wkb(geometrias[i]), fenced=fenced)
+                if not diferencia.is_empty:
+                    cajas_zona[i] = diferencia.bounds
+            del self.zonas[len(geometrias):]
+
+        for i, zona in enumerate(self.zonas):
+            if i in rehechas or zona['fenced'] is None:
+                continue
+            cajas_i = cajas + ([cajas_zona[i]] if i in cajas_zona else [])
+            if not cajas_i:
+                continue
+            # Union of the cells under every box, so overlapping boxes
+            # re-check each cell once
+            marcadas = np.zeros_like(zona['ocupado'])
+            for caja in cajas_i:
+                columnas, filas = self._celdas(zona, caja)
+                marcadas[np.ix_(columnas, filas)] = True
+            col, fila = np.nonzero(marcadas)
+            self._recalcular(zona, col, fila)
+            revisadas += len(col)
+
+        # Diff against the previous occupancy
+        agregadas, eliminadas = [], []
+        for i in range(max(len(self.zonas), len(anteriores))):
+            zona = self.zonas[i] if i < len(self.zonas) else None
+            previa = anterior[i] if i < len(anterior) else None
+            if i in rehechas:
+                if previa is not None:
+                    eliminadas.append(self._mesas(anteriores[i], i, previa))
+                if zona is not None and zona['fenced'] is not None:
+                    agregadas.append(self._mesas(zona, i, zona['ocupado']))
+            elif zona is not None and zona['fenced'] is not None:
+                agregadas.append(self._mesas(zona, i, zona['ocupado'] & ~previa))
+                eliminadas.append(self._mesas(zona, i, previa & ~zona['ocupado']))
+
+        agregadas = _concatenar(agregadas, self.module_width, self.module_length)
+        eliminadas = _concatenar(eliminadas, self.module_width, self.module_length)
+        instrumentation.contar('celdas_revisadas', revisadas)
+        logger.info("Incremental update: %d cells checked, +%d / -%d tables, total %d",
+                    revisadas, len(agregadas), len(eliminadas), self.total_modules)
+        return {
+            'added': agregadas,
+            'removed': eliminadas,
+            'total_modules': self.total_modules,
+            'total_energy': self.total_energy,
+            'cells_checked': revisadas,
+        }
+
+
+def _concatenar(layouts, module_width, module_length):
+    """One Layout with the tables of several"""
+    if not layouts:
+        return Layout.desde_arrays([], [], [], [], [], module_width, module_length)
+    return Layout(np.concatenate([layout.mesas for layout in layouts]),
+                  module_width, module_length)
@@ -0,0 +1,243 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Collector of the running context, None when instrumentation is off. Each
+# thread starts with none, so concurrent jobs (layout_service) keep their
+# metrics apart; threads working for a job run in a copy of its context
+_ACTIVA = contextvars.ContextVar('instrumentacion', default=None)
+
+
+def configurar_logging(nivel='INFO', ruta=None):
+    """
+    Leveled logging for the command-line entry points
+
+    Args:
+        nivel (str or int): Level name or number, e.g. 'DEBUG' shows the per
+            zone and per pitch details
+        ruta (str): Optional log file, in addition to the console
+    """
+    manejadores = [logging.StreamHandler()]
+    if ruta:
+        manejadores.append(logging.FileHandler(ruta, encoding='utf-8'))
+    logging.basicConfig(level=nivel if isinstance(nivel, int) else str(nivel).upper(),
+                        format='%(asctime)s %(levelname)-7s %(name)s: %(message)s',
+                        handlers=manejadores, force=True)
+
+
+def _memoria_pico_mb():
+    """Peak resident memory of the process in MB, None where unavailable"""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return round(pico / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+class Instrumentacion:
+    """
+    Collector of stage timings, counters and events
+
+    Stages are timed with perf_counter_ns, which is system-wide on the
+    supported platforms, so stages recorded in pool workers line up with the
+    parent's once merged. Every stage records the peak resident memory of
+    its process at its end; with trazar_memoria=True it also records the
+    Python-level allocation peak within the stage (tracemalloc, slower).
+
+    Args:
+        trazar_memoria (bool): Record per-stage allocation peaks
+    """
+
+    def __init__(self, trazar_memoria=False):
+        self.origen = time.perf_counter_ns()
+        self.etapas = []
+        self.contadores = {}
+        self.eventos = []
+        self.trazar_memoria = trazar_memoria
+        self._lock = threading.Lock()
+        if trazar_memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def etapa(self, nombre, **args):
+        """Time a stage; keyword arguments are stored with it"""
+        if self.trazar_memoria:
+            tracemalloc.reset_peak()
+        inicio = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            fin = time.perf_counter_ns()
+            registro = {'nombre': nombre, 'inicio_ns': inicio, 'duracion_ns': fin - inicio,
+                        'pid': os.getpid(), 'tid': threading.get_ident(),
+                        'memoria_pico_mb': _memoria_pico_mb(), 'args': args}
+            if self.trazar_memoria:
+                registro['asignado_pico_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            with self._lock:
+                self.etapas.append(registro)
+
+    def contar(self, nombre, n=1):
+        """Add n to a counter"""
+        with self._lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + int(n)
+
+    def registrar(self, nombre, **valores):
+        """Record a point event, e.g. the accepted tables of a zone and pitch"""
+        with self._lock:
+            self.eventos.append({'nombre': nombre, 'ts_ns': time.perf_counter_ns(),
+                                 'pid': os.getpid(), 'valores': valores})
+
+    def fusionar(self, datos):
+        """Merge the a_dict() of another collector (e.g. from a pool worker)"""
+        with self._lock:
+            self.etapas.extend(datos['etapas'])
+            self.eventos.extend(datos['eventos'])
+            for nombre, n in datos['contadores'].items():
+                self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def a_dict(self):
+        """Plain, picklable and JSON-serializable copy of everything recorded"""
+        with self._lock:
+            return {'origen_ns': self.origen, 'etapas': list(self.etapas),
+                    'contadores': dict(self.contadores), 'eventos': list(self.eventos)}
+
+    def resumen(self):
+        """
+        Total time and call count per stage name, the counters and the peak
+        memory
+
+        Returns:
+            dict: JSON-serializable summary
+        """
+        etapas = {}
+        for etapa in self.etapas:
+            total = etapas.setdefault(etapa['nombre'], {'llamadas': 0, 'segundos': 0.0})
+            total['llamadas'] += 1
+            total['segundos'] += etapa['duracion_ns'] / 1e9
+        for total in etapas.values():
+            total['segundos'] = round(total['segundos'], 6)
+        picos = [e['memoria_pico_mb'] for e in self.etapas if e['memoria_pico_mb'] is not None]
+        return {'etapas': etapas, 'contadores': dict(self.contadores),
+                'memoria_pico_mb': max(picos, default=_memoria_pico_mb())}
+
+    def exportar_json(self, ruta):
+        """Write the summary plus every stage and event as JSON"""
+        datos = self.a_dict()
+        datos['resumen'] = self.resumen()
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, indent=2, default=str)
+        logger.info("Instrumentation written to %s", ruta)
+        return ruta
+
+    def exportar_chrome_trace(self, ruta):
+        """
+        Write a Chrome trace (chrome://tracing, Perfetto): one complete event
+        per stage, one instant event per recorded event and the final counters
+        """
+        eventos = []
+        for etapa in self.etapas:
+            args = dict(etapa['args'], memoria_pico_mb=etapa['memoria_pico_mb'])
+            if 'asignado_pico_mb' in etapa:
+                args['asignado_pico_mb'] = etapa['asignado_pico_mb']
+            eventos.append({'name': etapa['nombre'], 'ph': 'X', 'pid': etapa['pid'],
+                            'tid': etapa['tid'], 'ts': (etapa['inicio_ns'] - self.origen) / 1e3,
+                            'dur': etapa['duracion_ns'] / 1e3, 'args': args})
+        for evento in self.eventos:
+            eventos.append({'name': evento['nombre'], 'ph': 'i', 's': 'p', 'pid': evento['pid'],
+                            'tid': 0, 'ts': (evento['ts_ns'] - self.origen) / 1e3,
+                            'args': evento['valores']})
+        fin = max((e['inicio_ns'] + e['duracion_ns'] for e in self.etapas), default=self.origen)
+        eventos.append({'name': 'contadores', 'ph': 'C', 'pid': os.getpid(),
+                        'ts': (fin - self.origen) / 1e3, 'args': dict(self.contadores)})
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': eventos, 'displayTimeUnit': 'ms'}, f, default=str)
+        logger.info("Chrome trace written to %s", ruta)
+        return ruta
+
+
+def activar(instrumentacion=None):
+    """Turn instrumentation on for this context and return the collector"""
+    instrumentacion = instrumentacion or Instrumentacion()
+    _ACTIVA.set(instrumentacion)
+    return instrumentacion
+
+
+def desactivar():
+    """Turn instrumentation off and return the collector that was active"""
+    anterior = _ACTIVA.get()
+    _ACTIVA.set(None)
+    return anterior
+
+
+def actual():
+    """Active collector, or None"""
+    return _ACTIVA.get()
+
+
+@contextmanager
+def instrumentar(trazar_memoria=False):
+    """Instrument a block: `with instrumentar() as inst: ...`"""
+    inst = Instrumentacion(trazar_memoria)
+    token = _ACTIVA.set(inst)
+    try:
+        yield inst
+    finally:
+        _ACTIVA.reset(token)
+
+
+@contextmanager
+def capturar():
+    """
+    Collect into a fresh collector for the block, e.g. inside a pool worker;
+    the caller sends its a_dict() back to be merged with fusionar()
+    """
+    inst = Instrumentacion()
+    token = _ACTIVA.set(inst)
+    try:
+        yield inst
+    finally:
+        _ACTIVA.reset(token)
+
+
+# Cheap module-level helpers: no-ops while instrumentation is off
+
+def etapa(nombre, **args):
+    activa = _ACTIVA.get()
+    return activa.etapa(nombre, **args) if activa is not None else nullcontext()
+
+
+def contar(nombre, n=1):
+    activa = _ACTIVA.get()
+    if activa is not None:
+        activa.contar(nombre, n)
+
+
+def registrar(nombre, **valores):
+    activa = _ACTIVA.get()
+    if activa is not None:
+        activa.registrar(nombre, **valores)
+
+
+def cronometrado(nombre=None):
+    """Decorator timing every call of a function as a stage"""
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with etapa(nombre or funcion.__name__):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
@@ -1,52 +1,94 @@
-import geopandas as gpd
-from shapely.geometry import shape
-import pyproj
-from shapely.ops import transform
+import logging
+from functools import lru_cache
 
-def cargar_kml(ruta_kml, input_crs='EPSG:4326', output_crs='EPSG:25833'):
+import numpy as np
+import shapely
+
+from modules import instrumentation, site_cache
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=32)
+def obtener_transformador(input_crs, output_crs):
+    """
+    Process-wide cache of pyproj transformers keyed by CRS pair
+
+    Building a Transformer means a PROJ database lookup; every later call
+    for the same pair reuses it.
+    """
+    import pyproj
+    return pyproj.Transformer.from_crs(pyproj.CRS(input_crs), pyproj.CRS(output_crs),
+                                       always_xy=True)
+
+
+def reproyectar(geometrias, input_crs, output_crs):
+    """
+    Reproject an array of shapely geometries in one bulk coordinate operation
+
+    All the coordinates of all the geometries go through the transformer in
+    a single call; invalid results are repaired with buffer(0) in bulk.
+    """
+    geometrias = np.asarray(geometrias, dtype=object)
+    transformer = obtener_transformador(input_crs, output_crs)
+    geometrias = shapely.transform(
+        geometrias, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+
+    # Ensure they are valid polygons
+    invalidas = ~shapely.is_valid(geometrias)
+    if invalidas.any():
+        geometrias[invalidas] = shapely.buffer(geometrias[invalidas], 0)
+    return geometrias
+
+
+def crs_utm_local(geometrias, input_crs='EPSG:4326'):
+    """
+    UTM CRS (WGS 84) of the zone containing the centre of the data extent
+
+    Returns:
+        str: CRS as 'EPSG:<code>'
+    """
+    from pyproj.aoi import AreaOfInterest
+    from pyproj.database import query_utm_crs_info
+    minx, miny, maxx, maxy = shapely.total_bounds(reproyectar(geometrias, input_crs, 'EPSG:4326'))
+    lon, lat = (minx + maxx) / 2, (miny + maxy) / 2
+    utm = query_utm_crs_info(datum_name='WGS 84',
+                             area_of_interest=AreaOfInterest(lon, lat, lon, lat))
+    return f"EPSG:{utm[0].code}"
+
+
+@instrumentation.cronometrado()
+def cargar_kml(ruta_kml, input_crs='EPSG:4326', output_crs='EPSG:25833', cache_dir=None):
     """
     Load and process KML file with flexible coordinate system transformation
-    
+
     Args:
     ruta_kml (str): Path to KML file
     input_crs (str): Input coordinate reference system (default: WGS84)
-    output_crs (str): Output coordinate reference system (default: UTM zone 33N)
-    
+    output_crs (str): Output coordinate reference system (default: UTM zone 33N),
+        or 'auto' for the local UTM zone of the data extent
+    cache_dir (str): Optional cache directory. The projected zones are stored
+        there as GeoParquet, keyed by the file content hash and the CRS pair,
+        and later loads of the same file skip parsing entirely
+
     Returns:
     tuple: Enabled and restricted zones as GeoDataFrames in the output CRS
     """
-    print("\n=== STARTING KML FILE LOAD ===")
-    print(f"Trying to load file: {ruta_kml}")
-    print(f"Input CRS: {input_crs}")
-    print(f"Output CRS: {output_crs}")
-    
+    import geopandas as gpd
+    logger.info("Loading KML file %s (%s -> %s)", ruta_kml, input_crs, output_crs)
+
     try:
+        if cache_dir:
+            clave = site_cache.clave_cache('kml', site_cache.hash_archivo(ruta_kml),
+                                           input_crs, output_crs)
+            zonas = site_cache.leer_zonas(cache_dir, clave)
+            if zonas is not None:
+                logger.info("Loaded from cache")
+                return zonas
+
         # Read KML file
-        gdf = gpd.read_file(ruta_kml, driver='KML')
-        
-        # Define coordinate transformations
-        input_proj = pyproj.CRS(input_crs)
-        output_proj = pyproj.CRS(output_crs)
-        
-        # Create transformer
-        project = pyproj.Transformer.from_crs(input_proj, output_proj, always_xy=True).transform
-
-        # Transform geometries
-        def transform_geometry(geometry):
-            try:
-                # Convert to Shapely geometry if not already
-                poly = shape(geometry) if hasattr(geometry, '__geo_interface__') else geometry
-                
-                # Transform geometry
-                transformed_poly = transform(project, poly)
-                
-                # Ensure it's a valid polygon
-                if not transformed_poly.is_valid:
-                    transformed_poly = transformed_poly.buffer(0)
-                return transformed_poly
-            except Exception as e:
-                print(f"Error processing geometry: {e}")
-                return None
+        with instrumentation.etapa('leer_kml'):
+            gdf = gpd.read_file(ruta_kml, driver='KML')
 
         # Normalize column names
         gdf['Name'] = gdf['Name'].str.lower().str.strip()
@@ -55,15 +97,29 @@ def cargar_kml(ruta_kml, input_crs='EPSG:4326', output_crs='EPSG:25833'):
         zonas_habilitadas = gdf[gdf['Name'] == 'enabled'].copy()
         zonas_inhabilitadas = gdf[gdf['Name'] == 'restricted'].copy()
 
-        # Apply coordinate transformation
-        zonas_habilitadas['geometry'] = zonas_habilitadas['geometry'].apply(transform_geometry)
-        zonas_inhabilitadas['geometry'] = zonas_inhabilitadas['geometry'].apply(transform_geometry)
+        if output_crs == 'auto':
+            output_crs = crs_utm_local(zonas_habilitadas.geometry.values, input_crs)
+            logger.info("Local UTM CRS: %s", output_crs)
 
-        # Remove any None geometries
-        zonas_habilitadas = zonas_habilitadas[zonas_habilitadas['geometry'].notna()]
-        zonas_inhabilitadas = zonas_inhabilitadas[zonas_inhabilitadas['geometry'].notna()]
+        # Apply coordinate transformation, all geometries in one call
+        zonas = []
+        for zona in (zonas_habilitadas, zonas_inhabilitadas):
+            with instrumentation.etapa('reproyectar', geometrias=len(zona)):
+                geometrias = reproyectar(zona.geometry.values, input_crs, output_crs)
+            zona = gpd.GeoDataFrame(zona.drop(columns='geometry'), geometry=geometrias,
+                                    crs=output_crs)
+            # Remove any empty geometries
+            zonas.append(zona[~zona.geometry.is_empty & zona.geometry.notna()])
 
+        zonas_habilitadas, zonas_inhabilitadas = zonas
+        logger.info("Loaded %d enabled and %d restricted zones",
+                    len(zonas_habilitadas), len(zonas_inhabilitadas))
+        if cache_dir:
+            try:
+                site_cache.guardar_zonas(cache_dir, clave, zonas_habilitadas, zonas_inhabilitadas)
+            except Exception as e:
+                logger.warning("Could not cache the site geometry: %s", e)
         return zonas_habilitadas, zonas_inhabilitadas
     except Exception as e:
-        print(f"Error loading KML: {e}")
-        return None, None
\ No newline at end of file
+        logger.error("Error loading KML: %s", e)
+        return None, None
@@ -0,0 +1,97 @@
+import numpy as np
+import shapely
+
+# One record per placed table
+MESA_DTYPE = np.dtype([
+    ('x', 'f8'),        # Table centre in the output CRS
+    ('y', 'f8'),
+    ('zona', 'i4'),     # Index of the enabled zone
+    ('columna', 'i4'),  # Grid column within the zone
+    ('fila', 'i4'),     # Grid row within the column
+])
+
+
+class Layout:
+    """
+    Array-backed result of optimizar_paneles, one record per placed table
+
+    Tables are kept in a NumPy structured array (centre, zone, column, row)
+    together with the table size and the grid angle; shapely geometries are
+    only built on demand, in one vectorized call. Iterating a Layout yields
+    the table centre lines, so code written for the former list of
+    LineStrings keeps working.
+
+    Args:
+        mesas (np.ndarray): Structured array with MESA_DTYPE
+        module_width (float): Table size across the rows (grid x axis)
+        module_length (float): Table size along the rows (grid y axis)
+        angulo (float): Grid rotation in degrees, counter-clockwise
+    """
+
+    def __init__(self, mesas, module_width, module_length, angulo=0.0):
+        self.mesas = mesas
+        self.module_width = module_width
+        self.module_length = module_length
+        self.angulo = angulo
+
+    @classmethod
+    def desde_arrays(cls, x, y, zona, columna, fila, module_width, module_length,
+                     angulo=0.0):
+        """Build a Layout from per-table arrays"""
+        mesas = np.empty(len(x), dtype=MESA_DTYPE)
+        mesas['x'] = x
+        mesas['y'] = y
+        mesas['zona'] = zona
+        mesas['columna'] = columna
+        mesas['fila'] = fila
+        return cls(mesas, module_width, module_length, angulo)
+
+    def __len__(self):
+        return len(self.mesas)
+
+    def __iter__(self):
+        return iter(self.lineas())
+
+    def __getitem__(self, indice):
+        return self.lineas()[indice]
+
+    def __repr__(self):
+        return (f"Layout({len(self)} tables, {self.module_width} x {self.module_length} m, "
+                f"angle {self.angulo} deg)")
+
+    @property
+    def centros(self):
+        """(n, 2) array of table centres"""
+        return np.stack([self.mesas['x'], self.mesas['y']], axis=1)
+
+    def _ejes(self):
+        """Half-size vectors across (width) and along (length) the rows"""
+        theta = np.radians(self.angulo)
+        ancho = np.array([np.cos(theta), np.sin(theta)]) * self.module_width / 2
+        largo = np.array([-np.sin(theta), np.cos(theta)]) * self.module_length / 2
+        return ancho, largo
+
+    def coordenadas_lineas(self):
+        """(n, 2, 2) array with the two end points of each table centre line"""
+        _, largo = self._ejes()
+        centros = self.centros
+        return np.stack([centros - largo, centros + largo], axis=1)
+
+    def coordenadas_poligonos(self):
+        """(n, 4, 2) array with the corners of each table footprint"""
+        ancho, largo = self._ejes()
+        centros = self.centros
+        return np.stack([
+            centros - ancho - largo,
+            centros + ancho - largo,
+            centros + ancho + largo,
+            centros - ancho + largo,
+        ], axis=1)
+
+    def lineas(self):
+        """Table centre lines as an array of shapely LineStrings"""
+        return shapely.linestrings(self.coordenadas_lineas())
+
+    def poligonos(self):
+        """Table footprints as an array of shapely Polygons"""
+        return shapely.polygons(self.coordenadas_poligonos())
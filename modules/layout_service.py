@@ -0,0 +1,234 @@
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from modules import batch_runner
+from modules.batch_runner import FORMATOS, completar_escenario, ejecutar_escenario
+from modules.site_cache import clave_cache, firma_archivo
+
+logger = logging.getLogger(__name__)
+
+# Finished results kept for repeat queries; their artifacts stay on disk
+MAX_RESULTADOS = 256
+
+
+class ServicioLayout:
+    """
+    Long-running what-if layout runner with warm in-memory caches
+
+    Requests are scenarios as in batch.py (see batch_runner) and run through
+    ejecutar_escenario on a bounded thread pool, so every job shares the
+    process caches: loaded sites, the module catalog and the memoized pitch
+    evaluations (bounded, see batch_runner.MAX_EVALUACIONES). Sites, the
+    catalog and finished results are keyed by the size and modification
+    time of their input files, so edited files are read again. The
+    prepared geometry of a site is kept per pool thread, since preparing it
+    is not thread-safe. A repeat of a finished request is answered from the
+    result memo without running again.
+
+    A request may name a session; a new request of the same session
+    supersedes the previous one, which is dropped if still queued or
+    stopped at its next evaluation if running.
+
+    Args:
+        max_workers (int): Jobs run at the same time
+        output_dir (str): Folder of the per-request artifacts
+        cache_dir (str): On-disk cache for projected site geometry
+    """
+
+    def __init__(self, max_workers=2, output_dir='service_output', cache_dir=None):
+        self.output_dir = os.path.realpath(output_dir)
+        self.cache_dir = cache_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='layout')
+        self._lock = threading.Lock()
+        self._sesiones = {}
+        self._resultados = OrderedDict()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        # Heavy imports paid once at start-up rather than on the first request
+        for modulo in ('modules.export_results', 'modules.visualizer'):
+            importlib.import_module(modulo)
+
+    def enviar(self, peticion):
+        """
+        Queue a layout request
+
+        Args:
+            peticion (dict): Scenario parameters plus optional 'session'
+                and 'artifacts' (subset of FORMATOS)
+
+        Returns:
+            Future: Resolves to the summary row of the scenario; cancelled
+            if superseded before it started
+        """
+        peticion = dict(peticion)
+        sesion = peticion.pop('session', None)
+        formatos = tuple(peticion.pop('artifacts', ()))
+        desconocidos = set(formatos) - set(FORMATOS)
+        if desconocidos:
+            raise ValueError(f"Unknown artifacts {sorted(desconocidos)}, "
+                             f"expected some of {FORMATOS}")
+        escenario = completar_escenario(peticion, nombre='layout')
+        # Input files edited on disk give a new key, so a stale result is not reused
+        clave = clave_cache(json.dumps(escenario, sort_keys=True, default=str), *formatos,
+                            *(_firma(escenario[ruta]) for ruta in ('kml', 'catalog')))
+
+        cancelar = threading.Event()
+        anterior = None
+        with self._lock:
+            if sesion is not None:
+                anterior = self._sesiones.pop(sesion, None)
+            futuro = self.executor.submit(self._ejecutar, escenario, formatos, clave, cancelar)
+            if sesion is not None:
+                self._sesiones[sesion] = (futuro, cancelar)
+        # Outside the lock: cancel() and add_done_callback() may run the
+        # callback, which takes the lock, right in this thread
+        if anterior is not None:
+            _detener(*anterior)
+        if sesion is not None:
+            futuro.add_done_callback(lambda f: self._terminar(sesion, f))
+        return futuro
+
+    def _terminar(self, sesion, futuro):
+        with self._lock:
+            if self._sesiones.get(sesion, (None,))[0] is futuro:
+                del self._sesiones[sesion]
+
+    def _ejecutar(self, escenario, formatos, clave, cancelar):
+        inicio = time.perf_counter()
+        with self._lock:
+            fila = self._resultados.get(clave)
+            if fila is not None:
+                self._resultados.move_to_end(clave)
+        if fila is not None and all(os.path.exists(fila[f]) for f in formatos):
+            return dict(fila, cached=True, seconds=round(time.perf_counter() - inicio, 3))
+
+        directorio = os.path.join(self.output_dir, clave[:16])
+        fila = ejecutar_escenario(escenario, directorio, formatos, self.cache_dir,
+                                  cancelar=cancelar)
+        if fila['status'] == 'ok':
+            with self._lock:
+                self._resultados[clave] = fila
+                while len(self._resultados) > MAX_RESULTADOS:
+                    self._resultados.popitem(last=False)
+        return dict(fila, cached=False)
+
+    def estado(self):
+        """Sizes of the warm caches and the running sessions"""
+        sitios = batch_runner._sitio.cache_info()
+        with self._lock:
+            return {'sites': sitios.currsize, 'site_hits': sitios.hits,
+                    'evaluations': len(batch_runner._EVALUACIONES),
+                    'results': len(self._resultados), 'sessions': len(self._sesiones)}
+
+    def cerrar(self):
+        """Stop the running jobs and the pool"""
+        with self._lock:
+            sesiones = list(self._sesiones.values())
+            self._sesiones.clear()
+        for futuro, cancelar in sesiones:
+            _detener(futuro, cancelar)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _firma(ruta):
+    """(size, mtime) of an input file, None if missing (the job reports it)"""
+    try:
+        return firma_archivo(ruta)
+    except OSError:
+        return None
+
+
+def _detener(futuro, cancelar):
+    """Drop a job if still queued, or stop it at its next evaluation"""
+    cancelar.set()
+    futuro.cancel()
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    """
+    JSON endpoints of a ServicioLayout (self.server.servicio):
+
+        POST /layout              run a scenario, answer its summary row
+        GET  /artifacts/<dir>/<f> download a KMZ / XLSX / PNG / Parquet / FGB artifact
+        GET  /status              cache sizes
+    """
+
+    def _responder(self, codigo, datos):
+        cuerpo = json.dumps(datos, default=str).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/layout':
+            return self._responder(404, {'error': f"Unknown endpoint {self.path}"})
+        try:
+            longitud = int(self.headers.get('Content-Length', 0))
+            peticion = json.loads(self.rfile.read(longitud) or b'{}')
+            if not isinstance(peticion, dict):
+                raise ValueError("The request body must be a JSON object")
+            futuro = self.server.servicio.enviar(peticion)
+        except (ValueError, TypeError) as e:
+            return self._responder(400, {'error': str(e)})
+
+        try:
+            fila = futuro.result()
+        except CancelledError:
+            fila = {'status': 'cancelled'}
+        servicio = self.server.servicio
+        for formato in FORMATOS:
+            if fila.get(formato):
+                relativa = os.path.relpath(fila[formato], servicio.output_dir)
+                fila[formato] = '/artifacts/' + relativa.replace(os.sep, '/')
+        codigo = {'ok': 200, 'cancelled': 409}.get(fila['status'], 422)
+        self._responder(codigo, fila)
+
+    def do_GET(self):
+        servicio = self.server.servicio
+        if self.path.rstrip('/') == '/status':
+            return self._responder(200, servicio.estado())
+        if not self.path.startswith('/artifacts/'):
+            return self._responder(404, {'error': f"Unknown endpoint {self.path}"})
+
+        ruta = os.path.realpath(os.path.join(servicio.output_dir,
+                                             unquote(self.path[len('/artifacts/'):])))
+        if not ruta.startswith(servicio.output_dir + os.sep) or not os.path.isfile(ruta):
+            return self._responder(404, {'error': f"No artifact {self.path}"})
+        tipos = {'.kmz': 'application/vnd.google-earth.kmz', '.png': 'image/png',
+                 '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                 '.parquet': 'application/vnd.apache.parquet'}
+        self.send_response(200)
+        self.send_header('Content-Type', tipos.get(os.path.splitext(ruta)[1],
+                                                   'application/octet-stream'))
+        self.send_header('Content-Length', str(os.path.getsize(ruta)))
+        self.end_headers()
+        with open(ruta, 'rb') as f:
+            while True:
+                trozo = f.read(1 << 16)
+                if not trozo:
+                    break
+                self.wfile.write(trozo)
+
+    def log_message(self, formato, *args):
+        logger.debug("%s %s", self.address_string(), formato % args)
+
+
+def crear_servidor(servicio, host='127.0.0.1', port=8765):
+    """
+    HTTP server of a ServicioLayout, one thread per connection; run it with
+    serve_forever()
+    """
+    servidor = ThreadingHTTPServer((host, port), _Manejador)
+    servidor.servicio = servicio
+    return servidor
@@ -1,134 +1,1240 @@
+import hashlib
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
-from shapely.geometry import LineString, Polygon
-from shapely.affinity import translate
+import shapely
+from shapely.geometry import LineString
+from shapely.affinity import rotate
+
+from modules import instrumentation, site_cache
+from modules.layout import Layout
+from modules.shading import ModeloRendimiento
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on candidate tables tested per vectorized batch, keeps the
+# coordinate arrays of very large zones within a few tens of MB
+MAX_CANDIDATOS_LOTE = 250_000
+
+# Grid columns per batch of optimizar_paneles(stream=True), unless columnas_tesela is set
+COLUMNAS_LOTE = 200
+
+
+# Pitch selection criteria of optimizar_paneles(criterio=...)
+CRITERIOS = ('capacidad', 'energia', 'lcoe')
+
+# LCOE proxy defaults: cost per Wp, cost per hectare of fenced area (land
+# over the plant's life, fencing and site works), fixed cost per site and
+# years of operation
+COSTES_POR_DEFECTO = {'coste_wp': 0.5, 'coste_ha': 30_000.0, 'coste_fijo': 0.0,
+                      'vida_util': 25}
+
+
+class OptimizacionCancelada(Exception):
+    """Raised by optimizar_paneles when its `cancelar` event is set"""
+
+
+def _posiciones_columnas(minx, maxx, module_width, pitch,
+                         modulos_entre_calles, ancho_calle):
+    """
+    Walk the grid columns of a zone from left to right
+
+    The x positions are accumulated step by step, exactly like the original
+    placement loop, so every coordinate is bit-identical to it.
+
+    Returns:
+        tuple: (column start x positions, street start x positions)
+    """
+    xs = []
+    calles_x = []
+    current_x = minx
+    column_count = 0
+    while current_x + module_width <= maxx:
+        xs.append(current_x)
+        column_count += 1
+        if column_count == modulos_entre_calles:
+            calles_x.append(current_x + module_width)
+            current_x += module_width + ancho_calle
+            column_count = 0
+        else:
+            current_x += module_width + pitch
+    return np.array(xs, dtype=float), np.array(calles_x, dtype=float)
+
+
+def _posiciones_filas(miny, maxy, module_length):
+    """
+    Walk the grid rows of a zone from bottom to top (accumulated like the
+    original loop)
+    """
+    ys = []
+    current_y = miny
+    while current_y + module_length <= maxy:
+        ys.append(current_y)
+        current_y += module_length
+    return np.array(ys, dtype=float)
+
+
+def _rectangulos(x0, y0, module_width, module_length):
+    """
+    Build one table Polygon per (x0, y0) lower-left corner in a single call,
+    with the same vertex order as the original per-cell Polygon
+    """
+    x1 = x0 + module_width
+    y1 = y0 + module_length
+    coords = np.stack([
+        np.stack([x0, y0], axis=1),
+        np.stack([x1, y0], axis=1),
+        np.stack([x1, y1], axis=1),
+        np.stack([x0, y1], axis=1),
+    ], axis=1)
+    return shapely.polygons(coords)
+
+
+def _indice_restringido(zona_restringida):
+    """
+    STRtree over the prepared polygons of the restricted union, or None
+
+    Built once per geometry and reused by every pitch of a sweep.
+    """
+    if zona_restringida is None or zona_restringida.is_empty:
+        return None
+    partes = shapely.get_parts(zona_restringida)
+    shapely.prepare(partes)
+    return shapely.STRtree(partes)
+
+
+def _intersecta_restringidas(restringidas, mesas):
+    """
+    Which tables of a batch intersect a restricted polygon
+
+    One bulk bounding-box query for the whole batch, then the exact test
+    only for the (table, nearby polygon) pairs it returns, with the
+    polygons prepared.
+    """
+    mesa, parte = restringidas.query(mesas)
+    toca = shapely.intersects(restringidas.geometries.take(parte), mesas[mesa])
+    instrumentation.contar('predicados_intersects', len(mesa))
+    resultado = np.zeros(len(mesas), dtype=bool)
+    resultado[mesa[toca]] = True
+    return resultado
+
+
+def _mesas_validas(zona, restringidas, x0, y0, module_width, module_length):
+    """
+    Exact feasibility of a batch of tables: contained in the zone and not
+    intersecting the restricted zones
+
+    Args:
+        zona (Polygon): Fenced zone, should be prepared
+        restringidas (STRtree or None): Index from _indice_restringido
+    """
+    mesas = _rectangulos(x0, y0, module_width, module_length)
+    dentro = shapely.contains(zona, mesas)
+    instrumentation.contar('predicados_contains', len(mesas))
+    if restringidas is not None:
+        dentro[dentro] = ~_intersecta_restringidas(restringidas, mesas[dentro])
+    return dentro
+
+
+def _colocar_mesas(zona, zona_restringida, minx, miny, maxx, maxy,
+                   module_width, module_length, pitch,
+                   modulos_entre_calles=float('inf'), ancho_calle=0,
+                   indice_restringido=None):
+    """
+    Vectorized placement of the tables of one zone for a given pitch
+
+    Every candidate table of the grid is built as a NumPy batch and tested
+    with the shapely 2.x vectorized predicates against prepared geometries:
+    a table is accepted when the zone contains it and it does not intersect
+    the restricted zones. The restricted test goes through an STRtree of the
+    restricted polygons, so each table is only checked against the few
+    polygons near it. Gives the same tables as the per-cell loop.
+
+    Args:
+        zona (Polygon): Fenced enabled zone
+        zona_restringida (Geometry or None): Union of the restricted zones
+        minx, miny, maxx, maxy (float): Grid extent (zone bounds)
+        indice_restringido (STRtree): Index of zona_restringida from
+            _indice_restringido, built here when not given
+
+    Returns:
+        tuple: (x0, y0, column index, row index) arrays of the accepted tables,
+        lower-left corners in column order, and the street start x positions
+    """
+    xs, calles_x = _posiciones_columnas(minx, maxx, module_width, pitch,
+                                        modulos_entre_calles, ancho_calle)
+    ys = _posiciones_filas(miny, maxy, module_length)
+    vacio = np.empty(0, dtype=float)
+    if len(xs) == 0 or len(ys) == 0:
+        indice = np.empty(0, dtype=np.int64)
+        return vacio, vacio, indice, indice, calles_x
+
+    shapely.prepare(zona)
+    if indice_restringido is None:
+        indice_restringido = _indice_restringido(zona_restringida)
+    instrumentation.contar('mesas_candidatas', len(xs) * len(ys))
+
+    columnas_lote = max(1, MAX_CANDIDATOS_LOTE // len(ys))
+    x_ok, y_ok, col_ok, fila_ok = [], [], [], []
+    for inicio in range(0, len(xs), columnas_lote):
+        cols = np.arange(inicio, min(inicio + columnas_lote, len(xs)))
+        col = np.repeat(cols, len(ys))
+        fila = np.tile(np.arange(len(ys)), len(cols))
+        x0 = xs[col]
+        y0 = np.tile(ys, len(cols))
+
+        dentro = _mesas_validas(zona, indice_restringido, x0, y0,
+                                module_width, module_length)
+        x_ok.append(x0[dentro])
+        y_ok.append(y0[dentro])
+        col_ok.append(col[dentro])
+        fila_ok.append(fila[dentro])
+
+    return (np.concatenate(x_ok), np.concatenate(y_ok), np.concatenate(col_ok),
+            np.concatenate(fila_ok), calles_x)
+
+
+def _filas_bloqueadas(ys, ys_top, columna, lo, hi, n_columnas, cerrado):
+    """
+    Mark the grid rows overlapped by blocked y-intervals of their column
+
+    With cerrado=False the intervals are open (touching is allowed, as for the
+    zone boundary); with cerrado=True touching counts as overlap, as for the
+    restricted zones. Uses a difference array, so the cost is O(intervals)
+    plus one cumulative sum over the grid.
+    """
+    if cerrado:
+        inicio = np.searchsorted(ys_top, lo, side='left')
+        fin = np.searchsorted(ys, hi, side='right')
+    else:
+        inicio = np.searchsorted(ys_top, lo, side='right')
+        fin = np.searchsorted(ys, hi, side='left')
+    validos = inicio < fin
+    marcas = np.zeros((n_columnas, len(ys) + 1), dtype=np.int32)
+    np.add.at(marcas, (columna[validos], inicio[validos]), 1)
+    np.add.at(marcas, (columna[validos], fin[validos]), -1)
+    return np.cumsum(marcas[:, :-1], axis=1) > 0
+
+
+def _colocar_mesas_scanline(zona, zona_restringida, minx, miny, maxx, maxy,
+                            module_width, module_length, pitch,
+                            modulos_entre_calles=float('inf'), ancho_calle=0,
+                            indice_restringido=None):
+    """
+    Scanline placement of the tables of one zone for a given pitch
+
+    Each table column is a vertical strip [x, x + module_width]. The strip is
+    intersected once with the outside of the zone and once with the
+    restricted polygons it crosses (found with the STRtree of
+    _indice_restringido), and the y-extent of every resulting piece blocks
+    the grid rows it overlaps; the tables of a column are then the unblocked
+    rows. This needs O(columns) geometry operations instead of one predicate
+    per cell. Same signature and result as _colocar_mesas; both agree except
+    for tables within floating-point noise of a boundary, where the overlay
+    rounding of the strip pieces decides.
+    """
+    xs, calles_x = _posiciones_columnas(minx, maxx, module_width, pitch,
+                                        modulos_entre_calles, ancho_calle)
+    ys = _posiciones_filas(miny, maxy, module_length)
+    vacio = np.empty(0, dtype=float)
+    if len(xs) == 0 or len(ys) == 0:
+        indice = np.empty(0, dtype=np.int64)
+        return vacio, vacio, indice, indice, calles_x
+
+    ys_top = ys + module_length
+    franjas = shapely.box(xs, miny, xs + module_width, maxy)
+    instrumentation.contar('mesas_candidatas', len(xs) * len(ys))
+    instrumentation.contar('operaciones_overlay', 2 * len(xs))
+
+    # Pieces of each strip outside the zone: tables may touch them
+    partes, columna = shapely.get_parts(shapely.difference(franjas, zona),
+                                        return_index=True)
+    limites = shapely.bounds(partes)
+    bloqueadas = _filas_bloqueadas(ys, ys_top, columna, limites[:, 1],
+                                   limites[:, 3], len(xs), cerrado=False)
+
+    # Pieces of each strip inside a restricted zone: tables may not touch them
+    if indice_restringido is None:
+        indice_restringido = _indice_restringido(zona_restringida)
+    if indice_restringido is not None:
+        franja, poligono = indice_restringido.query(franjas, predicate='intersects')
+        partes, posicion = shapely.get_parts(
+            shapely.intersection(franjas[franja], indice_restringido.geometries.take(poligono)),
+            return_index=True)
+        limites = shapely.bounds(partes)
+        bloqueadas |= _filas_bloqueadas(ys, ys_top, franja[posicion], limites[:, 1],
+                                        limites[:, 3], len(xs), cerrado=True)
+
+    col, fila = np.nonzero(~bloqueadas)
+    return xs[col], ys[fila], col, fila, calles_x
+
+
+def _marcar_rangos(n_filas, n_columnas, fila, j0, j1):
+    """
+    Boolean mask with the inclusive column ranges [j0, j1] of each given row
+    set, clipped to the grid (difference array + one cumulative sum)
+    """
+    j0 = np.clip(j0, 0, n_columnas)
+    j1 = np.clip(j1, -1, n_columnas - 1)
+    validos = (fila >= 0) & (fila < n_filas) & (j0 <= j1)
+    marcas = np.zeros((n_filas, n_columnas + 1), dtype=np.int32)
+    np.add.at(marcas, (fila[validos], j0[validos]), 1)
+    np.add.at(marcas, (fila[validos], j1[validos] + 1), -1)
+    return np.cumsum(marcas[:, :-1], axis=1) > 0
+
+
+def _tramos_bloqueados(franjas, zona, restringidas):
+    """
+    Pieces of the row bands lying outside the zone or inside the restricted
+    zones
+
+    Args:
+        restringidas (STRtree or None): Index over the restricted polygons, so
+            each band is only intersected with the polygons it crosses
+
+    Returns:
+        tuple: (band index, bounds, bloquea) of all the blocked pieces;
+        bloquea is False for the slivers outside the zone, which tables may
+        touch
+    """
+    geometrias = [shapely.difference(franjas, zona)]
+    indices = [np.arange(len(franjas))]
+    restringida = [np.zeros(len(franjas), dtype=bool)]
+    if restringidas is not None:
+        franja, poligono = restringidas.query(franjas, predicate='intersects')
+        geometrias.append(shapely.intersection(
+            franjas[franja], restringidas.geometries.take(poligono)))
+        indices.append(franja)
+        restringida.append(np.ones(len(franja), dtype=bool))
+
+    partes, posicion = shapely.get_parts(np.concatenate(geometrias), return_index=True)
+    no_vacias = ~shapely.is_empty(partes)
+    partes, posicion = partes[no_vacias], posicion[no_vacias]
+    bloquea = np.concatenate(restringida)[posicion] | (shapely.area(partes) > 0)
+    return np.concatenate(indices)[posicion], shapely.bounds(partes), bloquea
+
+
+def _rasterizar_zona(zona, restringidas, minx, maxx, ys, module_length, r):
+    """
+    Rasterize one zone at table-row resolution for the raster engine
+
+    Each grid row of tables is a band [y, y + module_length] across the
+    zone, cut into pixels of r metres along x. The band is intersected once
+    with the outside of the zone and once with the nearby restricted zones;
+    since a table spans its whole band, the x-extent of every piece decides
+    which tables it blocks. Two masks per band:
+    - occupied: pixels whose closed x-range touches a blocked piece
+    - blocked: pixel centres strictly inside the x-extent of a piece (but
+      not of a sliver outside the zone), so any table over them is
+      infeasible
+
+    Returns:
+        dict: Pixel origin, resolution and count, pixel centres and the
+        cumulative sums of each mask along its band
+    """
+    # Widening of the pixel ranges against overlay rounding
+    eps = r * 1e-6
+    nx = max(1, int(np.ceil((maxx - minx) / r)))
+    franjas = shapely.box(minx, ys, minx + nx * r, ys + module_length)
+    franja, limites, bloquea = _tramos_bloqueados(franjas, zona, restringidas)
+    instrumentation.contar('operaciones_overlay', len(franjas))
+
+    j0 = np.ceil((limites[:, 0] - eps - minx) / r).astype(np.int64) - 1
+    j1 = np.floor((limites[:, 2] + eps - minx) / r).astype(np.int64)
+    ocupado = _marcar_rangos(len(ys), nx, franja, j0, j1)
+
+    centros_x = minx + (np.arange(nx) + 0.5) * r
+    j0 = np.searchsorted(centros_x, limites[bloquea, 0] + eps, side='left')
+    j1 = np.searchsorted(centros_x, limites[bloquea, 2] - eps, side='right') - 1
+    bloqueado = _marcar_rangos(len(ys), nx, franja[bloquea], j0, j1)
+
+    def sumas(mascara):
+        tabla = np.zeros((len(ys), nx + 1), dtype=np.int32)
+        np.cumsum(mascara, axis=1, dtype=np.int32, out=tabla[:, 1:])
+        return tabla
+
+    return {'minx': minx, 'r': r, 'nx': nx, 'centros_x': centros_x,
+            'suma_ocupado': sumas(ocupado), 'suma_bloqueado': sumas(bloqueado)}
+
+
+def _colocar_mesas_raster(zona, zona_restringida, minx, miny, maxx, maxy,
+                          module_width, module_length, pitch,
+                          modulos_entre_calles=float('inf'), ancho_calle=0,
+                          resolucion=None, refinar=True, cache=None,
+                          indice_restringido=None):
+    """
+    Raster screening placement of the tables of one zone for a given pitch
+
+    The zone is rasterized by _rasterizar_zona with one pixel row per grid
+    row of tables and `resolucion` metres per pixel along x (default a
+    quarter of the table width). With the cumulative sums of each row every
+    table is checked in O(1): no occupied pixel under it means feasible, a
+    blocked pixel centre under it means infeasible. The remaining tables
+    are the ones touching a boundary pixel; with refinar=True they get the
+    exact shapely check and the result matches the exact engine, with
+    refinar=False they are rejected.
+
+    Error bound (refinar=False): the screening never accepts a table the exact
+    engine rejects. It may reject feasible tables, but only those lying within
+    one pixel (resolucion along x) of the zone boundary or of a restricted
+    zone in their row, so the table deficit is bounded by the number of grid
+    cells in that band.
+
+    The raster does not depend on the pitch; pass the same `cache` dict for
+    every pitch of a sweep to build it once per zone. It takes 8 bytes per
+    pixel: rows of tables times the zone width over resolucion.
+    """
+    xs, calles_x = _posiciones_columnas(minx, maxx, module_width, pitch,
+                                        modulos_entre_calles, ancho_calle)
+    ys = _posiciones_filas(miny, maxy, module_length)
+    vacio = np.empty(0, dtype=float)
+    if len(xs) == 0 or len(ys) == 0:
+        indice = np.empty(0, dtype=np.int64)
+        return vacio, vacio, indice, indice, calles_x
+
+    r = resolucion or module_width / 4
+    if indice_restringido is None:
+        indice_restringido = _indice_restringido(zona_restringida)
+    # The pixels start at the zone bound, not at the (offset) grid origin, so
+    # one raster serves every pitch and x offset of the sweep
+    x_raster = min(minx, zona.bounds[0])
+    clave = (id(zona), id(zona_restringida), x_raster, miny, maxx, maxy, module_length, r)
+    raster = cache.get(clave) if cache is not None else None
+    instrumentation.contar('mesas_candidatas', len(xs) * len(ys))
+    if raster is None:
+        with instrumentation.etapa('rasterizar_zona', resolucion=r):
+            raster = _rasterizar_zona(zona, indice_restringido, x_raster, maxx, ys,
+                                      module_length, r)
+        if cache is not None:
+            cache[clave] = raster
+    nx = raster['nx']
+    filas = np.arange(len(ys))[None, :]
+
+    # Pixels overlapping the interior of each column of tables
+    x1 = xs + module_width
+    j0 = np.clip(np.floor((xs - x_raster) / r).astype(np.int64), 0, nx - 1)[:, None]
+    j1 = np.clip(np.ceil((x1 - x_raster) / r).astype(np.int64), 1, nx)[:, None]
+    suma = raster['suma_ocupado']
+    libre = suma[filas, j1] - suma[filas, j0] == 0
+
+    # Pixel centres inside each column of tables
+    j0 = np.searchsorted(raster['centros_x'], xs, side='left')[:, None]
+    j1 = np.searchsorted(raster['centros_x'], x1, side='right')[:, None]
+    suma = raster['suma_bloqueado']
+    descartada = suma[filas, j1] - suma[filas, j0] > 0
+
+    if refinar:
+        col, fila = np.nonzero(~libre & ~descartada)
+        if len(col):
+            shapely.prepare(zona)
+            libre[col, fila] = _mesas_validas(zona, indice_restringido, xs[col], ys[fila],
+                                              module_width, module_length)
+
+    col, fila = np.nonzero(libre)
+    return xs[col], ys[fila], col, fila, calles_x
+
+
+# Placement engines selectable with optimizar_paneles(motor=...)
+MOTORES = {
+    'vectorial': _colocar_mesas,
+    'scanline': _colocar_mesas_scanline,
+    'raster': _colocar_mesas_raster,
+}
+
+
+def _geometrias(zonas):
+    """
+    Shapely geometries of a GeoDataFrame or GeoSeries, of one geometry or of
+    a sequence of them, as an object array (empty for None)
+    """
+    if zonas is None:
+        return np.empty(0, dtype=object)
+    if isinstance(zonas, shapely.Geometry):
+        zonas = [zonas]
+    return np.asarray(getattr(zonas, 'geometry', zonas), dtype=object)
+
+
+def _preparar_geometria(zonas_habilitadas, zonas_inhabilitadas, fenced_distance,
+                        cache_dir=None):
+    """
+    Pitch-invariant geometry work, done once per optimization
+
+    With cache_dir the fenced zones are stored on disk, keyed by the content
+    of the enabled zones and the fenced distance, and reused by later runs.
+
+    Returns:
+        dict: Fenced enabled zones (None for invalid ones) and the union of the
+        restricted zones (None when there are none)
+    """
+    zonas = _geometrias(zonas_habilitadas)
+    zonas_fenced = None
+    if cache_dir:
+        clave = site_cache.clave_cache('fenced', *shapely.to_wkb(zonas), fenced_distance)
+        zonas_fenced = site_cache.leer_geometrias(cache_dir, clave)
+    if zonas_fenced is None:
+        # Same buffer resolution as GeoSeries.buffer
+        zonas_fenced = shapely.buffer(zonas, -fenced_distance, quad_segs=16)
+        zonas_fenced = [zona if zona.is_valid else None for zona in zonas_fenced]
+        if cache_dir:
+            site_cache.guardar_geometrias(cache_dir, clave, zonas_fenced)
+
+    zona_restringida_union = None
+    restringidas = _geometrias(zonas_inhabilitadas)
+    if len(restringidas):
+        zona_restringida_union = shapely.union_all(restringidas)
+
+    # Content fingerprint of the prepared geometry, keys cached evaluations
+    huella = hashlib.sha1()
+    for geometria in zonas_fenced + [zona_restringida_union]:
+        huella.update(shapely.to_wkb(geometria) if geometria is not None else b'-')
+
+    # Rotation centre of the grid angle search: centre of the fenced extent
+    validas = [zona for zona in zonas_fenced if zona is not None and not zona.is_empty]
+    minx, miny, maxx, maxy = shapely.total_bounds(validas) if validas else (0, 0, 0, 0)
 
-def optimizar_paneles(zonas_habilitadas, zonas_inhabilitadas, module_specs, 
+    return {
+        'zonas_fenced': zonas_fenced,
+        'zona_restringida_union': zona_restringida_union,
+        'huella': huella.hexdigest(),
+        'pivote': ((minx + maxx) / 2, (miny + maxy) / 2),
+    }
+
+
+def _rotar_geometria(geometria, angulo):
+    """
+    Geometry rotated by -angulo degrees around the pivot, so that an
+    axis-aligned grid laid out on it is rotated by angulo in the output CRS
+    """
+    if angulo == 0:
+        return geometria
+    girar = partial(rotate, angle=-angulo, origin=geometria['pivote'])
+    restringida = geometria['zona_restringida_union']
+    return dict(
+        geometria,
+        zonas_fenced=[girar(zona) if zona is not None else None
+                      for zona in geometria['zonas_fenced']],
+        zona_restringida_union=girar(restringida) if restringida is not None else None,
+        indice_restringido=None,
+    )
+
+
+def _rotar_xy(x, y, angulo, pivote):
+    """Rotate coordinate arrays by angulo degrees (counter-clockwise) around pivote"""
+    if angulo == 0:
+        return x, y
+    theta = np.radians(angulo)
+    dx, dy = x - pivote[0], y - pivote[1]
+    return (pivote[0] + dx * np.cos(theta) - dy * np.sin(theta),
+            pivote[1] + dx * np.sin(theta) + dy * np.cos(theta))
+
+
+def _preparar(geometria):
+    """Prepare the geometries in place for repeated predicate calls"""
+    for zona in geometria['zonas_fenced']:
+        if zona is not None:
+            shapely.prepare(zona)
+    if geometria.get('indice_restringido') is None:
+        geometria['indice_restringido'] = _indice_restringido(
+            geometria['zona_restringida_union'])
+    else:
+        # Prepared state does not survive pickling to a worker
+        shapely.prepare(geometria['indice_restringido'].geometries)
+    return geometria
+
+
+# Geometry of the running optimization inside a pool worker, one entry per
+# grid angle, set once per process by _iniciar_worker instead of being
+# pickled with every pitch
+_GEOMETRIA_WORKER = None
+
+
+def _iniciar_worker(geometrias):
+    global _GEOMETRIA_WORKER
+    _GEOMETRIA_WORKER = {angulo: _preparar(geometria)
+                         for angulo, geometria in geometrias.items()}
+
+
+def _evaluar_pitch(pitch, geometria, dimensiones, modulos_entre_calles, ancho_calle,
+                   motor='vectorial', opciones_motor=None, desfase=(0.0, 0.0),
+                   angulo=0.0):
+    """
+    Lay out every zone for one pitch
+
+    desfase shifts the grid origin from the zone's lower-left bound by a
+    fraction of the column period (x) and of the table length (y).
+
+    Returns:
+        dict: Pitch, grid angle and offset, table count and, per zone, the
+        accepted table corners and street positions (plain arrays, cheap to
+        send back from a worker)
+    """
+    module_width, module_length = dimensiones
+    opciones_motor = dict(opciones_motor or {})
+    if motor == 'raster':
+        # Pitch-invariant rasters, kept with the geometry while its angle is
+        # evaluated (see _evaluar_combinacion)
+        opciones_motor['cache'] = geometria.setdefault('rasters', {})
+    # Pitch-invariant index of the restricted polygons
+    opciones_motor['indice_restringido'] = _preparar(geometria)['indice_restringido']
+
+    zonas = []
+    total_modulos = 0
+    for zona in geometria['zonas_fenced']:
+        if zona is None:
+            zonas.append(None)
+            continue
+        minx, miny, maxx, maxy = zona.bounds
+        origen_x = minx + desfase[0] * (module_width + pitch)
+        origen_y = miny + desfase[1] * module_length
+        x0, y0, columna, fila, calles_x = MOTORES[motor](
+            zona, geometria['zona_restringida_union'], origen_x, origen_y, maxx, maxy,
+            module_width, module_length, pitch,
+            modulos_entre_calles, ancho_calle, **opciones_motor
+        )
+        total_modulos += len(x0)
+        instrumentation.registrar('mesas_aceptadas', zona=len(zonas), pitch=pitch,
+                                  angulo=angulo, desfase=list(desfase), mesas=len(x0))
+        zonas.append({'x0': x0, 'y0': y0, 'columna': columna, 'fila': fila,
+                      'calles_x': calles_x, 'miny': miny, 'maxy': maxy})
+
+    return {'pitch': pitch, 'angulo': angulo, 'desfase': desfase,
+            'total_modules': total_modulos, 'zonas': zonas}
+
+
+def _teselas(n_columnas, columnas_tesela, modulos_entre_calles):
+    """
+    Column index ranges [a, b) of the tiles of a zone
+
+    With streets the tiles hold whole street blocks, so every tile starts
+    right after a street and its column walk stays in phase with the
+    untiled one.
+    """
+    if math.isfinite(modulos_entre_calles) and float(modulos_entre_calles).is_integer() \
+            and modulos_entre_calles > 0:
+        bloque = int(modulos_entre_calles)
+        columnas_tesela = max(1, round(columnas_tesela / bloque)) * bloque
+    return [(a, min(a + columnas_tesela, n_columnas))
+            for a in range(0, n_columnas, columnas_tesela)]
+
+
+def _colocar_tesela(tarea):
+    """
+    Lay out one tile; the task carries only the tile's clipped geometry
+
+    Returns the engine's tuple plus the tile's instrumentation (None when
+    not measured), to be merged by the caller.
+    """
+    motor, argumentos, opciones_motor, medir = tarea
+    if not medir:
+        return MOTORES[motor](*argumentos, **(opciones_motor or {})) + (None,)
+    with instrumentation.capturar() as inst:
+        with inst.etapa('colocar_tesela', columnas_desde=float(argumentos[2])):
+            resultado = MOTORES[motor](*argumentos, **(opciones_motor or {}))
+    return resultado + (inst.a_dict(),)
+
+
+def _tareas_teselas(pitch, geometria, dimensiones, modulos_entre_calles, ancho_calle,
+                    motor='vectorial', opciones_motor=None, desfase=(0.0, 0.0),
+                    columnas_tesela=200):
+    """
+    Split every zone into column tiles for one pitch
+
+    The columns of each zone are walked once and split into tiles of about
+    columnas_tesela columns (whole street blocks). The zone and the
+    restricted union are clipped to each tile's columns, padded by half a
+    table width so no table edge lies on a clip edge.
+
+    Returns:
+        tuple: (zones, tasks). Per zone (None if invalid) its street
+        positions, bounds and the first column of each of its tiles; one
+        _colocar_tesela task per tile, in zone and column order
+    """
+    module_width, module_length = dimensiones
+    margen = module_width / 2
+    medir = instrumentation.actual() is not None
+    tareas = []
+    zonas = []
+    for zona in geometria['zonas_fenced']:
+        if zona is None:
+            zonas.append(None)
+            continue
+        minx, miny, maxx, maxy = zona.bounds
+        origen_x = minx + desfase[0] * (module_width + pitch)
+        origen_y = miny + desfase[1] * module_length
+        xs, calles_x = _posiciones_columnas(origen_x, maxx, module_width, pitch,
+                                            modulos_entre_calles, ancho_calle)
+        zonas.append({'calles_x': calles_x, 'miny': miny, 'maxy': maxy, 'teselas': []})
+
+        for a, b in _teselas(len(xs), columnas_tesela, modulos_entre_calles):
+            x_fin = maxx if b == len(xs) else xs[b - 1] + module_width
+            caja = shapely.box(xs[a] - margen, origen_y - margen, x_fin + margen, maxy + margen)
+            zona_tesela = shapely.intersection(zona, caja)
+            if zona_tesela.is_empty:
+                continue
+            restringida = geometria['zona_restringida_union']
+            if restringida is not None:
+                restringida = shapely.intersection(restringida, caja)
+                if restringida.is_empty:
+                    restringida = None
+            zonas[-1]['teselas'].append(a)
+            tareas.append((motor, (zona_tesela, restringida, xs[a], origen_y, x_fin, maxy,
+                                   module_width, module_length, pitch,
+                                   modulos_entre_calles, ancho_calle), opciones_motor, medir))
+    return zonas, tareas
+
+
+def _evaluar_pitch_teselas(pitch, geometria, dimensiones, modulos_entre_calles, ancho_calle,
+                           motor='vectorial', opciones_motor=None, desfase=(0.0, 0.0),
+                           angulo=0.0, columnas_tesela=200, executor=None):
+    """
+    Tiled version of _evaluar_pitch, same result
+
+    Every tile of _tareas_teselas is laid out on its own, starting its walk
+    at the exact x of its first column, so positions are bit-identical to
+    the untiled walk. With an executor the tiles are laid out on the pool;
+    results are merged in zone and column order whatever the completion
+    order.
+    """
+    zonas, tareas = _tareas_teselas(pitch, geometria, dimensiones, modulos_entre_calles,
+                                    ancho_calle, motor, opciones_motor, desfase,
+                                    columnas_tesela)
+    piezas = iter(executor.map(_colocar_tesela, tareas) if executor is not None
+                  else map(_colocar_tesela, tareas))
+    total_modulos = 0
+    for i, zona in enumerate(zonas):
+        if zona is None:
+            continue
+        partes = []
+        for a in zona.pop('teselas'):
+            x0, y0, columna, fila, _, metricas = next(piezas)
+            if metricas is not None:
+                instrumentation.actual().fusionar(metricas)
+            partes.append((x0, y0, columna + a, fila))
+        if partes:
+            x0, y0, columna, fila = (np.concatenate(p) for p in zip(*partes))
+        else:
+            x0 = y0 = np.empty(0, dtype=float)
+            columna = fila = np.empty(0, dtype=np.int64)
+        total_modulos += len(x0)
+        instrumentation.registrar('mesas_aceptadas', zona=i, pitch=pitch, angulo=angulo,
+                                  desfase=list(desfase), mesas=len(x0))
+        zona.update({'x0': x0, 'y0': y0, 'columna': columna, 'fila': fila})
+
+    return {'pitch': pitch, 'angulo': angulo, 'desfase': desfase,
+            'total_modules': total_modulos, 'zonas': zonas}
+
+
+def _evaluar_combinacion(combinacion, geometrias=None, medir=False, **kwargs):
+    """
+    Evaluate one (angle, x offset, y offset, pitch) grid combination
+
+    With medir=True the evaluation is instrumented into a fresh collector
+    (this may run in a pool worker) returned under 'metricas', for the
+    caller to merge.
+    """
+    angulo, fraccion_x, fraccion_y, pitch = combinacion
+    if geometrias is None:
+        geometrias = _GEOMETRIA_WORKER
+    # The sweep is angle-major: only the rasters of the current angle are kept
+    for otro, geometria in geometrias.items():
+        if otro != angulo:
+            geometria.pop('rasters', None)
+    if not medir:
+        return _evaluar_pitch(pitch, geometrias[angulo], desfase=(fraccion_x, fraccion_y),
+                              angulo=angulo, **kwargs)
+    with instrumentation.capturar() as inst:
+        with inst.etapa('evaluar_pitch', pitch=pitch, angulo=angulo,
+                        desfase=[fraccion_x, fraccion_y]):
+            resultado = _evaluar_pitch(pitch, geometrias[angulo],
+                                       desfase=(fraccion_x, fraccion_y), angulo=angulo, **kwargs)
+    resultado['metricas'] = inst.a_dict()
+    return resultado
+
+
+def _clave_evaluacion(huella, dimensiones, modulos_entre_calles, ancho_calle, motor,
+                      opciones_motor, combinacion):
+    """
+    Memo key of one evaluation: geometry fingerprint, layout parameters and
+    the (angle, x offset, y offset, pitch) combination
+    """
+    angulo, fx, fy, pitch = combinacion
+    return (huella, tuple(dimensiones), modulos_entre_calles, ancho_calle, motor,
+            tuple(sorted((opciones_motor or {}).items())), angulo, fx, fy, round(pitch, 9))
+
+
+def _secuencia_pitch(pitch_min, pitch_max, pitch_step):
+    """Pitches of the sweep, accumulated like the original while loop"""
+    pitches = []
+    current_pitch = pitch_min
+    while current_pitch <= pitch_max:
+        pitches.append(current_pitch)
+        current_pitch += pitch_step
+    return pitches
+
+
+def _construir_layout(resultado, module_width, module_length, pivote=(0, 0)):
+    """
+    Layout of one evaluation, with the table centres rotated back to the
+    output CRS when the grid was laid out at an angle
+    """
+    angulo = resultado.get('angulo', 0)
+    partes = [(i, zona) for i, zona in enumerate(resultado['zonas']) if zona is not None]
+    if not partes:
+        return Layout.desde_arrays([], [], [], [], [], module_width, module_length, angulo)
+
+    centro_x = np.concatenate([zona['x0'] + module_width/2 for _, zona in partes])
+    centro_y = np.concatenate([zona['y0'] + module_length/2 for _, zona in partes])
+    centro_x, centro_y = _rotar_xy(centro_x, centro_y, angulo, pivote)
+    return Layout.desde_arrays(
+        centro_x, centro_y,
+        np.concatenate([np.full(len(zona['x0']), i) for i, zona in partes]),
+        np.concatenate([zona['columna'] for _, zona in partes]),
+        np.concatenate([zona['fila'] for _, zona in partes]),
+        module_width, module_length, angulo
+    )
+
+
+def _lotes_layout(zonas, tareas, module_width, module_length, angulo=0.0, pivote=(0, 0)):
+    """
+    Generator of the Layout of each tile of _tareas_teselas, in zone and
+    column order
+
+    Each tile is laid out only when the consumer asks for the next batch, so
+    at most one tile's tables are held at a time. Empty tiles are skipped.
+    """
+    piezas = map(_colocar_tesela, tareas)
+    for i, zona in enumerate(zonas):
+        if zona is None:
+            continue
+        for a in zona['teselas']:
+            x0, y0, columna, fila, _, metricas = next(piezas)
+            if metricas is not None and instrumentation.actual() is not None:
+                instrumentation.actual().fusionar(metricas)
+            if not len(x0):
+                continue
+            centro_x, centro_y = _rotar_xy(x0 + module_width/2, y0 + module_length/2,
+                                           angulo, pivote)
+            yield Layout.desde_arrays(centro_x, centro_y, np.full(len(x0), i), columna + a,
+                                      fila, module_width, module_length, angulo)
+
+
+def _calles(resultado, ancho_calle, pivote=(0, 0)):
+    """Street dicts of one evaluation, rotated back like the tables"""
+    angulo = resultado.get('angulo', 0)
+    calles = []
+    for zona in resultado['zonas']:
+        if zona is None:
+            continue
+        # Add street boundary lines
+        for street_x in zona['calles_x']:
+            x, y = _rotar_xy(np.array([street_x, street_x, street_x + ancho_calle, street_x + ancho_calle]),
+                             np.array([zona['miny'], zona['maxy'], zona['miny'], zona['maxy']]),
+                             angulo, pivote)
+            street_left_line = LineString([
+                (x[0], y[0]),
+                (x[1], y[1])
+            ])
+            street_right_line = LineString([
+                (x[2], y[2]),
+                (x[3], y[3])
+            ])
+            calles.append({
+                'left_boundary': street_left_line,
+                'right_boundary': street_right_line,
+                'width': ancho_calle
+            })
+    return calles
+
+
+def _refinar_pitch(evaluar_pitches, energia, a, b, tolerancia):
+    """
+    Golden-section search of the best pitch inside the bracket [a, b]
+
+    Each step reuses one of the two interior points of the previous one, so
+    it costs a single new layout; ties keep the smaller pitch.
+
+    Returns:
+        list: Every result returned by evaluar_pitches, in evaluation order
+    """
+    razon = (math.sqrt(5) - 1) / 2
+    c = b - razon * (b - a)
+    d = a + razon * (b - a)
+    evaluados = evaluar_pitches([c, d])
+    fc, fd = (energia(r) for r in evaluados)
+    while b - a > tolerancia:
+        if fc >= fd:
+            b, d, fd = d, c, fc
+            c = b - razon * (b - a)
+            evaluados += evaluar_pitches([c])
+            fc = energia(evaluados[-1])
+        else:
+            a, c, fc = c, d, fd
+            d = a + razon * (b - a)
+            evaluados += evaluar_pitches([d])
+            fd = energia(evaluados[-1])
+    return evaluados
+
+
+@instrumentation.cronometrado()
+def optimizar_paneles(zonas_habilitadas, zonas_inhabilitadas, module_specs,
                      panels_x_module, pitch_min, pitch_max, pitch_step,
                      modulos_entre_calles=float('inf'), ancho_calle=0,
-                     fenced_distance=0):
+                     fenced_distance=0, max_workers=1, motor='vectorial',
+                     resolucion_raster=None, refinar_raster=True,
+                     busqueda='barrido', tolerancia_pitch=0.01, cache=None,
+                     angulos=(0,), desfases_x=1, desfases_y=1, cache_dir=None,
+                     columnas_tesela=None, stream=False, geometrias_preparadas=None,
+                     cancelar=None, criterio='capacidad', opciones_rendimiento=None):
     """
     Optimize solar PV module placement with multiple enhancements:
     - Fenced area creation
     - Pitch range optimization
     - Street placement between module groups
+
+    The zones are GeoDataFrames in a projected CRS, as cargar_kml returns
+    them, or plain shapely polygons in metres: one geometry, a list or an
+    array of them (None for no restricted zones). The placement itself only
+    needs NumPy and shapely; geopandas and pyproj are not imported here.
+
+    The fenced zones and the restricted union are computed once for the whole
+    sweep. With max_workers other than 1 the pitches are evaluated on a
+    ProcessPoolExecutor (None uses every core); results are reduced in pitch
+    order, so the chosen pitch does not depend on the number of workers.
+
+    motor selects the placement engine: 'vectorial' (exact per-table
+    predicates, default), 'scanline' (per-column strip intervals, faster
+    for small tables on long sites) or 'raster' (screening on a raster with
+    one pixel row per grid row of tables and resolucion_raster metres per
+    pixel along it, built once per zone and angle for every pitch of the
+    sweep; see _colocar_mesas_raster for its error bound,
+    refinar_raster=False skips the exact boundary checks).
+
+    Choosing the engine: the three place the same tables ('scanline' up to
+    floating-point noise on a boundary). 'vectorial' costs one predicate
+    per candidate table and is the reference, fine for small sites and
+    single runs. 'scanline' costs two overlays per table column and pitch,
+    about twice as fast as 'vectorial' when columns hold many tables.
+    'raster' costs one overlay per table row, once per zone and angle, and
+    then only array work per pitch: the fastest for pitch sweeps and
+    offset or angle searches on large sites. benchmarks/motores.py times
+    them on a synthetic site.
+
+    busqueda='refinada' runs the pitch_step sweep and then a golden-section
+    search between the neighbours of its best pitch, down to
+    tolerancia_pitch; it returns the usual tuple plus the evaluation history
+    (one dict per requested pitch, in order). Evaluations are memoized in
+    `cache`, keyed by the geometry fingerprint and the layout parameters;
+    passing the same dict to later calls reuses their layouts too. Any
+    object with get() and item assignment will do, e.g. a bounded LRU.
+
+    Besides the pitch, the grid can be searched over its rotation (angulos,
+    degrees counter-clockwise around the centre of the fenced extent) and
+    its origin: desfases_x / desfases_y evenly spaced phase offsets within
+    one column period / table length from the zone's lower-left bound.
+    Every (angle, offset, pitch) combination is laid out by the vectorized
+    engines and scored; ties keep the earliest angle, the smallest offset
+    and the smallest pitch. The refined search keeps the best angle and
+    offset of the sweep fixed.
+
+    The placed tables are returned as a Layout (modules.layout): centres,
+    zone, column and row in NumPy arrays, geometries built on demand. Only
+    the summary numbers of the other evaluations are kept.
+
+    cache_dir stores the fenced zones on disk (see modules.site_cache) so
+    repeat runs on the same site skip the buffer.
+
+    columnas_tesela switches on the tiled mode for very large zones: each
+    evaluation splits the zones into tiles of about that many grid columns
+    (see _evaluar_pitch_teselas) and, with max_workers other than 1, lays
+    the tiles out in parallel instead of the pitches. Each worker task only
+    carries its tile's clipped geometry, and the merged layout is the same
+    as the untiled one.
+
+    stream=True returns, in place of the Layout, a generator of Layout
+    batches: one per tile (columnas_tesela columns, COLUMNAS_LOTE by
+    default) of each zone, in zone and column order. The search then keeps
+    only summary numbers and the chosen layout is laid out tile by tile, in
+    this process, as the batches are consumed, so the tables are never all
+    in memory at once. Totals, pitch and streets are known up front; feed
+    the generator to export_results, which consumes it in one pass.
+
+    geometrias_preparadas is an optional dict, one per site, that keeps the
+    prepared geometry (fenced zones, restricted union and index, rotated
+    copies) per fenced distance; later calls with the same zone
+    GeoDataFrames reuse it instead of preparing it again. cancelar is an
+    optional threading.Event checked between evaluations: once set, the
+    optimization stops with OptimizacionCancelada.
+
+    criterio sets what the search maximizes. 'capacidad' (default) is the
+    installed power, which favours the tightest pitch. 'energia' is the
+    annual energy: capacity times the specific yield of the pitch and grid
+    angle from modules.shading.ModeloRendimiento, which accounts for row to
+    row shading at the site's latitude. 'lcoe' minimizes an LCOE proxy,
+    (coste_wp * Wp + coste_ha * fenced ha + coste_fijo) / (kWh per year *
+    vida_util): the area cost is paid whatever the pitch, so it weighs the
+    capacity lost to wide pitches against the shading lost to tight ones;
+    with no area or fixed cost it favours the least shaded pitch.
+    opciones_rendimiento holds the ModeloRendimiento keywords (racking,
+    inclinacion, claridad, ...) and the cost keys of COSTES_POR_DEFECTO;
+    with plain polygons, which carry no CRS, it also needs the site's
+    'latitud' and 'longitud'. The yields of
+    the whole sweep are computed in one batch; with another criterion than
+    'capacidad' the evaluation summaries also hold 'yield_kwh_kwp',
+    'energy_kwh' and 'lcoe'.
     """
-    print("\n=== STARTING ENHANCED MODULE OPTIMIZATION ===")
+    if busqueda not in ('barrido', 'refinada'):
+        raise ValueError(f"Unknown pitch search '{busqueda}', expected 'barrido' or 'refinada'")
+    if motor not in MOTORES:
+        raise ValueError(f"Unknown placement engine '{motor}', expected one of {sorted(MOTORES)}")
+    if criterio not in CRITERIOS:
+        raise ValueError(f"Unknown pitch criterion '{criterio}', expected one of {CRITERIOS}")
+    logger.info("Starting module optimization")
 
-    pitch_results = []
-    current_pitch = pitch_min
+    preparada = (geometrias_preparadas or {}).get(fenced_distance)
+    if preparada is None or preparada['zonas'][0] is not zonas_habilitadas \
+            or preparada['zonas'][1] is not zonas_inhabilitadas:
+        with instrumentation.etapa('preparar_geometria'):
+            geometria = _preparar_geometria(zonas_habilitadas, zonas_inhabilitadas,
+                                            fenced_distance, cache_dir=cache_dir)
+        # The zones are kept with their geometry, so identity checks stay valid
+        preparada = {'zonas': (zonas_habilitadas, zonas_inhabilitadas), 'rotadas': {0: geometria}}
+        if geometrias_preparadas is not None:
+            geometrias_preparadas[fenced_distance] = preparada
+    geometria = preparada['rotadas'][0]
+    for i, zona in enumerate(geometria['zonas_fenced']):
+        if zona is None:
+            logger.warning("Zone %d is invalid, skipping", i + 1)
+            continue
+        logger.debug("Zone %d: area %.1f sq meters, bounds %s", i + 1, zona.area, zona.bounds)
 
-    while current_pitch <= pitch_max:
-        # Apply fenced area reduction
-        zonas_habilitadas_fenced = zonas_habilitadas.copy()
-        zonas_habilitadas_fenced.geometry = zonas_habilitadas_fenced.geometry.buffer(-fenced_distance)
-
-        # Prepare restricted zones union
-        zona_restringida_union = zonas_inhabilitadas.geometry.unary_union if not zonas_inhabilitadas.empty else None
-
-        lineas_paneles = []
-        total_modulos = 0
-        total_panels = 0
-        total_energy = 0
-        calles = []
-
-        # Calculate module dimensions
-        module_width = module_specs['length']
-        module_length = module_specs['width'] * panels_x_module
-        stc = module_specs['stc'] * panels_x_module
-
-        for i, zona in enumerate(zonas_habilitadas_fenced.geometry):
-            print(f"\nProcessing zone {i+1} with pitch {current_pitch}")
-            print(f"Zone area: {zona.area} sq meters")
-            print(f"Zone bounds: {zona.bounds}")
-
-            if not zona.is_valid:
-                print(f"Zone {i+1} is invalid, skipping...")
-                continue
+    # Calculate module dimensions
+    module_width = module_specs['length']
+    module_length = module_specs['width'] * panels_x_module
+    dimensiones = (module_width, module_length)
 
-            minx, miny, maxx, maxy = zona.bounds
-            current_x = minx
-            modules_in_zone = 0
-            column_count = 0
+    opciones_motor = None
+    if motor == 'raster':
+        opciones_motor = {'resolucion': resolucion_raster, 'refinar': refinar_raster}
 
-            while current_x + module_width <= maxx:
-                current_y = miny
-                column_modules = 0
-
-                while current_y + module_length <= maxy:
-                    module_polygon = Polygon([
-                        (current_x, current_y),
-                        (current_x + module_width, current_y),
-                        (current_x + module_width, current_y + module_length),
-                        (current_x, current_y + module_length)
-                    ])
-
-                    # Check if module is within enabled zone and not in restricted zones
-                    if (zona.contains(module_polygon) and
-                        (zona_restringida_union is None or not module_polygon.intersects(zona_restringida_union))):
-                        module_line = LineString([
-                            (current_x + module_width/2, current_y),
-                            (current_x + module_width/2, current_y + module_length)
-                        ])
-                        lineas_paneles.append(module_line)
-                        total_modulos += 1
-                        modules_in_zone += 1
-                        column_modules += 1
-                        current_y += module_length
-                    else:
-                        # Skip placing module if it intersects with a restricted zone
-                        current_y += module_length
-
-                # Increment column count
-                column_count += 1
-
-                if column_count == modulos_entre_calles:
-                    # Add street boundary lines
-                    street_left_line = LineString([
-                        (current_x + module_width, miny),
-                        (current_x + module_width, maxy)
-                    ])
-                    street_right_line = LineString([
-                        (current_x + module_width + ancho_calle, miny),
-                        (current_x + module_width + ancho_calle, maxy)
-                    ])
-                    calles.append({
-                        'left_boundary': street_left_line,
-                        'right_boundary': street_right_line,
-                        'width': ancho_calle
-                    })
-                    current_x += module_width + ancho_calle
-                    column_count = 0
-                else:
-                    current_x += module_width + current_pitch
-
-            total_panels = total_modulos * panels_x_module
-            total_energy = total_panels * module_specs['stc']
-
-            print(f"\nPitch {current_pitch} Summary:")
-            print(f"Total modules: {total_modulos}")
-            print(f"Total panels: {total_panels}")
-            print(f"Total energy generated: {total_energy:.2f} W")
-
-            pitch_results.append({
-                'pitch': current_pitch,
-                'total_modules': total_modulos,
-                'total_panels': total_panels,
-                'total_energy': total_energy,
-                'lineas_paneles': lineas_paneles,
-                'calles': calles
-            })
+    pitches = _secuencia_pitch(pitch_min, pitch_max, pitch_step)
+    fracciones_x = [k / desfases_x for k in range(desfases_x)]
+    fracciones_y = [k / desfases_y for k in range(desfases_y)]
+    combinaciones = [(angulo, fx, fy, pitch) for angulo in angulos
+                     for fx in fracciones_x for fy in fracciones_y for pitch in pitches]
+    buscar_rejilla = len(combinaciones) > len(pitches)
+
+    modelo = None
+    if criterio != 'capacidad':
+        opciones = dict(opciones_rendimiento or {})
+        costes = {clave: opciones.pop(clave, valor) for clave, valor in COSTES_POR_DEFECTO.items()}
+        hectareas = sum(zona.area for zona in geometria['zonas_fenced'] if zona is not None) / 1e4
+        coste_sitio = costes['coste_ha'] * hectareas + costes['coste_fijo']
+        with instrumentation.etapa('rendimiento'):
+            if 'latitud' in opciones:
+                modelo = ModeloRendimiento(opciones.pop('latitud'), opciones.pop('longitud'),
+                                           module_specs, module_width, **opciones)
+            elif getattr(zonas_habilitadas, 'crs', None) is None:
+                raise ValueError("Zones without a CRS need 'latitud' and 'longitud' in "
+                                 "opciones_rendimiento")
+            else:
+                modelo = ModeloRendimiento.desde_zonas(zonas_habilitadas, module_specs,
+                                                       module_width, **opciones)
+            # Specific yield of every (angle, pitch) of the sweep, one batch per angle
+            rendimientos = {}
+            for angulo in angulos:
+                for pitch, valor in zip(pitches, modelo.rendimiento(pitches, angulo)):
+                    rendimientos[angulo, pitch] = float(valor)
+    for angulo in angulos:
+        if angulo not in preparada['rotadas']:
+            preparada['rotadas'][angulo] = _rotar_geometria(geometria, angulo)
+    geometrias = {angulo: preparada['rotadas'][angulo] for angulo in angulos}
+
+    evaluar = partial(_evaluar_combinacion, dimensiones=dimensiones,
+                      modulos_entre_calles=modulos_entre_calles,
+                      ancho_calle=ancho_calle, motor=motor,
+                      opciones_motor=opciones_motor,
+                      medir=instrumentation.actual() is not None)
+    clave = partial(_clave_evaluacion, geometria['huella'], dimensiones,
+                    modulos_entre_calles, ancho_calle, motor, opciones_motor)
+    if cache is None:
+        cache = {}
+    historial = []
+
+    def resumen(resultado):
+        total_modulos = resultado['total_modules']
+        total_panels = total_modulos * panels_x_module
+        fila = {
+            'pitch': resultado['pitch'],
+            'angulo': resultado['angulo'],
+            'desfase': resultado['desfase'],
+            'total_modules': total_modulos,
+            'total_panels': total_panels,
+            'total_energy': total_panels * module_specs['stc'],
+        }
+        if modelo is not None:
+            clave_rendimiento = (resultado['angulo'], resultado['pitch'])
+            if clave_rendimiento not in rendimientos:
+                # Pitches of the refined search
+                rendimientos[clave_rendimiento] = float(
+                    modelo.rendimiento([resultado['pitch']], resultado['angulo'])[0])
+            fila['yield_kwh_kwp'] = rendimientos[clave_rendimiento]
+            fila['energy_kwh'] = fila['total_energy'] / 1000 * fila['yield_kwh_kwp']
+            coste = costes['coste_wp'] * fila['total_energy'] + coste_sitio
+            fila['lcoe'] = (coste / (fila['energy_kwh'] * costes['vida_util'])
+                            if fila['energy_kwh'] > 0 else math.inf)
+        return fila
+
+    def puntuacion(fila):
+        """Value the search maximizes"""
+        if criterio == 'energia':
+            return fila['energy_kwh']
+        if criterio == 'lcoe':
+            return -fila['lcoe']
+        return fila['total_energy']
+
+    orden_angulos = {angulo: i for i, angulo in enumerate(angulos)}
+
+    def prioridad(fila, combinacion):
+        """Sort key of the reduction: best score first, then sweep order"""
+        angulo, fx, fy, pitch = combinacion
+        return (-puntuacion(fila), orden_angulos[angulo], fx, fy, pitch)
+
+    # Only the summary numbers of each evaluation are kept (in the cache);
+    # the table arrays are kept for the best evaluation seen so far only
+    mejor = {'prioridad': None, 'clave': None, 'resultado': None}
+
+    def comprobar_cancelacion():
+        if cancelar is not None and cancelar.is_set():
+            raise OptimizacionCancelada("Optimization cancelled")
+
+    def evaluar_combinaciones(lista, etapa='barrido'):
+        """Summaries of the given combinations, laying out only the uncached ones"""
+        claves = [clave(combinacion) for combinacion in lista]
+        # Summaries of this call, read once: a bounded cache may drop them
+        evaluados = {}
+        pendientes = {}
+        for combinacion, c in zip(lista, claves):
+            resultado = cache.get(c)
+            if resultado is None:
+                pendientes.setdefault(c, combinacion)
+            else:
+                evaluados[c] = resultado
+        if columnas_tesela or executor is None:
+            resultados = (evaluar_local(combinacion) for combinacion in pendientes.values())
+        else:
+            resultados = executor.map(evaluar, pendientes.values())
+        for (c, combinacion), resultado in zip(pendientes.items(), resultados):
+            comprobar_cancelacion()
+            zonas = resultado.pop('zonas')
+            metricas = resultado.pop('metricas', None)
+            if metricas is not None:
+                instrumentation.actual().fusionar(metricas)
+            instrumentation.contar('evaluaciones')
+            cache[c] = evaluados[c] = resultado
+
+            fila = resumen(resultado)
+            if mejor['prioridad'] is None or prioridad(fila, combinacion) < mejor['prioridad']:
+                mejor.update(prioridad=prioridad(fila, combinacion), clave=c,
+                             resultado=None if stream else dict(resultado, zonas=zonas))
+            del zonas
+
+            logger.debug("Pitch %s, angle %s, offset %s: %d tables, %d panels, %.2f W",
+                         fila['pitch'], fila['angulo'], fila['desfase'], fila['total_modules'],
+                         fila['total_panels'], fila['total_energy'])
+
+        instrumentation.contar('evaluaciones_en_cache', len(lista) - len(pendientes))
+        filas = []
+        for combinacion, c in zip(lista, claves):
+            fila = dict(resumen(evaluados[c]), pitch=combinacion[3])
+            historial.append(dict(fila, etapa=etapa, en_cache=c not in pendientes))
+            filas.append(dict(fila, combinacion=combinacion))
+        return filas
+
+    def evaluar_local(combinacion):
+        """One evaluation in this process (tiled: tiles on the executor, if any)"""
+        comprobar_cancelacion()
+        if columnas_tesela:
+            angulo, fx, fy, pitch = combinacion
+            with instrumentation.etapa('evaluar_pitch', pitch=pitch, angulo=angulo,
+                                       desfase=[fx, fy]):
+                return _evaluar_pitch_teselas(
+                    pitch, geometrias[angulo], dimensiones, modulos_entre_calles, ancho_calle,
+                    motor=motor, opciones_motor=opciones_motor, desfase=(fx, fy),
+                    angulo=angulo, columnas_tesela=columnas_tesela, executor=executor)
+        _preparar(geometrias[combinacion[0]])
+        return evaluar(combinacion, geometrias=geometrias)
+
+    executor = None
+    if columnas_tesela and max_workers != 1:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    elif max_workers != 1 and len(combinaciones) > 1:
+        executor = ProcessPoolExecutor(max_workers=max_workers,
+                                       initializer=_iniciar_worker,
+                                       initargs=(geometrias,))
+    try:
+        pitch_results = evaluar_combinaciones(combinaciones)
+
+        if busqueda == 'refinada' and pitch_results:
+            angulo, fx, fy, pitch = min(
+                pitch_results, key=lambda fila: prioridad(fila, fila['combinacion']))['combinacion']
+            posicion = pitches.index(pitch)
+            a = pitches[max(posicion - 1, 0)]
+            b = pitches[min(posicion + 1, len(pitches) - 1)]
+            logger.info("Refining pitch between %s and %s", a, b)
+            pitch_results += _refinar_pitch(
+                lambda lista: evaluar_combinaciones(
+                    [(angulo, fx, fy, pitch) for pitch in lista], etapa='refinamiento'),
+                puntuacion, a, b, tolerancia_pitch)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for geometria_angulo in geometrias.values():
+            geometria_angulo.pop('rasters', None)
+
+    best_result = min(pitch_results, key=lambda fila: prioridad(fila, fila['combinacion']))
+    logger.info("Optimization complete: best pitch %s%s, %d tables, %.2f W",
+                best_result['pitch'],
+                f", grid angle {best_result['angulo']} deg, offset {best_result['desfase']}"
+                if buscar_rejilla else '',
+                best_result['total_modules'], best_result['total_energy'])
+    if modelo is not None:
+        logger.info("Annual energy %.1f MWh (%.1f kWh/kWp), LCOE proxy %.4f per kWh",
+                    best_result['energy_kwh'] / 1000, best_result['yield_kwh_kwp'],
+                    best_result['lcoe'])
 
-            current_pitch += pitch_step
+    if stream:
+        # Tiles of the chosen combination, laid out lazily by the generator
+        angulo, fx, fy, pitch = best_result['combinacion']
+        zonas, tareas = _tareas_teselas(pitch, geometrias[angulo], dimensiones,
+                                        modulos_entre_calles, ancho_calle, motor,
+                                        opciones_motor, (fx, fy),
+                                        columnas_tesela or COLUMNAS_LOTE)
+        lineas_paneles = _lotes_layout(zonas, tareas, module_width, module_length,
+                                       angulo, pivote=geometria['pivote'])
+        calles = _calles({'angulo': angulo, 'zonas': zonas}, ancho_calle,
+                         pivote=geometria['pivote'])
+    else:
+        resultado = mejor['resultado']
+        if mejor['clave'] != clave(best_result['combinacion']):
+            # The best layout came from a previous call's cache: lay it out again
+            executor = None
+            resultado = evaluar_local(best_result['combinacion'])
+            metricas = resultado.pop('metricas', None)
+            if metricas is not None:
+                instrumentation.actual().fusionar(metricas)
 
-    best_result = max(pitch_results, key=lambda x: x['total_energy'])
-    print("\n=== OPTIMIZATION COMPLETE ===")
-    print(f"Best Pitch: {best_result['pitch']}")
-    print(f"Maximum Energy: {best_result['total_energy']:.2f} W")
+        with instrumentation.etapa('construir_layout'):
+            lineas_paneles = _construir_layout(resultado, module_width, module_length,
+                                               pivote=geometria['pivote'])
+            calles = _calles(resultado, ancho_calle, pivote=geometria['pivote'])
 
     return (
-        best_result['lineas_paneles'],
+        lineas_paneles,
         best_result['total_modules'],
         best_result['total_energy'],
         best_result['pitch'],
-        best_result.get('calles', [])
-    )
\ No newline at end of file
+        calles
+    ) + ((historial,) if busqueda == 'refinada' else ())
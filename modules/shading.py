@@ -0,0 +1,235 @@
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Solar constant (W/m2)
+IRRADIANCIA_EXTRATERRESTRE = 1361.0
+
+# T_NOCT used when the catalog leaves it empty (degC)
+T_NOCT_POR_DEFECTO = 45.0
+
+RACKINGS = ('FixTilt', 'Tracker')
+
+
+def centroide_wgs84(zonas_habilitadas):
+    """(latitude, longitude) of the centre of the enabled zones"""
+    from modules.kml_loader import obtener_transformador
+    centro = zonas_habilitadas.geometry.union_all().centroid
+    lon, lat = obtener_transformador(zonas_habilitadas.crs.to_string(), 'EPSG:4326').transform(
+        centro.x, centro.y)
+    return float(lat), float(lon)
+
+
+def posiciones_solares(latitud, longitud, paso_minutos=60):
+    """
+    Sun positions and clear-sky irradiance over one year, vectorized
+
+    The sun position follows the NOAA (Spencer) series for the declination
+    and the equation of time, evaluated at the middle of every time step in
+    UTC. Clear-sky beam irradiance uses the Meinel model on the Kasten-Young
+    air mass, with the diffuse horizontal irradiance taken as a tenth of the
+    beam. Only the daylight steps are returned.
+
+    Args:
+        latitud (float): Site latitude in degrees
+        longitud (float): Site longitude in degrees, east positive
+        paso_minutos (int): Time step
+
+    Returns:
+        dict: Per daylight step the sun unit vector 'sol' (n, 3) in
+        east-north-up, its elevation in degrees, 'dni' and 'dhi' in W/m2 and
+        the step length 'horas'
+    """
+    horas = paso_minutos / 60
+    t = np.arange(0, 365 * 24, horas) + horas / 2
+    dia = t // 24
+    hora = t % 24
+
+    g = 2 * np.pi / 365 * (dia + (hora - 12) / 24)
+    ecuacion_tiempo = 229.18 * (0.000075 + 0.001868 * np.cos(g) - 0.032077 * np.sin(g)
+                                - 0.014615 * np.cos(2 * g) - 0.040849 * np.sin(2 * g))
+    declinacion = (0.006918 - 0.399912 * np.cos(g) + 0.070257 * np.sin(g)
+                   - 0.006758 * np.cos(2 * g) + 0.000907 * np.sin(2 * g)
+                   - 0.002697 * np.cos(3 * g) + 0.00148 * np.sin(3 * g))
+    tiempo_solar = hora * 60 + ecuacion_tiempo + 4 * longitud
+    angulo_horario = np.radians(tiempo_solar / 4 - 180)
+
+    phi = math.radians(latitud)
+    este = -np.cos(declinacion) * np.sin(angulo_horario)
+    norte = (np.sin(declinacion) * math.cos(phi)
+             - np.cos(declinacion) * np.cos(angulo_horario) * math.sin(phi))
+    arriba = (np.sin(declinacion) * math.sin(phi)
+              + np.cos(declinacion) * np.cos(angulo_horario) * math.cos(phi))
+
+    dia_solar = arriba > 0.01
+    este, norte, arriba = este[dia_solar], norte[dia_solar], arriba[dia_solar]
+    elevacion = np.degrees(np.arcsin(arriba))
+    masa_aire = 1 / (arriba + 0.50572 * (6.07995 + elevacion) ** -1.6364)
+    dni = IRRADIANCIA_EXTRATERRESTRE * 0.7 ** (masa_aire ** 0.678)
+
+    return {
+        'sol': np.stack([este, norte, arriba], axis=1),
+        'elevacion': elevacion,
+        'dni': dni,
+        'dhi': 0.1 * dni,
+        'horas': horas,
+    }
+
+
+class ModeloRendimiento:
+    """
+    Annual specific yield (kWh/kWp) of parallel rows as a function of pitch
+
+    Rows are infinitely long tables of width module_width (across the rows)
+    laid out every module_width + pitch metres, like the grid of
+    optimizar_paneles; at grid angle 0 the rows run along the projected
+    y axis (north-south). In the plane across the rows a row shades its
+    neighbour whenever the beam it intercepts exceeds the beam that falls on
+    one row period of ground, so the unshaded beam on a module is
+
+        DNI * min(cos(AOI), (module_width + pitch) * sin(elevation) / module_width)
+
+    which is evaluated for every pitch and time step in one NumPy
+    broadcast. Shading a sliver of a module switches off every bypass-diode
+    substring it touches, so the shaded fraction is rounded up to whole
+    substrings (`bloques`), weighted by `efecto_electrico`.
+
+    FixTilt modules face the equator at `inclinacion` degrees (default from
+    the latitude) whatever the row direction; the row shading model assumes
+    they tilt across the rows, so grid angles with rows more than 45
+    degrees off east-west log a warning. Tracker modules turn about the row
+    axis, up to `limite_tracker` degrees, with backtracking. Diffuse light
+    is isotropic and unshaded.
+
+    The module's electrical data from the catalog sets the temperature
+    loss: cell temperature from T_NOCT and power from gamma_r (%/degC).
+    Absolute values are clear-sky scaled by `claridad`; they rank pitches
+    and give LCOE proxies, they are not a bankable yield.
+
+    Args:
+        latitud, longitud (float): Site position in degrees
+        module_specs (dict): Catalog specs (gamma_r, T_NOCT)
+        module_width (float): Table size across the rows (m)
+        racking (str): 'FixTilt' or 'Tracker'
+        inclinacion (float): Fixed tilt in degrees
+        limite_tracker (float): Tracker rotation limit in degrees
+        backtracking (bool): Trackers backtrack to avoid row shading
+        claridad (float): Ratio of actual to clear-sky irradiance, about
+            0.5 in central Europe and 0.75 in deserts
+        temperatura_ambiente (float): Ambient temperature in degC
+        bloques (int): Bypass-diode substrings stacked across the row
+            width (1 for one module in portrait, its substrings run along
+            the module)
+        efecto_electrico (float): Weight of the substring loss, 0 for a
+            purely irradiance-proportional loss
+        paso_minutos (int): Time step of the year simulation
+    """
+
+    def __init__(self, latitud, longitud, module_specs, module_width, racking='Tracker',
+                 inclinacion=None, limite_tracker=60.0, backtracking=True, claridad=0.55,
+                 temperatura_ambiente=15.0, bloques=1, efecto_electrico=1.0,
+                 paso_minutos=60):
+        if racking not in RACKINGS:
+            raise ValueError(f"Unknown racking '{racking}', expected one of {RACKINGS}")
+        self.latitud = latitud
+        self.module_width = module_width
+        self.racking = racking
+        self.inclinacion = (inclinacion if inclinacion is not None
+                            else min(40.0, 3.1 + 0.76 * abs(latitud)))
+        self.limite_tracker = limite_tracker
+        self.backtracking = backtracking
+        self.claridad = claridad
+        self.temperatura_ambiente = temperatura_ambiente
+        self.bloques = bloques
+        self.efecto_electrico = efecto_electrico
+
+        gamma = module_specs.get('gamma_r')
+        t_noct = module_specs.get('T_NOCT')
+        self.gamma = -0.4 if gamma is None or math.isnan(gamma) else float(gamma)
+        self.t_noct = T_NOCT_POR_DEFECTO if t_noct is None or math.isnan(t_noct) else float(t_noct)
+        self.sol = posiciones_solares(latitud, longitud, paso_minutos)
+        self._angulos_avisados = set()
+
+    @classmethod
+    def desde_zonas(cls, zonas_habilitadas, module_specs, module_width, **opciones):
+        """Model at the centre of the enabled zones (any projected CRS)"""
+        latitud, longitud = centroide_wgs84(zonas_habilitadas)
+        return cls(latitud, longitud, module_specs, module_width, **opciones)
+
+    def _ejes(self, angulo):
+        """Horizontal unit vectors along and across the rows (east, north)"""
+        theta = math.radians(angulo)
+        eje = np.array([-math.sin(theta), math.cos(theta)])
+        normal = np.array([eje[1], -eje[0]])
+        return eje, normal
+
+    def rendimiento(self, pitches, angulo=0.0):
+        """
+        Annual specific yield for every pitch
+
+        Args:
+            pitches (array-like): Gaps between rows (m)
+            angulo (float): Grid angle in degrees, counter-clockwise
+
+        Returns:
+            np.ndarray: kWh per kWp installed, one value per pitch
+        """
+        pitches = np.atleast_1d(np.asarray(pitches, dtype=float))
+        periodo = (self.module_width + pitches)[:, None]
+        sol = self.sol['sol']
+        _, normal = self._ejes(angulo)
+        # Sun in the plane across the rows: horizontal component along the
+        # row normal and vertical component
+        s_u = sol[:, :2] @ normal
+        s_z = sol[:, 2]
+
+        if self.racking == 'FixTilt':
+            # Face the equator, whatever the row direction
+            hacia_ecuador = np.array([0.0, 1.0 if self.latitud < 0 else -1.0])
+            if abs(normal @ hacia_ecuador) < math.sqrt(0.5) \
+                    and angulo not in self._angulos_avisados:
+                self._angulos_avisados.add(angulo)
+                logger.warning("Grid angle %s deg puts the FixTilt rows more than 45 deg off "
+                               "east-west; the row shading estimate assumes modules tilted "
+                               "across the rows", angulo)
+            beta = math.radians(self.inclinacion)
+            cos_aoi = np.broadcast_to((sol[:, :2] @ hacia_ecuador) * math.sin(beta)
+                                      + s_z * math.cos(beta), (len(pitches), len(s_z)))
+        else:
+            # True-tracking rotation, then backtracking (flat ground) per pitch
+            rotacion = np.arctan2(s_u, s_z)
+            rotacion = np.broadcast_to(rotacion, (len(pitches), len(s_z))).copy()
+            if self.backtracking:
+                gcr = self.module_width / periodo
+                cociente = np.abs(np.cos(rotacion)) / gcr
+                sombra = cociente < 1
+                correccion = -np.sign(rotacion) * np.arccos(np.minimum(cociente, 1))
+                rotacion = np.where(sombra, rotacion + correccion, rotacion)
+            limite = math.radians(self.limite_tracker)
+            rotacion = np.clip(rotacion, -limite, limite)
+            cos_aoi = s_u * np.sin(rotacion) + s_z * np.cos(rotacion)
+            beta = rotacion
+
+        # Shaded fraction of the row width: the beam on a module is capped by
+        # the beam on one row period of ground
+        cos_aoi = np.clip(cos_aoi, 0, None)
+        libre = periodo * s_z / self.module_width
+        sombreado = np.clip(1 - libre / np.where(cos_aoi > 0, cos_aoi, 1), 0, 1)
+        # Electrical effect: a shaded sliver switches off its whole substring
+        bloques = np.minimum(1, np.ceil(sombreado * self.bloques - 1e-9) / self.bloques)
+        perdida = (1 - self.efecto_electrico) * sombreado + self.efecto_electrico * bloques
+        haz = cos_aoi * (1 - perdida)
+        poa = (self.sol['dni'] * haz
+               + self.sol['dhi'] * (1 + np.cos(beta)) / 2) * self.claridad
+
+        t_celda = self.temperatura_ambiente + (self.t_noct - 20) / 800 * poa
+        potencia = poa / 1000 * (1 + self.gamma / 100 * (t_celda - 25))
+        return potencia.sum(axis=1) * self.sol['horas']
+
+    def perdida_sombra(self, pitches, angulo=0.0):
+        """Fraction of the unshaded yield lost to row shading, per pitch"""
+        libre = self.rendimiento([1e6], angulo)[0]
+        return 1 - self.rendimiento(pitches, angulo) / libre
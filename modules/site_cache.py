@@ -0,0 +1,149 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import shapely
+
+# Total size kept in a cache directory; least recently used entries go first
+CACHE_MAX_BYTES = 1 << 30
+
+# Bump when the content of the cached entries changes
+CACHE_VERSION = '1'
+
+
+def firma_archivo(ruta):
+    """(size, mtime) of a file: a cheap change check, short of hashing it"""
+    estado = os.stat(ruta)
+    return estado.st_size, estado.st_mtime_ns
+
+
+def clave_cache(*partes):
+    """Cache key: SHA-256 of the given parts (str or bytes) plus the cache version"""
+    h = hashlib.sha256(CACHE_VERSION.encode())
+    for parte in partes:
+        h.update(b'\0')
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode())
+    return h.hexdigest()
+
+
+def hash_archivo(ruta, bloque=1 << 20):
+    """SHA-256 of a file's content"""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(bloque), b''):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+def _ruta(cache_dir, clave, sufijo):
+    return os.path.join(cache_dir, f"{clave}{sufijo}")
+
+
+def _tocar(*rutas):
+    """Mark entries as recently used (the LRU order is the mtime order)"""
+    for ruta in rutas:
+        os.utime(ruta)
+
+
+def _escribir_atomico(ruta, escribir):
+    """
+    Write through a temp file in the same directory and rename it into place,
+    so concurrent runs never see a partial entry
+    """
+    directorio = os.path.dirname(ruta)
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    os.close(fd)
+    try:
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+
+def limpiar_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """Evict least recently used entries until the directory fits in max_bytes"""
+    entradas = []
+    for nombre in os.listdir(cache_dir):
+        ruta = os.path.join(cache_dir, nombre)
+        if os.path.isfile(ruta) and not nombre.endswith('.tmp'):
+            estado = os.stat(ruta)
+            entradas.append((estado.st_mtime, estado.st_size, ruta))
+    total = sum(tamano for _, tamano, _ in entradas)
+    for _, tamano, ruta in sorted(entradas):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+
+
+def guardar_geometrias(cache_dir, clave, geometrias, max_bytes=CACHE_MAX_BYTES):
+    """
+    Store an array of shapely geometries (None allowed) as WKB in an .npz
+    entry; only NumPy and shapely are needed to read it back
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    nulos = np.array([g is None for g in geometrias], dtype=bool)
+    wkb = [shapely.to_wkb(g) if g is not None else b'' for g in geometrias]
+    datos = np.frombuffer(b''.join(wkb), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(w) for w in wkb])
+
+    def escribir(ruta):
+        with open(ruta, 'wb') as f:
+            np.savez(f, wkb=datos, offsets=offsets, nulos=nulos)
+
+    _escribir_atomico(_ruta(cache_dir, clave, '.npz'), escribir)
+    limpiar_cache(cache_dir, max_bytes)
+
+
+def leer_geometrias(cache_dir, clave):
+    """Geometries stored by guardar_geometrias, or None on a cache miss"""
+    ruta = _ruta(cache_dir, clave, '.npz')
+    try:
+        with np.load(ruta) as entrada:
+            datos = entrada['wkb'].tobytes()
+            offsets = entrada['offsets']
+            nulos = entrada['nulos']
+    except (FileNotFoundError, OSError, ValueError, KeyError):
+        return None
+    _tocar(ruta)
+    return [None if nulo else shapely.from_wkb(datos[a:b])
+            for nulo, a, b in zip(nulos, offsets[:-1], offsets[1:])]
+
+
+def guardar_zonas(cache_dir, clave, zonas_habilitadas, zonas_inhabilitadas,
+                  max_bytes=CACHE_MAX_BYTES):
+    """Store the projected enabled and restricted zones as GeoParquet"""
+    os.makedirs(cache_dir, exist_ok=True)
+    for sufijo, zonas in (('_enabled.parquet', zonas_habilitadas),
+                          ('_restricted.parquet', zonas_inhabilitadas)):
+        # KML attribute columns are mixed-type; keep them as text
+        zonas = zonas.copy()
+        for columna in zonas.columns.drop(zonas.geometry.name):
+            zonas[columna] = zonas[columna].astype('string')
+        _escribir_atomico(_ruta(cache_dir, clave, sufijo), zonas.to_parquet)
+    limpiar_cache(cache_dir, max_bytes)
+
+
+def leer_zonas(cache_dir, clave):
+    """Zones stored by guardar_zonas, or None on a cache miss"""
+    import geopandas as gpd
+
+    rutas = [_ruta(cache_dir, clave, sufijo)
+             for sufijo in ('_enabled.parquet', '_restricted.parquet')]
+    if not all(os.path.exists(ruta) for ruta in rutas):
+        return None
+    try:
+        zonas = tuple(gpd.read_parquet(ruta) for ruta in rutas)
+    except (OSError, ValueError):
+        return None
+    _tocar(*rutas)
+    # GeoParquet stores the CRS as PROJJSON; restore the short EPSG form
+    epsg = zonas[0].crs.to_epsg() if zonas[0].crs else None
+    if epsg:
+        zonas = tuple(zona.set_crs(f"EPSG:{epsg}", allow_override=True) for zona in zonas)
+    return zonas
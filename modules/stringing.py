@@ -0,0 +1,301 @@
+import logging
+import math
+
+import numpy as np
+import shapely
+
+from modules import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Per-table electrical assignment, aligned with Layout.mesas (-1: none)
+ASIGNACION_DTYPE = np.dtype([
+    ('bloque', 'i4'),   # Inverter block
+    ('string', 'i4'),   # First string with modules on the table
+    ('caja', 'i4'),     # Combiner box of that string
+])
+
+STRING_DTYPE = np.dtype([
+    ('bloque', 'i4'),
+    ('caja', 'i4'),
+    ('mesa_inicio', 'i8'),  # Layout index of the first and last table
+    ('mesa_fin', 'i8'),
+    ('x', 'f8'),            # Midpoint between the end tables
+    ('y', 'f8'),
+    ('cable_m', 'f8'),      # DC string cable to the combiner box
+])
+
+CAJA_DTYPE = np.dtype([
+    ('bloque', 'i4'),
+    ('strings', 'i4'),
+    ('x', 'f8'),            # Centre of the table the box is mounted on
+    ('y', 'f8'),
+    ('cable_m', 'f8'),      # DC main cable to the inverter
+])
+
+BLOQUE_DTYPE = np.dtype([
+    ('x', 'f8'),            # Inverter station, next to the table nearest the block centre
+    ('y', 'f8'),
+    ('mesas', 'i4'),
+    ('strings', 'i4'),
+    ('cajas', 'i4'),
+    ('modulos', 'i8'),
+    ('modulos_sin_string', 'i4'),
+    ('potencia_kwp', 'f8'),
+    ('cable_string_m', 'f8'),
+    ('cable_dc_m', 'f8'),
+])
+
+
+class AgrupacionElectrica:
+    """
+    Strings, combiner boxes and inverter blocks of a Layout
+
+    Result of agrupar_strings: one structured array per level, indexes are
+    0-based and refer to the other arrays (bloque, caja) or to the tables
+    of the Layout (mesa_inicio, mesa_fin).
+
+    Args:
+        layout (Layout): Grouped tables
+        mesas (np.ndarray): ASIGNACION_DTYPE, one record per table
+        strings (np.ndarray): STRING_DTYPE
+        cajas (np.ndarray): CAJA_DTYPE
+        bloques (np.ndarray): BLOQUE_DTYPE
+        modules_per_string (int): Modules in series per string
+        modulos_sin_bloque (int): Modules of the tables left out of every
+            block, too few for a whole string
+    """
+
+    def __init__(self, layout, mesas, strings, cajas, bloques, modules_per_string,
+                 modulos_sin_bloque=0):
+        self.layout = layout
+        self.mesas = mesas
+        self.strings = strings
+        self.cajas = cajas
+        self.bloques = bloques
+        self.modules_per_string = modules_per_string
+        self.modulos_sin_bloque = modulos_sin_bloque
+
+    def __repr__(self):
+        return (f"AgrupacionElectrica({len(self.bloques)} blocks, {len(self.cajas)} combiner "
+                f"boxes, {len(self.strings)} strings of {self.modules_per_string} modules)")
+
+    def resumen(self):
+        """Totals of the grouping"""
+        return {
+            'inverter_blocks': len(self.bloques),
+            'combiner_boxes': len(self.cajas),
+            'strings': len(self.strings),
+            'unstrung_modules': int(self.bloques['modulos_sin_string'].sum())
+                                + self.modulos_sin_bloque,
+            'string_cable_km': float(self.bloques['cable_string_m'].sum()) / 1000,
+            'dc_cable_km': float(self.bloques['cable_dc_m'].sum()) / 1000,
+        }
+
+    def contornos(self):
+        """Convex hull of the table footprints of every block, in the layout CRS"""
+        esquinas = self.layout.coordenadas_poligonos()
+        orden = np.argsort(self.mesas['bloque'], kind='stable')
+        orden = orden[self.mesas['bloque'][orden] >= 0]
+        puntos = shapely.multipoints(esquinas[orden].reshape(-1, 2),
+                                     indices=np.repeat(self.mesas['bloque'][orden], 4))
+        return shapely.convex_hull(puntos)
+
+
+def _biseccion(u, v, n_bloques):
+    """
+    Block of every point by recursive bisection (a k-d tree with n_bloques
+    leaves): each node is cut across its longer side so that both halves
+    hold table counts proportional to the blocks they get
+    """
+    bloque = np.zeros(len(u), dtype=np.int32)
+    pila = [(np.arange(len(u)), n_bloques, 0)] if len(u) else []
+    while pila:
+        indices, k, primero = pila.pop()
+        if k == 1:
+            bloque[indices] = primero
+            continue
+        eje = u if np.ptp(u[indices]) >= np.ptp(v[indices]) else v
+        indices = indices[np.argsort(eje[indices], kind='stable')]
+        k_izquierda = k // 2
+        corte = round(len(indices) * k_izquierda / k)
+        pila.append((indices[corte:], k - k_izquierda, primero + k_izquierda))
+        pila.append((indices[:corte], k_izquierda, primero))
+    return bloque
+
+
+def _inicios(cuentas):
+    """First index of every group of consecutive items given the group sizes"""
+    return np.cumsum(cuentas) - cuentas
+
+
+@instrumentation.cronometrado()
+def agrupar_strings(layout, module_specs, panels_x_module, modules_per_string,
+                    capacidad_bloque_kwp=4000.0, strings_por_caja=24):
+    """
+    Group the tables of a layout into strings, combiner boxes and inverter
+    blocks, with DC cable length estimates
+
+    Inverter blocks are the leaves of a k-d tree over the table centres of
+    each zone in the grid frame, split until every block holds at most
+    capacidad_bloque_kwp of whole strings, so blocks are compact, of even
+    size and never cross zones. Inside a block the tables are walked column by column,
+    up one column and down the next (zone, column and row of the grid), and
+    the modules along that walk are cut into strings of modules_per_string;
+    a string spans several tables when panels_x_module is not a multiple of
+    it. Modules left over at the end of a block stay unstrung, and so do
+    the tables of a block too small for one string (a small zone), which
+    then belong to no block. Consecutive strings share a combiner box,
+    strings_por_caja per box.
+
+    Combiner boxes are mounted on the table nearest to the centre of their
+    strings and inverter stations placed next to the table nearest to the
+    block centre, both found with an STRtree over the table centres.
+    Cables run along and across the rows, so lengths are Manhattan
+    distances in the grid frame, counting both poles:
+
+        string cable = 2 * (string midpoint -> box) + first -> last table
+        DC main cable = 2 * (box -> inverter)
+
+    Everything is vectorized over tables and strings; 50 000 tables take
+    well under a second.
+
+    Args:
+        layout (Layout): Tables from optimizar_paneles
+        module_specs (dict): Catalog specs (stc)
+        panels_x_module (int): Modules per table
+        modules_per_string (int): Modules in series per string
+        capacidad_bloque_kwp (float): DC capacity of an inverter block
+        strings_por_caja (int): Strings per combiner box
+
+    Returns:
+        AgrupacionElectrica: Per-table assignment and the strings, boxes
+        and blocks with their cable lengths
+    """
+    potencia_string = modules_per_string * module_specs['stc'] / 1000
+    strings_bloque = int(capacidad_bloque_kwp // potencia_string)
+    mesas_bloque = strings_bloque * modules_per_string // panels_x_module
+    if mesas_bloque < 1:
+        raise ValueError(f"An inverter block of {capacidad_bloque_kwp} kWp does not hold a "
+                         f"table of {panels_x_module} modules in whole strings")
+    if strings_por_caja < 1:
+        raise ValueError("strings_por_caja must be at least 1")
+
+    mesas = layout.mesas
+    n = len(mesas)
+    theta = math.radians(layout.angulo)
+    u = mesas['x'] * math.cos(theta) + mesas['y'] * math.sin(theta)
+    v = -mesas['x'] * math.sin(theta) + mesas['y'] * math.cos(theta)
+
+    with instrumentation.etapa('bloques'):
+        # Blocks do not cross zones: every zone gets its own k-d tree
+        bloque = np.empty(n, dtype=np.int32)
+        n_bloques = 0
+        for zona in np.unique(mesas['zona']):
+            indices = np.flatnonzero(mesas['zona'] == zona)
+            k = -(-len(indices) // mesas_bloque)
+            bloque[indices] = n_bloques + _biseccion(u[indices], v[indices], k)
+            n_bloques += k
+
+        # Blocks without a whole string get no inverter: their tables stay
+        # out of every block (-1) and their modules unstrung
+        mesas_por_bloque = np.bincount(bloque, minlength=n_bloques)
+        con_strings = mesas_por_bloque * panels_x_module >= modules_per_string
+        modulos_sin_bloque = int(mesas_por_bloque[~con_strings].sum()) * panels_x_module
+        bloque = np.where(con_strings, np.cumsum(con_strings) - 1, -1)[bloque].astype(np.int32)
+        mesas_por_bloque = mesas_por_bloque[con_strings]
+        n_bloques = len(mesas_por_bloque)
+        activas = np.flatnonzero(bloque >= 0)
+
+    with instrumentation.etapa('strings'):
+        # Walk up even columns and down odd ones inside each block
+        serpentina = np.where(mesas['columna'] % 2, -mesas['fila'], mesas['fila'])
+        orden = activas[np.lexsort((serpentina[activas], mesas['columna'][activas],
+                                    mesas['zona'][activas], bloque[activas]))]
+        strings_por_bloque = mesas_por_bloque * panels_x_module // modules_per_string
+        inicio_mesas = _inicios(mesas_por_bloque)
+        inicio_strings = _inicios(strings_por_bloque)
+
+        s_bloque = np.repeat(np.arange(n_bloques), strings_por_bloque)
+        s_local = np.arange(len(s_bloque)) - inicio_strings[s_bloque]
+        primera = orden[inicio_mesas[s_bloque]
+                        + s_local * modules_per_string // panels_x_module]
+        ultima = orden[inicio_mesas[s_bloque]
+                       + ((s_local + 1) * modules_per_string - 1) // panels_x_module]
+
+        cajas_por_bloque = -(-strings_por_bloque // strings_por_caja)
+        s_caja = _inicios(cajas_por_bloque)[s_bloque] + s_local // strings_por_caja
+        n_cajas = int(cajas_por_bloque.sum())
+
+        # First string on every table, -1 past the last whole string of its block
+        b_orden = bloque[orden]
+        t_local = np.arange(len(orden)) - inicio_mesas[b_orden]
+        s_mesa = t_local * panels_x_module // modules_per_string
+        asignacion = np.full(n, -1, dtype=ASIGNACION_DTYPE)
+        asignacion['bloque'] = bloque
+        asignacion['string'][orden] = np.where(s_mesa < strings_por_bloque[b_orden],
+                                               inicio_strings[b_orden] + s_mesa, -1)
+        con_string = asignacion['string'] >= 0
+        asignacion['caja'][con_string] = s_caja[asignacion['string'][con_string]]
+
+    with instrumentation.etapa('ubicacion'):
+        arbol = shapely.STRtree(shapely.points(layout.centros))
+
+        def mesa_cercana(x, y):
+            return arbol.query_nearest(shapely.points(np.column_stack([x, y])),
+                                       all_matches=False)[1]
+
+        s_x = (mesas['x'][primera] + mesas['x'][ultima]) / 2
+        s_y = (mesas['y'][primera] + mesas['y'][ultima]) / 2
+        strings_caja = np.bincount(s_caja, minlength=n_cajas)
+        mesa_caja = mesa_cercana(np.bincount(s_caja, s_x, n_cajas) / strings_caja,
+                                 np.bincount(s_caja, s_y, n_cajas) / strings_caja)
+        mesa_inversor = mesa_cercana(
+            np.bincount(bloque[activas], mesas['x'][activas], n_bloques) / mesas_por_bloque,
+            np.bincount(bloque[activas], mesas['y'][activas], n_bloques) / mesas_por_bloque)
+
+    with instrumentation.etapa('cableado'):
+        s_u = (u[primera] + u[ultima]) / 2
+        s_v = (v[primera] + v[ultima]) / 2
+        caja_u, caja_v = u[mesa_caja], v[mesa_caja]
+        cable_string = (2 * (np.abs(s_u - caja_u[s_caja]) + np.abs(s_v - caja_v[s_caja]))
+                        + np.abs(u[primera] - u[ultima]) + np.abs(v[primera] - v[ultima]))
+        c_bloque = np.repeat(np.arange(n_bloques), cajas_por_bloque)
+        cable_caja = 2 * (np.abs(caja_u - u[mesa_inversor][c_bloque])
+                          + np.abs(caja_v - v[mesa_inversor][c_bloque]))
+
+    strings = np.empty(len(s_bloque), dtype=STRING_DTYPE)
+    strings['bloque'] = s_bloque
+    strings['caja'] = s_caja
+    strings['mesa_inicio'] = primera
+    strings['mesa_fin'] = ultima
+    strings['x'] = s_x
+    strings['y'] = s_y
+    strings['cable_m'] = cable_string
+
+    cajas = np.empty(n_cajas, dtype=CAJA_DTYPE)
+    cajas['bloque'] = c_bloque
+    cajas['strings'] = strings_caja
+    cajas['x'] = mesas['x'][mesa_caja]
+    cajas['y'] = mesas['y'][mesa_caja]
+    cajas['cable_m'] = cable_caja
+
+    bloques = np.empty(n_bloques, dtype=BLOQUE_DTYPE)
+    bloques['x'] = mesas['x'][mesa_inversor]
+    bloques['y'] = mesas['y'][mesa_inversor]
+    bloques['mesas'] = mesas_por_bloque
+    bloques['strings'] = strings_por_bloque
+    bloques['cajas'] = cajas_por_bloque
+    bloques['modulos'] = strings_por_bloque * modules_per_string
+    bloques['modulos_sin_string'] = (mesas_por_bloque * panels_x_module
+                                     - strings_por_bloque * modules_per_string)
+    bloques['potencia_kwp'] = strings_por_bloque * potencia_string
+    bloques['cable_string_m'] = np.bincount(s_bloque, cable_string, n_bloques)
+    bloques['cable_dc_m'] = np.bincount(c_bloque, cable_caja, n_bloques)
+
+    agrupacion = AgrupacionElectrica(layout, asignacion, strings, cajas, bloques,
+                                     modules_per_string, modulos_sin_bloque)
+    instrumentation.contar('strings', len(strings))
+    logger.info("%d tables grouped into %d strings, %d combiner boxes and %d inverter blocks",
+                n, len(strings), n_cajas, n_bloques)
+    return agrupacion
@@ -1,13 +1,18 @@
-import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon as MplPolygon, Rectangle
-from matplotlib.patches import Arrow
+import logging
+
 import numpy as np
 from shapely.geometry import LineString, MultiLineString, GeometryCollection, Polygon
 
+from modules import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
 def dibujar_geometria(geometria, ax, color="blue", label=None):
     """
     Draw geometry on matplotlib axis
     """
+    from matplotlib.patches import Polygon as MplPolygon
     if isinstance(geometria, LineString):
         x, y = geometria.coords.xy
         ax.plot(x, y, color=color, linewidth=2, label=label)
@@ -29,6 +34,7 @@ def agregar_norte(ax, x_offset=0.02, y_offset=0.94, arrow_length=0.03):
     """
     Add North arrow to the plot
     """
+    from matplotlib.patches import Arrow
     arrow = Arrow(x_offset, y_offset, 0, arrow_length,
                   width=0.005, color='black', transform=ax.transAxes)
     ax.add_patch(arrow)
@@ -50,15 +56,41 @@ def agregar_escala(ax, zonas_habilitadas):
     ax.text(x_min + scale_length/2, y_min - zone_width*0.01,
             scale_text, ha='center', va='top')
 
+@instrumentation.cronometrado()
 def visualizar_paneles(zonas_habilitadas, zonas_inhabilitadas,
                       lineas_paneles, total_modulos, total_energia,
                       module_specs, panels_x_module, pitch,
-                      proyecto_extra_info=None, calles=None):
+                      proyecto_extra_info=None, calles=None,
+                      salida=None, dpi=150, mostrar=True):
     """
     Create visualization of solar panel placement
+
+    lineas_paneles is the Layout returned by optimizar_paneles. All table
+    footprints are drawn as one PolyCollection and the streets as one
+    LineCollection.
+
+    Args:
+        salida (str): Optional image path; the format (PNG, SVG, PDF, ...)
+            follows the file extension
+        dpi (int): Resolution of the saved image
+        mostrar (bool): Open the interactive window. With mostrar=False the
+            figure is rendered off-screen without any GUI backend, for
+            headless batch rendering
+
+    Returns:
+        str: The saved image path, or None
     """
-    print("\n=== GENERATING VISUALIZATION ===")
-    fig, ax = plt.subplots(figsize=(20, 15))
+    # matplotlib is only loaded when a layout is drawn
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.figure import Figure
+
+    logger.info("Generating visualization")
+    if mostrar:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(20, 15))
+    else:
+        fig = Figure(figsize=(20, 15))
+        ax = fig.subplots()
 
     # Plot enabled zones
     if not zonas_habilitadas.empty:
@@ -76,30 +108,23 @@ def visualizar_paneles(zonas_habilitadas, zonas_inhabilitadas,
     fenced_area = zonas_habilitadas.geometry.unary_union.buffer(-proyecto_extra_info['fenced_distance'])
     dibujar_geometria(fenced_area, ax, color='#FFFF00', label='Fenced Area')
 
-    # Plot panel lines as polygons
-    module_width = module_specs['length']
-    module_length = module_specs['width'] * panels_x_module
-    for panel in lineas_paneles:
-        center_x, center_y = panel.centroid.coords[0]
-        panel_poly = Polygon([
-            (center_x - module_width/2, center_y),
-            (center_x + module_width/2, center_y),
-            (center_x + module_width/2, center_y + module_length),
-            (center_x - module_width/2, center_y + module_length)
-        ])
-        dibujar_geometria(panel_poly, ax, color='#AEF66A')
+    # Plot the table footprints of the Layout
+    ax.add_collection(PolyCollection(lineas_paneles.coordenadas_poligonos(), closed=True,
+                                     edgecolor='#AEF66A', facecolor='#AEF66A',
+                                     linewidth=1, alpha=0.7))
 
     # Plot streets
     if calles:
-        for calle in calles:
-            dibujar_geometria(calle['left_boundary'], ax, color='brown')
-            dibujar_geometria(calle['right_boundary'], ax, color='brown')
+        segmentos = [np.asarray(calle[lado].coords) for calle in calles
+                     for lado in ('left_boundary', 'right_boundary')]
+        ax.add_collection(LineCollection(segmentos, colors='brown', linewidth=2))
+    ax.autoscale_view()
 
-    plt.title(f"Layout: {proyecto_extra_info.get('project_name', 'Project Example')} - DK")
-    plt.xlabel("Longitude")
-    plt.ylabel("Latitude")
-    plt.grid(True)
-    plt.axis('equal')
+    ax.set_title(f"Layout: {proyecto_extra_info.get('project_name', 'Project Example')} - DK")
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.grid(True)
+    ax.axis('equal')
 
     # Create new custom legends
     legend_props = dict(facecolor='#AEF66A', alpha=0.5, boxstyle='round')
@@ -110,8 +135,8 @@ def visualizar_paneles(zonas_habilitadas, zonas_inhabilitadas,
         f"PV Module Model: {proyecto_extra_info.get('module_model', 'Unknown')}\n"
         f"Racking: {proyecto_extra_info.get('racking', 'Unknown')}"
     )
-    plt.text(1.02, 0.9, tech_text, transform=ax.transAxes, fontsize=10,
-             verticalalignment='top', bbox=legend_props)
+    ax.text(1.02, 0.9, tech_text, transform=ax.transAxes, fontsize=10,
+            verticalalignment='top', bbox=legend_props)
 
     # Capacity Legend
     capacity_text = (
@@ -122,8 +147,8 @@ def visualizar_paneles(zonas_habilitadas, zonas_inhabilitadas,
         f"Module Width: {module_specs['width']:.2f} m\n"
         f"Module Length: {module_specs['length']:.2f} m"
     )
-    plt.text(1.02, 0.6, capacity_text, transform=ax.transAxes, fontsize=10,
-             verticalalignment='top', bbox=legend_props)
+    ax.text(1.02, 0.6, capacity_text, transform=ax.transAxes, fontsize=10,
+            verticalalignment='top', bbox=legend_props)
 
     # Assumptions Legend
     total_area_ha = zonas_habilitadas.geometry.area.sum() / 10_000
@@ -136,10 +161,16 @@ def visualizar_paneles(zonas_habilitadas, zonas_inhabilitadas,
         f"Modules per Table: {panels_x_module}\n"
         f"Total Table Qty: {total_modulos:.2f}"
     )
-    plt.text(1.02, 0.3, assumptions_text, transform=ax.transAxes, fontsize=10,
-             verticalalignment='top', bbox=legend_props)
+    ax.text(1.02, 0.3, assumptions_text, transform=ax.transAxes, fontsize=10,
+            verticalalignment='top', bbox=legend_props)
 
     agregar_norte(ax)
     agregar_escala(ax, zonas_habilitadas)
-    plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    fig.tight_layout()
+
+    if salida:
+        fig.savefig(salida, dpi=dpi, bbox_inches='tight')
+        logger.info("Layout image saved to %s", salida)
+    if mostrar:
+        plt.show()
+    return salida
\ No newline at end of file
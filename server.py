@@ -0,0 +1,39 @@
+import argparse
+
+from modules.instrumentation import configurar_logging
+from modules.layout_service import ServicioLayout, crear_servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local HTTP/JSON what-if layout service with warm caches")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('-p', '--port', type=int, default=8765, help="Port (default 8765)")
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help="Layout jobs run at the same time (default 2)")
+    parser.add_argument('-o', '--output-dir', default='service_output',
+                        help="Folder for the per-request artifacts")
+    parser.add_argument('--cache-dir', default=None,
+                        help="On-disk cache for projected site geometry")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Logging level")
+    args = parser.parse_args()
+    configurar_logging(args.log_level)
+
+    servicio = ServicioLayout(max_workers=args.workers, output_dir=args.output_dir,
+                              cache_dir=args.cache_dir)
+    servidor = crear_servidor(servicio, args.host, args.port)
+    print(f"Layout service on http://{args.host}:{args.port} "
+          f"(POST /layout, GET /artifacts/..., GET /status)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.cerrar()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,45 @@
+import sys
+
+import pytest
+import shapely
+
+import batch
+from modules import batch_runner
+from modules.panel_optimizer import optimizar_paneles
+
+
+@pytest.mark.parametrize('nombre, contenido', [
+    ('vacio.json', '[]'),
+    ('vacio.json', '{"defaults": {"module_id": 2}, "scenarios": []}'),
+    ('vacio.yaml', ''),
+    ('vacio.csv', ''),
+    ('cabecera.csv', 'kml,module_id\n'),
+])
+def test_fichero_sin_escenarios(tmp_path, monkeypatch, nombre, contenido):
+    ruta = tmp_path / nombre
+    ruta.write_text(contenido, encoding='utf-8')
+    monkeypatch.setattr(sys, 'argv', ['batch.py', str(ruta), '-o', str(tmp_path / 'salida')])
+    assert batch.main() == 0
+    assert not (tmp_path / 'salida').exists()
+
+
+def test_memo_de_evaluaciones_acotado():
+    memo = batch_runner._MemoEvaluaciones(3)
+    for clave in 'abcd':
+        memo[clave] = {'total_modules': ord(clave)}
+    assert len(memo) == 3 and memo.get('a') is None
+    memo.get('b')
+    memo['e'] = {}
+    assert memo.get('c') is None and memo.get('b') is not None
+
+
+def test_barrido_mayor_que_el_memo():
+    # The sweep outgrows the memo; its own evaluations must still be scored
+    zona = shapely.box(0, 0, 300, 200)
+    modulo = {'stc': 550, 'length': 2.278, 'width': 1.134}
+    memo = batch_runner._MemoEvaluaciones(2)
+    resultado = optimizar_paneles([zona], None, modulo, 28, 3, 6, 0.5, cache=memo,
+                                  busqueda='refinada')
+    referencia = optimizar_paneles([zona], None, modulo, 28, 3, 6, 0.5, busqueda='refinada')
+    assert resultado[1:4] == referencia[1:4]
+    assert len(memo) == 2
@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import pyarrow.feather as feather
+
+from modules import data_loader
+from modules.site_cache import firma_archivo
+from modules.data_loader import RUTA_CATALOGO, ModuleCatalog
+
+
+def _copia(tmp_path):
+    ruta = tmp_path / 'modulos.csv'
+    shutil.copy(RUTA_CATALOGO, ruta)
+    return str(ruta)
+
+
+def test_instantanea_se_reutiliza_sin_leer_el_csv(tmp_path, monkeypatch):
+    ruta = _copia(tmp_path)
+    catalogo = ModuleCatalog(ruta)
+    metadatos = feather.read_table(f"{ruta}.feather").schema.metadata
+    assert metadatos[data_loader._CLAVE_ORIGEN] == b'%d:%d' % firma_archivo(ruta)
+
+    def sin_csv(*args, **kwargs):
+        raise AssertionError("the CSV was parsed again")
+
+    monkeypatch.setattr('pandas.read_csv', sin_csv)
+    recargado = ModuleCatalog(ruta)
+    assert len(recargado) == len(catalogo)
+    assert recargado.df.equals(catalogo.df)
+
+
+def test_instantanea_se_rehace_si_cambia_el_csv(tmp_path):
+    ruta = _copia(tmp_path)
+    n = len(ModuleCatalog(ruta))
+    with open(ruta, encoding='utf-8') as f:
+        lineas = f.readlines()
+    with open(ruta, 'w', encoding='utf-8') as f:
+        # Drop the first module
+        f.writelines(lineas[:1] + lineas[2:])
+    estado = os.stat(ruta)
+    os.utime(ruta, ns=(estado.st_atime_ns, estado.st_mtime_ns + 10**9))
+    assert len(ModuleCatalog(ruta)) == n - 1
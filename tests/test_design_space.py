@@ -0,0 +1,16 @@
+import pytest
+import shapely
+
+from modules.design_space import explorar_diseno
+
+
+def test_modulo_sin_dimensiones():
+    # Module 1 of the bundled catalog has no length or width
+    with pytest.raises(ValueError, match='ID 1 '):
+        explorar_diseno([shapely.box(0, 0, 200, 200)], None, [2, 1], [28], [4.0])
+
+
+def test_modulos_validos():
+    filas = explorar_diseno([shapely.box(0, 0, 200, 200)], None, [2], [14, 28], [4.0, 6.0])
+    assert len(filas) == 4
+    assert (filas['total_tables'] > 0).all()
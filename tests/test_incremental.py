@@ -0,0 +1,51 @@
+import numpy as np
+import shapely
+
+from modules.incremental import LayoutIncremental
+from modules.panel_optimizer import optimizar_paneles
+
+MODULO = {'PV Module Model': 'Test', 'stc': 550, 'length': 2.278, 'width': 1.134}
+PITCH = 4.0
+OPCIONES = {'modulos_entre_calles': 12, 'ancho_calle': 6, 'fenced_distance': 5}
+
+
+def _sitio():
+    """Two enabled zones and a few small restricted zones"""
+    zonas = [shapely.box(0, 0, 600, 400), shapely.box(650, 0, 900, 250)]
+    rng = np.random.default_rng(5)
+    puntos = shapely.points(rng.uniform((0, 0), (900, 400), (20, 2)))
+    return zonas, list(shapely.buffer(puntos, rng.uniform(2, 8, 20), quad_segs=4))
+
+
+def _mesas(layout):
+    return set(zip(np.round(layout.mesas['x'], 6), np.round(layout.mesas['y'], 6)))
+
+
+def test_ediciones_dispersas_revisan_pocas_celdas():
+    zonas, restringidas = _sitio()
+    esquinas = [shapely.box(20, 20, 28, 23), shapely.box(570, 370, 578, 373)]
+
+    def revisadas(nuevas):
+        incremental = LayoutIncremental(zonas, restringidas, MODULO, 28, PITCH, **OPCIONES)
+        return incremental.actualizar(zonas_inhabilitadas=restringidas + nuevas)['cells_checked']
+
+    por_esquina = [revisadas([esquina]) for esquina in esquinas]
+    assert all(0 < n <= 4 for n in por_esquina)
+    # Opposite corners: each edit re-checks its own cells, not the site between them
+    assert revisadas(esquinas) == sum(por_esquina)
+
+
+def test_varias_ediciones_igual_que_desde_cero():
+    zonas, restringidas = _sitio()
+    incremental = LayoutIncremental(zonas, restringidas, MODULO, 28, PITCH, **OPCIONES)
+    incremental.actualizar(zonas_inhabilitadas=restringidas[1:] + [shapely.box(100, 100, 130, 110)])
+    restringidas = restringidas[1:] + [shapely.box(100, 100, 130, 110),
+                                       shapely.Point(800, 200).buffer(15)]
+    incremental.actualizar(zonas_inhabilitadas=restringidas)
+    # Edit the enabled zone without moving its fenced bounds
+    zonas = [shapely.box(0, 0, 600, 400).difference(shapely.box(300, 0, 340, 60)), zonas[1]]
+    resultado = incremental.actualizar(zonas_habilitadas=zonas)
+
+    exacto = optimizar_paneles(zonas, restringidas, MODULO, 28, PITCH, PITCH, 1, **OPCIONES)
+    assert resultado['total_modules'] == exacto[1]
+    assert _mesas(incremental.layout) == _mesas(exacto[0])
@@ -0,0 +1,46 @@
+import threading
+
+import numpy as np
+
+from modules import instrumentation
+from modules.export_results import export_results
+from modules.layout import Layout
+
+
+def test_colectores_por_hilo():
+    # Concurrent jobs instrument themselves on their own threads (as in
+    # layout_service) and must not see each other's metrics
+    barrera = threading.Barrier(2)
+    resultados = {}
+
+    def trabajo(nombre, n):
+        with instrumentation.instrumentar() as inst:
+            barrera.wait()
+            for _ in range(n):
+                instrumentation.contar('evaluaciones')
+            with instrumentation.etapa(nombre):
+                barrera.wait()
+        resultados[nombre] = inst.resumen()
+
+    hilos = [threading.Thread(target=trabajo, args=(nombre, n))
+             for nombre, n in (('a', 3), ('b', 5))]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert resultados['a']['contadores'] == {'evaluaciones': 3}
+    assert resultados['b']['contadores'] == {'evaluaciones': 5}
+    assert list(resultados['a']['etapas']) == ['a']
+    assert list(resultados['b']['etapas']) == ['b']
+    assert instrumentation.actual() is None
+
+
+def test_escritores_informan_al_colector_del_trabajo(tmp_path):
+    lineas = Layout.desde_arrays(np.arange(4.0) * 5, np.zeros(4), np.zeros(4), np.arange(4),
+                                 np.zeros(4), 4.5, 30.0)
+    specs = {'PV Module Model': 'Test', 'stc': 550, 'Width (m)': 1.1, 'Length (m)': 2.2}
+    with instrumentation.instrumentar() as inst:
+        export_results(None, None, lineas, 4 * 28, 4 * 28 * 0.55, specs, 28, 5.0, '1V',
+                       28, 'test', output_dir=str(tmp_path), kmz=False, excel=False,
+                       atributos=True)
+    assert 'write_csv' in inst.resumen()['etapas']
@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+from modules import layout_service
+from modules.layout_service import ServicioLayout
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KML = os.path.join(RAIZ, 'data', 'Zona1.kml')
+
+# Jobs on one site run at the same time on the pool threads, with several
+# angles and engines so they prepare and rotate the site geometry together.
+# A crash there is a segfault, so the service runs in its own interpreter.
+_PETICIONES = textwrap.dedent('''
+    import json, sys
+    from modules.layout_service import ServicioLayout
+
+    servicio = ServicioLayout(max_workers=8, output_dir=sys.argv[2])
+    futuros = [servicio.enviar({{
+        'kml': sys.argv[1], 'module_id': 2, 'panels_x_module': 28,
+        'pitch_min': 3, 'pitch_max': 4 + 0.1 * i, 'pitch_step': 0.5,
+        'angulos': [0, 3, 6, 9, 12], 'motor': ('raster', 'scanline', 'vectorial')[i % 3]}})
+        for i in range({n})]
+    filas = [futuro.result() for futuro in futuros]
+    servicio.cerrar()
+    print(json.dumps([[fila['status'], fila['total_tables']] for fila in filas]))
+''')
+
+
+def test_peticiones_concurrentes_mismo_sitio(tmp_path):
+    n = 12
+    for ronda in range(3):
+        salida = subprocess.run(
+            [sys.executable, '-c', _PETICIONES.format(n=n), KML, str(tmp_path / str(ronda))],
+            cwd=RAIZ, capture_output=True, text=True, timeout=600)
+        assert salida.returncode == 0, salida.stderr[-2000:]
+        filas = json.loads(salida.stdout.strip().splitlines()[-1])
+        assert [estado for estado, _ in filas] == ['ok'] * n
+        # Same engine and swept pitches on the same site, same layout
+        assert filas[0][1] == filas[3][1] > 0
+
+
+class _Bloqueante:
+    """ejecutar_escenario stand-in that holds its worker until released or cancelled"""
+
+    def __init__(self):
+        self.liberar = threading.Event()
+        self.empezados = []
+
+    def __call__(self, escenario, directorio, formatos, cache_dir, cancelar=None):
+        self.empezados.append(escenario['name'])
+        while not (self.liberar.is_set() or cancelar.is_set()):
+            time.sleep(0.01)
+        return {'name': escenario['name'], 'status': 'cancelled' if cancelar.is_set() else 'ok'}
+
+
+def _en_hilo(funcion, *args):
+    """Run funcion on a thread and fail if it does not return in time"""
+    resultado = []
+    hilo = threading.Thread(target=lambda: resultado.append(funcion(*args)), daemon=True)
+    hilo.start()
+    hilo.join(timeout=10)
+    assert not hilo.is_alive(), f"{funcion.__name__} did not return"
+    return resultado[0] if resultado else None
+
+
+def _peticion(nombre, **extra):
+    return {'name': nombre, 'kml': KML, 'module_id': 2, **extra}
+
+
+def test_sesion_sustituye_peticion_en_cola(tmp_path, monkeypatch):
+    trabajo = _Bloqueante()
+    monkeypatch.setattr(layout_service, 'ejecutar_escenario', trabajo)
+    servicio = ServicioLayout(max_workers=1, output_dir=str(tmp_path))
+    try:
+        ocupado = servicio.enviar(_peticion('ocupado'))
+        primero = servicio.enviar(_peticion('primero', session='s'))
+        segundo = _en_hilo(servicio.enviar, _peticion('segundo', session='s'))
+        assert primero.cancelled()
+        assert servicio.estado()['sessions'] == 1
+        trabajo.liberar.set()
+        assert ocupado.result(timeout=10)['status'] == 'ok'
+        assert segundo.result(timeout=10)['name'] == 'segundo'
+        assert trabajo.empezados == ['ocupado', 'segundo']
+    finally:
+        trabajo.liberar.set()
+        _en_hilo(servicio.cerrar)
+    assert servicio.estado()['sessions'] == 0
+
+
+def test_cerrar_con_trabajos_en_cola(tmp_path, monkeypatch):
+    trabajo = _Bloqueante()
+    monkeypatch.setattr(layout_service, 'ejecutar_escenario', trabajo)
+    servicio = ServicioLayout(max_workers=1, output_dir=str(tmp_path))
+    corriendo = servicio.enviar(_peticion('corriendo', session='a'))
+    en_cola = [servicio.enviar(_peticion(f"cola_{i}", session=f"s{i}")) for i in range(3)]
+    _en_hilo(servicio.cerrar)
+    assert corriendo.result(timeout=1)['status'] == 'cancelled'
+    assert all(futuro.cancelled() for futuro in en_cola)
+    assert trabajo.empezados == ['corriendo']
+
+
+def test_kml_editado_no_reutiliza_el_resultado(tmp_path):
+    kml = tmp_path / 'sitio.kml'
+    shutil.copy(KML, kml)
+    peticion = {'kml': str(kml), 'module_id': 2, 'pitch_min': 4, 'pitch_max': 4}
+    servicio = ServicioLayout(max_workers=1, output_dir=str(tmp_path / 'salida'))
+    try:
+        assert servicio.enviar(peticion).result(timeout=120)['cached'] is False
+        assert servicio.enviar(peticion).result(timeout=120)['cached'] is True
+        sitios = servicio.estado()['sites']
+
+        estado = os.stat(kml)
+        os.utime(kml, ns=(estado.st_atime_ns, estado.st_mtime_ns + 10**9))
+        fila = servicio.enviar(peticion).result(timeout=120)
+        assert fila['status'] == 'ok' and fila['cached'] is False
+        assert servicio.estado()['sites'] == sitios + 1
+    finally:
+        servicio.cerrar()
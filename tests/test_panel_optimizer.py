@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import shapely
+
+from modules.panel_optimizer import optimizar_paneles
+
+MODULO = {'PV Module Model': 'Test', 'stc': 550, 'length': 2.278, 'width': 1.134}
+
+
+def _sitio():
+    """Concave zone with a hole, a second zone and small restricted zones"""
+    rng = np.random.default_rng(3)
+    angulos = np.sort(rng.uniform(0, 2 * np.pi, 40))
+    radios = 400 * rng.uniform(0.6, 1.0, 40)
+    principal = shapely.Polygon(np.c_[radios * np.cos(angulos), radios * np.sin(angulos)])
+    principal = principal.difference(shapely.Point(120, 40).buffer(60))
+    zonas = [principal, shapely.box(500, -100, 700, 150)]
+    puntos = shapely.points(rng.uniform(-400, 700, (60, 2)))
+    restringidas = list(shapely.buffer(puntos, rng.uniform(2, 12, 60), quad_segs=4))
+    return zonas, restringidas
+
+
+def _mesas(resultado):
+    mesas = resultado[0].mesas
+    return set(zip(np.round(mesas['x'], 6), np.round(mesas['y'], 6)))
+
+
+@pytest.mark.parametrize('opciones', [
+    {},
+    {'angulos': (0, 17), 'desfases_x': 2, 'desfases_y': 2},
+    {'modulos_entre_calles': 12, 'ancho_calle': 6, 'fenced_distance': 5},
+])
+@pytest.mark.parametrize('motor', ['scanline', 'raster'])
+def test_motores_coinciden_con_vectorial(motor, opciones):
+    zonas, restringidas = _sitio()
+    exacto = optimizar_paneles(zonas, restringidas, MODULO, 28, 3, 5, 0.5, **opciones)
+    resultado = optimizar_paneles(zonas, restringidas, MODULO, 28, 3, 5, 0.5, motor=motor,
+                                  **opciones)
+    assert resultado[1:4] == exacto[1:4]
+    assert _mesas(resultado) == _mesas(exacto)
+
+
+def test_raster_sin_refinar_es_subconjunto():
+    zonas, restringidas = _sitio()
+    exacto = optimizar_paneles(zonas, restringidas, MODULO, 28, 4, 4, 1)
+    cribado = optimizar_paneles(zonas, restringidas, MODULO, 28, 4, 4, 1, motor='raster',
+                                refinar_raster=False, resolucion_raster=1.0)
+    assert _mesas(cribado) <= _mesas(exacto)
+    assert cribado[1] > 0.9 * exacto[1]
+
+
+def test_lcoe_elige_pitch_interior():
+    zonas, restringidas = _sitio()
+    opciones = {'latitud': 40.0, 'longitud': -3.0}
+    _, _, _, pitch, _ = optimizar_paneles(zonas, restringidas, MODULO, 28, 2, 12, 0.5,
+                                          criterio='lcoe', opciones_rendimiento=opciones)
+    assert 2 < pitch < 12
+    # Without area cost the least shaded pitch wins
+    _, _, _, pitch, _ = optimizar_paneles(zonas, restringidas, MODULO, 28, 2, 12, 0.5,
+                                          criterio='lcoe',
+                                          opciones_rendimiento={**opciones, 'coste_ha': 0})
+    assert pitch == 12
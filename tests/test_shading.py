@@ -0,0 +1,32 @@
+import logging
+
+import pytest
+
+from modules.shading import ModeloRendimiento
+
+LATITUD, LONGITUD = 52.6, 13.4
+
+
+@pytest.mark.parametrize('latitud', [LATITUD, -LATITUD])
+def test_fixtilt_mira_al_ecuador_con_cualquier_angulo(latitud):
+    modelo = ModeloRendimiento(latitud, LONGITUD, {}, 2.278, racking='FixTilt')
+    # Rows running north-south (0) or east-west (90), no row shading
+    norte_sur, este_oeste = (modelo.rendimiento([1e6], angulo)[0] for angulo in (0, 90))
+    assert norte_sur == pytest.approx(este_oeste, rel=1e-9)
+    assert este_oeste > 1000
+
+
+def test_fixtilt_avisa_filas_fuera_de_este_oeste(caplog):
+    modelo = ModeloRendimiento(LATITUD, LONGITUD, {}, 2.278, racking='FixTilt')
+    with caplog.at_level(logging.WARNING, logger='modules.shading'):
+        modelo.rendimiento([4.0], 90)
+        assert not caplog.records
+        modelo.rendimiento([4.0, 5.0], 0)
+        modelo.rendimiento([6.0], 0)
+    assert len(caplog.records) == 1
+
+
+def test_sombra_baja_con_el_pitch():
+    modelo = ModeloRendimiento(LATITUD, LONGITUD, {}, 2.278, racking='FixTilt')
+    perdidas = modelo.perdida_sombra([2.0, 4.0, 8.0], 90)
+    assert perdidas[0] > perdidas[1] > perdidas[2] >= 0
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from modules.layout import Layout
+from modules.stringing import agrupar_strings
+
+MODULO = {'stc': 550}
+
+
+def _layout(zona, columna, fila):
+    """Tables of 4.5 x 30 m on a regular grid"""
+    columna, fila = np.asarray(columna), np.asarray(fila)
+    return Layout.desde_arrays(columna * 10.0 + 1000 * np.asarray(zona), fila * 30.0,
+                               zona, columna, fila, 4.5, 30.0)
+
+
+def test_una_mesa_sin_strings_completos():
+    # 10 modules, strings of 26: no whole string
+    agrupacion = agrupar_strings(_layout([0], [0], [0]), MODULO, 10, 26)
+    assert agrupacion.resumen() == {
+        'inverter_blocks': 0, 'combiner_boxes': 0, 'strings': 0, 'unstrung_modules': 10,
+        'string_cable_km': 0.0, 'dc_cable_km': 0.0}
+    assert agrupacion.mesas.tolist() == [(-1, -1, -1)]
+    assert len(agrupacion.contornos()) == 0
+
+
+def test_bloques_sin_strings_no_cuentan():
+    # Zone 0 holds 40 tables of 28 modules; zone 1 a single table, short of a string
+    columnas, filas = np.divmod(np.arange(40), 10)
+    layout = _layout(np.r_[np.zeros(40, int), 1], np.r_[columnas, 0], np.r_[filas, 0])
+    agrupacion = agrupar_strings(layout, MODULO, 28, 56, capacidad_bloque_kwp=200,
+                                 strings_por_caja=4)
+    resumen = agrupacion.resumen()
+    assert resumen['strings'] == 20
+    assert resumen['inverter_blocks'] == len(agrupacion.bloques) == 4
+    assert (agrupacion.bloques['strings'] > 0).all()
+    assert resumen['combiner_boxes'] == agrupacion.bloques['cajas'].sum() == 8
+    assert resumen['unstrung_modules'] == 28
+    assert tuple(agrupacion.mesas[-1]) == (-1, -1, -1)
+    assert (agrupacion.mesas['bloque'][:-1] >= 0).all()
+    assert len(agrupacion.contornos()) == 4
+
+
+@pytest.mark.parametrize('modules_per_string', [14, 28, 30])
+def test_strings_completos(modules_per_string):
+    columnas, filas = np.divmod(np.arange(60), 12)
+    agrupacion = agrupar_strings(_layout(np.zeros(60, int), columnas, filas), MODULO, 28,
+                                 modules_per_string, capacidad_bloque_kwp=300)
+    bloques = agrupacion.bloques
+    assert bloques['modulos'].sum() + agrupacion.resumen()['unstrung_modules'] == 60 * 28
+    assert (bloques['potencia_kwp'] <= 300).all()
+    assert len(agrupacion.strings) == bloques['strings'].sum()
+    assert (agrupacion.mesas['caja'] >= 0).sum() > 0